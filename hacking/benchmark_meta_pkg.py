@@ -0,0 +1,694 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2024, Jakob Meng <jakobmeng@web.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Offline benchmark for module jm1.pkg.meta_pkg.
+#
+# Package managers apt, dnf, dnf5 and yum are replaced with stand-in Python modules which are backed by synthetic
+# package databases, hence this benchmark runs on any Linux host without network access and without root privileges.
+# Packages are built natively and, if dpkg-deb or rpmbuild are available, with the external builder, too.
+#
+# Timings of each phase are compared against a baseline which has been stored with --update-baseline before. Phase
+# startup measures the import of the module and phase noop measures a module run where all meta packages have been
+# installed by the module before. The latter must not import Python bindings of package managers other than rpm.
+#
+# Usage: hacking/benchmark_meta_pkg.py [--sizes 1000,10000,100000] [--repeat 5] [--update-baseline]
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import argparse
+import contextlib
+import jinja2
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_BASELINE = os.path.join(REPO_DIR, '.cache', 'benchmark', 'baseline.json')
+
+MANAGERS = ['apt', 'dnf', 'dnf5', 'yum']
+
+# Number of meta packages which are probed, built and installed per run
+META_PKGS = 10
+
+# Bindings which a run of meta_pkg must not import if all meta packages have been installed before
+MANAGER_BINDINGS = ['apt', 'apt_pkg', 'dnf', 'libdnf5', 'yum']
+
+# Submodules of stand-in bindings which are imported by meta_pkg
+SUBMODULES = ['apt.debfile', 'apt.progress', 'apt.progress.base']
+
+
+def import_meta_pkg(tmp_dir):
+    # Make this repository importable as collection jm1.pkg without installing it
+    collections_dir = os.path.join(tmp_dir, 'collections')
+    os.makedirs(os.path.join(collections_dir, 'ansible_collections', 'jm1'))
+    os.symlink(REPO_DIR, os.path.join(collections_dir, 'ansible_collections', 'jm1', 'pkg'))
+    sys.path.insert(0, collections_dir)
+
+    from ansible_collections.jm1.pkg.plugins.modules import meta_pkg
+    return meta_pkg
+
+
+class Database(object):
+    """Synthetic database of installed packages, optionally with meta packages which have been installed before."""
+
+    def __init__(self, size, meta_pkgs=()):
+        self.packages = [('pkg%06d' % i, '1.%d' % (i % 10)) for i in range(size)]
+        self.packages.extend((pkg['name'], pkg['version']) for pkg in meta_pkgs)
+        self.fingerprints = dict((pkg['name'], pkg['fingerprint']) for pkg in meta_pkgs)
+
+    def description(self, name):
+        if name in self.fingerprints:
+            return 'Synthetic package for benchmarks.\n\njm1-pkg-fingerprint: %s' % self.fingerprints[name]
+        return 'Synthetic package for benchmarks.'
+
+    def write_dpkg_status(self, path):
+        with open(path, 'w') as f:
+            for name, version in self.packages:
+                fingerprint = 'Jm1-Pkg-Fingerprint: %s\n' % self.fingerprints[name] if name in self.fingerprints else ''
+                f.write('Package: {name}\n'
+                        'Status: install ok installed\n'
+                        'Priority: optional\n'
+                        'Section: misc\n'
+                        'Installed-Size: 42\n'
+                        'Maintainer: Nobody <nobody@example.com>\n'
+                        'Architecture: all\n'
+                        'Version: {version}\n'
+                        '{fingerprint}'
+                        'Description: Synthetic package {name}\n'
+                        ' Synthetic package for benchmarks.\n'
+                        '\n'.format(name=name, version=version, fingerprint=fingerprint))
+
+    def index(self):
+        # Building an index of all packages stands in for loading a package cache or sack
+        return dict(self.packages)
+
+
+def stand_in_bindings(db):
+    """Return stand-in modules for Python bindings of apt, apt_pkg, dnf, libdnf5, rpm and yum."""
+
+    class InstalledPkg(object):
+        def __init__(self, name, version):
+            self.name = name
+            self.version = version
+            self.description = 'Synthetic package for benchmarks.'
+            self.record = {}
+
+        def get_version(self):
+            return self.version
+
+        def get_description(self):
+            return self.description
+
+    # apt
+
+    class AptPackage(object):
+        def __init__(self, name, version):
+            self.name = name
+            self.installed = InstalledPkg(name, version) if version else None
+            self.is_installed = self.installed is not None
+            self.has_provides = False
+
+    class AptCache(object):
+        def __init__(self):
+            self.index = db.index()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def __contains__(self, name):
+            return name in self.index
+
+        def __getitem__(self, name):
+            return AptPackage(name, self.index[name])
+
+        def get_providing_packages(self, name):
+            return []
+
+        def is_virtual_package(self, name):
+            return False
+
+        @contextlib.contextmanager
+        def actiongroup(self):
+            yield
+
+        broken_count = 0
+
+        def get_changes(self):
+            # Dependencies of the synthetic meta packages are installed already
+            return []
+
+        def clear(self):
+            pass
+
+    class DebPackage(object):
+        def __init__(self, filename, cache=None):
+            self.filename = filename
+
+        def check(self):
+            return True
+
+    apt = types.ModuleType('apt')
+    apt.Cache = AptCache
+    apt.debfile = types.ModuleType('apt.debfile')
+    apt.debfile.DebPackage = DebPackage
+    apt.progress = types.ModuleType('apt.progress')
+    apt.progress.base = types.ModuleType('apt.progress.base')
+
+    apt_pkg = types.ModuleType('apt_pkg')
+    apt_pkg.config = types.SimpleNamespace(find_b=lambda name, default=False: default)
+    for name in ['pkgsystem_lock', 'pkgsystem_unlock', 'pkgsystem_lock_inner', 'pkgsystem_unlock_inner']:
+        setattr(apt_pkg, name, lambda: None)
+
+    # dnf
+
+    class DepsolveError(Exception):
+        pass
+
+    class DnfQuery(object):
+        def __init__(self, index, names=None):
+            self.index = index
+            self.names = names
+
+        def installed(self):
+            return self
+
+        def filter(self, name):
+            return DnfQuery(self.index, name if isinstance(name, list) else [name])
+
+        def run(self):
+            return [InstalledPkg(name, self.index[name]) for name in self.names or self.index if name in self.index]
+
+    class DnfBase(object):
+        def __init__(self):
+            self.index = None
+            self.sack = types.SimpleNamespace(query=lambda: DnfQuery(self.index))
+            self.transaction = types.SimpleNamespace(install_set=[])
+            self.conf = types.SimpleNamespace(
+                installroot='/', persistdir='/nonexistent',
+                substitutions=types.SimpleNamespace(update_from_etc=lambda installroot: None))
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def init_plugins(self):
+            pass
+
+        def pre_configure_plugins(self):
+            pass
+
+        def configure_plugins(self):
+            pass
+
+        def read_all_repos(self):
+            pass
+
+        def fill_sack(self, load_system_repo=True, load_available_repos=True):
+            self.index = db.index()
+
+        def add_remote_rpms(self, paths):
+            return [InstalledPkg(os.path.basename(path).rsplit('-', 2)[0], None) for path in paths]
+
+        def package_install(self, pkg):
+            pass
+
+        def package_reinstall(self, pkg):
+            pass
+
+        def remove(self, name):
+            pass
+
+        def resolve(self, allow_erasing=False):
+            pass
+
+        def download_packages(self, pkgs):
+            pass
+
+        def do_transaction(self):
+            pass
+
+    dnf = types.ModuleType('dnf')
+    dnf.Base = DnfBase
+    dnf.exceptions = types.SimpleNamespace(DepsolveError=DepsolveError)
+
+    # libdnf5
+
+    class RepoSack(object):
+        def __init__(self, base):
+            self.base = base
+
+        def create_repos_from_system_configuration(self):
+            pass
+
+        def load_repos(self, repo_type=None):
+            self.base.index = db.index()
+
+    class Dnf5Base(object):
+        def __init__(self):
+            self.index = None
+            self.config = types.SimpleNamespace(plugins=False)
+            self.repo_sack = RepoSack(self)
+
+        def get_config(self):
+            return self.config
+
+        def load_config(self):
+            pass
+
+        def setup(self):
+            pass
+
+        def get_repo_sack(self):
+            return self.repo_sack
+
+    class PackageQuery(object):
+        def __init__(self, base):
+            self.base = base
+            self.names = None
+
+        def filter_installed(self):
+            pass
+
+        def filter_name(self, names):
+            self.names = names if isinstance(names, list) else [names]
+
+        def empty(self):
+            return not list(self)
+
+        def __iter__(self):
+            return iter([InstalledPkg(name, self.base.index[name]) for name in self.names if name in self.base.index])
+
+    class Dnf5Transaction(object):
+        def get_problems(self):
+            return 0
+
+        def download(self):
+            pass
+
+        def run(self):
+            return 0
+
+    class Goal(object):
+        def __init__(self, base):
+            pass
+
+        def add_install(self, path):
+            pass
+
+        def add_reinstall(self, path):
+            pass
+
+        def add_rpm_remove(self, name, settings):
+            pass
+
+        def resolve(self):
+            return Dnf5Transaction()
+
+    class GoalJobSettings(object):
+        def set_clean_requirements_on_remove(self, value):
+            pass
+
+    libdnf5 = types.ModuleType('libdnf5')
+    libdnf5.base = types.SimpleNamespace(Base=Dnf5Base, Goal=Goal, GoalJobSettings=GoalJobSettings,
+                                         GoalProblem_NO_PROBLEM=0,
+                                         Transaction=types.SimpleNamespace(TransactionRunResult_SUCCESS=0,
+                                                                           TransactionRunResult_ERROR_LOCK=1))
+    libdnf5.repo = types.SimpleNamespace(Repo=types.SimpleNamespace(Type_SYSTEM='system', Type_AVAILABLE='available'))
+    libdnf5.rpm = types.SimpleNamespace(PackageQuery=PackageQuery)
+
+    # rpm
+
+    class TransactionSet(object):
+        def __init__(self):
+            # Opening the rpm database is cheap because it is indexed by name
+            self.index = rpm_index
+
+        def dbMatch(self, tag, name):
+            if name not in self.index:
+                return []
+            return [{rpm.RPMTAG_VERSION: self.index[name].encode('utf-8'),
+                     rpm.RPMTAG_DESCRIPTION: db.description(name).encode('utf-8')}]
+
+        def closeDB(self):
+            pass
+
+    rpm_index = db.index()
+    rpm = types.ModuleType('rpm')
+    rpm.RPMTAG_VERSION = 1001
+    rpm.RPMTAG_DESCRIPTION = 1005
+    rpm.TransactionSet = TransactionSet
+
+    # yum
+
+    class RpmDB(object):
+        def __init__(self):
+            self.index = db.index()
+
+        def searchNevra(self, name, ver=None):
+            if name not in self.index:
+                return []
+            return [InstalledPkg(name, self.index[name])]
+
+    class YumBase(object):
+        def __init__(self):
+            self.rpmdb = RpmDB()
+            self.preconf = types.SimpleNamespace()
+            self.conf = types.SimpleNamespace()
+
+        def installLocal(self, pkg):
+            pass
+
+        def reinstallLocal(self, pkg):
+            pass
+
+        def remove(self, name):
+            pass
+
+        def buildTransaction(self):
+            return 2, []
+
+        def doLock(self):
+            pass
+
+        def doUnlock(self):
+            pass
+
+        def processTransaction(self):
+            pass
+
+    class LockError(Exception):
+        pass
+
+    yum = types.ModuleType('yum')
+    yum.YumBase = YumBase
+    yum.Errors = types.SimpleNamespace(LockError=LockError)
+
+    return dict(apt=apt, apt_pkg=apt_pkg, dnf=dnf, libdnf5=libdnf5, rpm=rpm, yum=yum)
+
+
+class Module(object):
+    """Stand-in for AnsibleModule which skips commands of package managers but runs dpkg-deb and rpmbuild."""
+
+    check_mode = False
+
+    def __init__(self, **params):
+        self.params = params
+
+    def run_command(self, cmd, check_rc=False, cwd=None, environ_update=None):
+        import subprocess
+
+        if not cmd.startswith(('dpkg-deb ', 'rpmbuild ', 'sh ')):
+            return 0, '', ''
+
+        process = subprocess.Popen(cmd, shell=True, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   universal_newlines=True)
+        stdout, stderr = process.communicate()
+        if check_rc and process.returncode:
+            raise RuntimeError('%s failed: %s' % (cmd, stderr))
+        return process.returncode, stdout, stderr
+
+    def get_bin_path(self, name):
+        return shutil.which(name)
+
+    def fail_json(self, msg, **kwargs):
+        raise RuntimeError(msg)
+
+    def warn(self, msg):
+        print('WARNING: %s' % msg, file=sys.stderr)
+
+    def debug(self, msg):
+        pass
+
+
+def meta_pkgs(manager):
+    from ansible_collections.jm1.pkg.plugins.module_utils import build
+
+    pkgs = []
+    for i in range(META_PKGS):
+        pkg = dict(
+            architecture='all' if manager == 'apt' else 'noarch',
+            conflicts=[],
+            depends=['pkg%06d' % j for j in range(i, i + 10)],
+            description='Meta package for benchmarks.',
+            enhances=[],
+            maintainer='Nobody <nobody@example.com>',
+            name='meta-bench%02d' % i,
+            recommends=[],
+            suggests=[],
+            summary='Meta package for benchmarks',
+            version='1')
+        pkg['fingerprint'] = build.fingerprint(
+            pkg['conflicts'], pkg['depends'], pkg['enhances'], pkg['recommends'], pkg['suggests'])
+        pkgs.append(pkg)
+    return pkgs
+
+
+def core_params(manager, pkgs, stamp_dir):
+    """Return parameters of module meta_pkg which install pkgs."""
+    return dict(
+        architecture=None,
+        artifact_cache='',
+        artifact_cache_max_age=0,
+        artifact_cache_max_size=0,
+        artifacts=None,
+        build_on_controller=False,
+        builder='native',
+        cache_only=False,
+        conflicts=[],
+        depends=[],
+        description=None,
+        enhances=[],
+        lock_timeout=0,
+        maintainer='Nobody <nobody@example.com>',
+        manager=manager,
+        metadata_max_age=None,
+        name=None,
+        packages=[dict((key, value) for key, value in pkg.items() if key != 'fingerprint') for pkg in pkgs],
+        plugins=False,
+        profile=None,
+        publish_to=None,
+        recommends=[],
+        request_artifacts=False,
+        stamp_dir=stamp_dir,
+        state='present',
+        suggests=[],
+        summary=None,
+        version='1')
+
+
+def measure(function, repeat):
+    """Return the best wall time in seconds of repeat calls of function and its last result."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def measure_startup(repeat, tmp_dir):
+    """Return the best wall time in seconds of importing module meta_pkg in a new Python interpreter."""
+    code = ('import sys, time; sys.path.insert(0, sys.argv[1]); start = time.time(); '
+            'from ansible_collections.jm1.pkg.plugins.modules import meta_pkg; print(time.time() - start)')
+    return min(float(subprocess.check_output([sys.executable, '-c', code, os.path.join(tmp_dir, 'collections')]))
+               for _ in range(repeat))
+
+
+def noop(meta_pkg, manager, size, pkgs, repeat, tmp_dir):
+    """Return the best wall time of module runs where pkgs have been installed before and bindings which were imported.
+
+    Stand-in bindings are available, but bindings of the package manager must not be imported in such runs.
+    """
+    db = Database(size, pkgs)
+    dpkg_status_path = os.path.join(tmp_dir, 'status-noop-%d' % size)
+    if not os.path.exists(dpkg_status_path):
+        db.write_dpkg_status(dpkg_status_path)
+
+    stamp_dir = os.path.join(tmp_dir, 'stamps-%s-%d' % (manager, size))
+    module = Module(**core_params(manager, pkgs, stamp_dir))
+    for pkg in pkgs:
+        meta_pkg.write_stamp(stamp_dir, manager, pkg, module)
+
+    original = dict((name, getattr(meta_pkg, name)) for name in ['DPKG_STATUS_PATH', 'rpm'] + MANAGER_BINDINGS)
+    original_modules = dict((name, sys.modules.get(name)) for name in ['rpm'] + MANAGER_BINDINGS + SUBMODULES)
+    meta_pkg.DPKG_STATUS_PATH = dpkg_status_path
+    bindings = stand_in_bindings(db)
+    sys.modules.update(bindings)
+    sys.modules.update({
+        'apt.debfile': bindings['apt'].debfile,
+        'apt.progress': bindings['apt'].progress,
+        'apt.progress.base': bindings['apt'].progress.base,
+    })
+    try:
+        def run():
+            for name in ['rpm'] + MANAGER_BINDINGS:
+                setattr(meta_pkg, name, None)
+            result = meta_pkg.core(module)
+            if result['changed']:
+                raise RuntimeError('no-op run of meta_pkg for %s has changed packages' % manager)
+            return [name for name in MANAGER_BINDINGS if getattr(meta_pkg, name) is not None]
+        return measure(run, repeat)
+    finally:
+        for name, value in original.items():
+            setattr(meta_pkg, name, value)
+        for name, value in original_modules.items():
+            if value is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = value
+
+
+def benchmark(meta_pkg, manager, size, repeat, tmp_dir):
+    timings = {}
+    imported = []
+
+    db = Database(size)
+    dpkg_status_path = os.path.join(tmp_dir, 'status-%d' % size)
+    if not os.path.exists(dpkg_status_path):
+        db.write_dpkg_status(dpkg_status_path)
+    meta_pkg.DPKG_STATUS_PATH = dpkg_status_path
+
+    bindings = stand_in_bindings(db)
+    for name, binding in bindings.items():
+        setattr(meta_pkg, name, binding)
+        sys.modules[name] = binding
+
+    module = Module(plugins=False)
+    pkgs = meta_pkgs(manager)
+    names = [pkg['name'] for pkg in pkgs]
+    artifact_cache = meta_pkg.ArtifactCache('', 0, 0, module)
+    make = meta_pkg.make_deb if manager == 'apt' else meta_pkg.make_rpm
+    meta_pkg.get_rpm_dist = lambda cwd, module: '.bench'
+
+    timings['detection'], _ = measure(lambda: meta_pkg.probe_manager(module), repeat)
+    timings['probe'], _ = measure(lambda: meta_pkg.probe_installed(manager, names), repeat)
+
+    if manager == 'apt':
+        timings['render'], _ = measure(lambda: meta_pkg.render_control(**pkgs[0]), repeat)
+    else:
+        fields = dict(pkgs[0], changelog_date='Mon Jan 01 2024')
+        timings['render'], _ = measure(lambda: jinja2.Template(meta_pkg.RPM_SPEC_TEMPLATE).render(**fields), repeat)
+
+    builders = ['native']
+    if shutil.which('dpkg-deb' if manager == 'apt' else 'rpmbuild'):
+        builders.append('external')
+
+    build_dir = os.path.join(tmp_dir, 'build-%s-%d' % (manager, size))
+    for builder in builders:
+        def build():
+            shutil.rmtree(build_dir, ignore_errors=True)
+            os.makedirs(build_dir)
+            return [make(artifact_cache=artifact_cache, builder=builder, cwd=build_dir, manager=manager, module=module,
+                         timings=meta_pkg.Timings(), **pkg) for pkg in pkgs]
+        timings['build_%s' % builder], paths = measure(build, repeat)
+
+    # Packages have been built in the build phase already, so the transaction phase measures the package manager only
+    built = dict(zip(names, paths))
+    original_make = make
+    setattr(meta_pkg, original_make.__name__, lambda name, **kwargs: built[name])
+    try:
+        timings['transaction'], _ = measure(
+            lambda: meta_pkg.install(
+                pkgs, artifact_cache, 'native', manager, False, False, None, meta_pkg.LockWaiter(0, module),
+                meta_pkg.Timings(), False, module), repeat)
+    finally:
+        setattr(meta_pkg, original_make.__name__, original_make)
+
+    # Removal of meta packages which are absent already must not load any package cache or sack
+    timings['remove_absent'], _ = measure(
+        lambda: meta_pkg.remove(
+            manager, names, False, False, None, meta_pkg.LockWaiter(0, module), meta_pkg.Timings(), False, module),
+        repeat)
+
+    timings['noop'], imported = noop(meta_pkg, manager, size, pkgs, repeat, tmp_dir)
+
+    return timings, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark for module jm1.pkg.meta_pkg')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help='path of the baseline file (default: %(default)s)')
+    parser.add_argument('--managers', default=','.join(MANAGERS),
+                        help='comma-separated list of package managers (default: %(default)s)')
+    parser.add_argument('--repeat', default=5, type=int,
+                        help='number of runs per phase, the best run is reported (default: %(default)s)')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma-separated list of sizes of the synthetic package databases (default: %(default)s)')
+    parser.add_argument('--tolerance', default=2.0, type=float,
+                        help='factor by which a phase may be slower than the baseline (default: %(default)s)')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store timings as new baseline instead of comparing against it')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='jm1-pkg-benchmark-')
+    try:
+        meta_pkg = import_meta_pkg(tmp_dir)
+
+        results = dict(startup=dict(import_module=measure_startup(args.repeat, tmp_dir)))
+        print('%-12s import_module=%.4fs' % ('startup', results['startup']['import_module']))
+
+        regressions = []
+        for size in [int(size) for size in args.sizes.split(',')]:
+            for manager in args.managers.split(','):
+                key = '%s/%d' % (manager, size)
+                results[key], imported = benchmark(meta_pkg, manager, size, args.repeat, tmp_dir)
+                print('%-12s %s' % (key, '  '.join('%s=%.4fs' % item for item in sorted(results[key].items()))))
+                if imported:
+                    regressions.append('%s noop: imported bindings %s' % (key, ', '.join(imported)))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if regressions:
+        for regression in regressions:
+            print('REGRESSION %s' % regression)
+        return 1
+
+    if args.update_baseline:
+        if not os.path.isdir(os.path.dirname(args.baseline)):
+            os.makedirs(os.path.dirname(args.baseline))
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+        print('Baseline stored in %s' % args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('No baseline found at %s, run with --update-baseline first' % args.baseline)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    for key, timings in sorted(results.items()):
+        for phase, elapsed in sorted(timings.items()):
+            expected = baseline.get(key, {}).get(phase)
+            # Phases which are too fast to be measured reliably are compared against a floor of 5ms
+            if expected is not None and elapsed > max(expected, 0.005) * args.tolerance:
+                regressions.append('%s %s: %.4fs, baseline %.4fs' % (key, phase, elapsed, expected))
+
+    for regression in regressions:
+        print('REGRESSION %s' % regression)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2024, Jakob Meng <jakobmeng@web.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Offline check of the native writer for Debian packages in module_utils deb.
+#
+# Meta packages are built twice with the native writer, both builds must be byte-identical. Each package is then
+# inspected with dpkg-deb --info and dpkg-deb --contents which must succeed, report the control fields which have been
+# rendered and list no payload besides the root directory. The native writer must not import jinja2, because it is not
+# required on managed hosts. Requires dpkg-deb, but neither network access nor root privileges.
+#
+# Usage: hacking/check_deb_writer.py
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PACKAGES = [
+    dict(),
+    dict(name='jm1-check-relations',
+         conflicts=['nano'],
+         depends=['python3', 'python3-jinja2 (>= 2.10)', 'vim | emacs'],
+         enhances=['dpkg'],
+         recommends=['bash-completion'],
+         suggests=['git'],
+         version='2.3-1'),
+    dict(name='jm1-check-description',
+         description=('A long description which exceeds the line width of control files and hence has to be wrapped '
+                      'across several continuation lines by the template, including an empty line.\n\nSecond '
+                      'paragraph.'),
+         summary='Meta package with a long description',
+         version='1:0.1~rc1'),
+]
+
+
+def import_build(tmp_dir):
+    # Make this repository importable as collection jm1.pkg without installing it
+    collections_dir = os.path.join(tmp_dir, 'collections')
+    os.makedirs(os.path.join(collections_dir, 'ansible_collections', 'jm1'))
+    os.symlink(REPO_DIR, os.path.join(collections_dir, 'ansible_collections', 'jm1', 'pkg'))
+    sys.path.insert(0, collections_dir)
+
+    from ansible_collections.jm1.pkg.plugins.module_utils import build
+    return build
+
+
+def dpkg_deb(*args):
+    process = subprocess.Popen(['dpkg-deb'] + list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               universal_newlines=True)
+    stdout, stderr = process.communicate()
+    return process.returncode, stdout, stderr
+
+
+def check(build, pkg, tmp_dir):
+    """Return a list of errors of the Debian package built natively for meta package pkg."""
+    key, suffix, make = build.native_artifact('apt', None, pkg)
+
+    first = make()
+    # Timestamps must not leak into packages, hence the second build is delayed past a change of seconds
+    time.sleep(1.1)
+    second = make()
+
+    errors = []
+    if first != second:
+        errors.append('builds are not byte-identical')
+
+    path = os.path.join(tmp_dir, pkg['name'] + suffix)
+    with open(path, 'wb') as f:
+        f.write(first)
+
+    rc, stdout, stderr = dpkg_deb('--info', path)
+    if rc != 0:
+        errors.append('dpkg-deb --info failed with rc %d: %s' % (rc, stderr.strip()))
+    else:
+        for field, value in [('Package', pkg['name']),
+                             ('Version', pkg['version']),
+                             ('Architecture', pkg['architecture']),
+                             (build.DEB_FINGERPRINT_FIELD, pkg['fingerprint'])]:
+            if ' %s: %s\n' % (field, value) not in stdout:
+                errors.append('dpkg-deb --info does not report %s: %s' % (field, value))
+
+    rc, stdout, stderr = dpkg_deb('--field', path, 'Depends')
+    if rc != 0:
+        errors.append('dpkg-deb --field failed with rc %d: %s' % (rc, stderr.strip()))
+    elif stdout.strip() != ', '.join(pkg['depends']):
+        errors.append('dpkg-deb --field reports Depends: %s' % stdout.strip())
+
+    rc, stdout, stderr = dpkg_deb('--contents', path)
+    if rc != 0:
+        errors.append('dpkg-deb --contents failed with rc %d: %s' % (rc, stderr.strip()))
+    else:
+        # Like packages built with dpkg-deb --build, the payload consists of the root directory only
+        payload = [line.split()[-1] for line in stdout.splitlines() if line.split()[-1] != './']
+        if payload:
+            errors.append('dpkg-deb --contents lists a payload: %s' % ', '.join(payload))
+
+    return errors
+
+
+def main():
+    if not shutil.which('dpkg-deb'):
+        print('dpkg-deb is not available', file=sys.stderr)
+        return 2
+
+    tmp_dir = tempfile.mkdtemp(prefix='jm1-pkg-check-deb-')
+    try:
+        build = import_build(tmp_dir)
+
+        defaults = dict(build.PKG_DEFAULTS, architecture='all', maintainer='Jakob Meng <jakobmeng@web.de>',
+                        name='jm1-check-defaults')
+        failed = False
+        for pkg in build.meta_packages(defaults, PACKAGES):
+            errors = check(build, pkg, tmp_dir)
+            print('%-24s %s' % (pkg['name'], 'ok' if not errors else 'FAILED'))
+            for error in errors:
+                print('  %s' % error)
+            failed = failed or bool(errors)
+
+        if 'jinja2' in sys.modules:
+            print('native writer imported jinja2')
+            failed = True
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2024, Jakob Meng <jakobmeng@web.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Offline check of the native writer for RPM packages in module_utils rpm.
+#
+# Meta packages are built twice with the native writer and the same build time, both builds must be byte-identical.
+# Headers of each package are read back, its relationships must match the meta package, the digests in the signature
+# header must match header and payload and rpmlib(RichDependencies) must be required if and only if any relationship is
+# a rich dependency. If rpm is available, each package is inspected with rpm --query and rpmkeys --checksig, too, which
+# must succeed and report the relationships of the meta package. Requires neither network access nor root privileges.
+#
+# Usage: hacking/check_rpm_writer.py
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DIST = '.fc39'
+
+BUILDTIME = 1704110400  # Mon Jan 01 2024 12:00:00 UTC
+
+PACKAGES = [
+    dict(),
+    dict(name='jm1-check-relations',
+         conflicts=['nano < 7'],
+         depends=['python3', 'python3-jinja2 >= 2.10', 'make = 4.4'],
+         enhances=['dnf'],
+         recommends=['bash-completion'],
+         suggests=['git > 2'],
+         version='2.3'),
+]
+
+# A rich dependency in each relationship tag on its own
+PACKAGES.extend(
+    dict({'name': 'jm1-check-rich-' + key, key: ['(vim or emacs)']})
+    for key in ['conflicts', 'depends', 'enhances', 'recommends', 'suggests'])
+
+# Query tags of rpm by relationship
+QUERY_TAGS = dict(
+    conflicts='--conflicts',
+    depends='--requires',
+    enhances='--enhances',
+    recommends='--recommends',
+    suggests='--suggests',
+)
+
+OPERATORS = {2: '<', 4: '>', 8: '=', 10: '<=', 12: '>='}
+
+
+def import_rpm(tmp_dir):
+    # Make this repository importable as collection jm1.pkg without installing it
+    collections_dir = os.path.join(tmp_dir, 'collections')
+    os.makedirs(os.path.join(collections_dir, 'ansible_collections', 'jm1'))
+    os.symlink(REPO_DIR, os.path.join(collections_dir, 'ansible_collections', 'jm1', 'pkg'))
+    sys.path.insert(0, collections_dir)
+
+    from ansible_collections.jm1.pkg.plugins.module_utils import build, rpm
+    return build, rpm
+
+
+def run(*args):
+    process = subprocess.Popen(list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    stdout, stderr = process.communicate()
+    return process.returncode, stdout, stderr
+
+
+def format_relationship(relationship):
+    """Return relationship (name, flags, version) like rpm --query prints it."""
+    name, flags, version = relationship
+    if not version:
+        return name
+    return '%s %s %s' % (name, OPERATORS[flags & 14], version)
+
+
+def check(build, rpm, pkg, tmp_dir):
+    """Return a list of errors of the RPM package built natively for meta package pkg."""
+    fields = dict((key, pkg[key]) for key in build.PKG_DEFAULTS)
+    fields.update(
+        description='%s\n\n%s%s' % (pkg['description'], build.RPM_FINGERPRINT_PREFIX, pkg['fingerprint']),
+        release='1' + DIST)
+
+    first = rpm.make_rpm_archive(buildtime=BUILDTIME, **fields)
+    second = rpm.make_rpm_archive(buildtime=BUILDTIME, **fields)
+
+    errors = []
+    if first != second:
+        errors.append('builds are not byte-identical')
+
+    path = os.path.join(tmp_dir, rpm.rpm_filename(fields['architecture'], pkg['name'], fields['release'],
+                                                  pkg['version']))
+    with open(path, 'wb') as f:
+        f.write(first)
+
+    signature, header, (start, end) = rpm.read_rpm_header(path)
+    if header[rpm.RPMTAG_NAME] != pkg['name'] or header[rpm.RPMTAG_VERSION] != pkg['version']:
+        errors.append('header reports %s-%s' % (header[rpm.RPMTAG_NAME], header[rpm.RPMTAG_VERSION]))
+
+    if signature[rpm.RPMSIGTAG_SHA256] != hashlib.sha256(first[start:end]).hexdigest():
+        errors.append('SHA256 digest of header does not match')
+    if signature[rpm.RPMSIGTAG_MD5] != hashlib.md5(first[start:]).digest():
+        errors.append('MD5 digest of header and payload does not match')
+
+    expected = dict((key, [rpm.parse_relationship(relationship) for relationship in pkg[key]])
+                    for key in QUERY_TAGS)
+    if any(name.startswith('(') for value in expected.values() for name, flags, version in value):
+        expected['depends'].append(
+            ('rpmlib(RichDependencies)', rpm.RPMSENSE_RPMLIB | rpm.RPMSENSE_LESS | rpm.RPMSENSE_EQUAL, '4.12.0-1'))
+
+    for key, tags in [('conflicts', (rpm.RPMTAG_CONFLICTNAME, rpm.RPMTAG_CONFLICTFLAGS, rpm.RPMTAG_CONFLICTVERSION)),
+                      ('depends', (rpm.RPMTAG_REQUIRENAME, rpm.RPMTAG_REQUIREFLAGS, rpm.RPMTAG_REQUIREVERSION)),
+                      ('enhances', (rpm.RPMTAG_ENHANCENAME, rpm.RPMTAG_ENHANCEFLAGS, rpm.RPMTAG_ENHANCEVERSION)),
+                      ('recommends', (rpm.RPMTAG_RECOMMENDNAME, rpm.RPMTAG_RECOMMENDFLAGS,
+                                      rpm.RPMTAG_RECOMMENDVERSION)),
+                      ('suggests', (rpm.RPMTAG_SUGGESTNAME, rpm.RPMTAG_SUGGESTFLAGS, rpm.RPMTAG_SUGGESTVERSION))]:
+        actual = rpm.header_relationships(header, *tags)
+        if actual != expected[key]:
+            errors.append('header reports %s: %s' % (key, actual))
+
+    if not shutil.which('rpm'):
+        return errors
+
+    rc, stdout, stderr = run('rpm', '--query', '--package', '--queryformat', '%{NAME} %{VERSION} %{RELEASE}', path)
+    if rc != 0:
+        errors.append('rpm --query failed with rc %d: %s' % (rc, stderr.strip()))
+    elif stdout != '%s %s %s' % (pkg['name'], pkg['version'], fields['release']):
+        errors.append('rpm --query reports %s' % stdout)
+
+    for key, option in sorted(QUERY_TAGS.items()):
+        rc, stdout, stderr = run('rpm', '--query', '--package', option, path)
+        if rc != 0:
+            errors.append('rpm --query %s failed with rc %d: %s' % (option, rc, stderr.strip()))
+        elif sorted(stdout.splitlines()) != sorted(format_relationship(value) for value in expected[key]):
+            errors.append('rpm --query %s reports %s' % (option, ', '.join(stdout.splitlines())))
+
+    rc, stdout, stderr = run('rpmkeys', '--checksig', path)
+    if rc != 0:
+        errors.append('rpmkeys --checksig failed with rc %d: %s' % (rc, (stdout + stderr).strip()))
+
+    return errors
+
+
+def main():
+    if not shutil.which('rpm'):
+        print('rpm is not available, packages are checked with read_rpm_header() only', file=sys.stderr)
+
+    tmp_dir = tempfile.mkdtemp(prefix='jm1-pkg-check-rpm-')
+    try:
+        build, rpm = import_rpm(tmp_dir)
+
+        defaults = dict(build.PKG_DEFAULTS, architecture='noarch', maintainer='Jakob Meng <jakobmeng@web.de>',
+                        name='jm1-check-defaults')
+        failed = False
+        for pkg in build.meta_packages(defaults, PACKAGES):
+            errors = check(build, rpm, pkg, tmp_dir)
+            print('%-28s %s' % (pkg['name'], 'ok' if not errors else 'FAILED'))
+            for error in errors:
+                print('  %s' % error)
+            failed = failed or bool(errors)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
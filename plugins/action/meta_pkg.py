@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2024, Jakob Meng <jakobmeng@web.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Action plugin for module jm1.pkg.meta_pkg which passes the package manager from already gathered facts to the
+# module, so that the module does not have to detect the package manager on the managed host.
+#
+# Meta packages are built natively on the controller, once per package manager, distribution tag and package content,
+# and are passed base64 encoded to the module with its arguments. Forks which build the same package concurrently wait
+# for each other using a lock file, hence all managed hosts share a single build. Packages are built and passed to the
+# module only if the module reports that meta packages have to be installed, so no-op runs do not transfer packages.
+# The module reports the maintainer and the distribution tag of the managed host, too, so the keys of the packages
+# match.
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import base64
+import errno
+import fcntl
+import os
+import time
+
+from ansible import constants as C
+from ansible.module_utils._text import to_text
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.module_utils.six import string_types
+from ansible.plugins.action import ActionBase
+from ansible.utils.vars import merge_hash
+from ansible_collections.jm1.pkg.plugins.module_utils.build import (
+    PKG_DEFAULTS,
+    meta_packages,
+    native_artifact,
+)
+from ansible_collections.jm1.pkg.plugins.module_utils.package_index import is_glob
+
+SUPPORTED_MANAGERS = ['apt', 'dnf', 'dnf5', 'yum']
+
+# Distribution tags, i.e. rpm macro %dist, by fact distribution, for meta packages which are built up front. A wrong tag
+# does no harm, because then the module will not find a matching package and builds it on the managed host instead.
+RPM_DIST_TAGS = dict(
+    AlmaLinux='.el{major}',
+    Amazon='.amzn{major}',
+    CentOS='.el{major}',
+    Fedora='.fc{major}',
+    OracleLinux='.el{major}',
+    RedHat='.el{major}',
+    Rocky='.el{major}',
+)
+
+# Distribution tags which do not follow RPM_DIST_TAGS, by fact distribution and major version
+RPM_DIST_TAG_EXCEPTIONS = {
+    ('CentOS', '7'): '.el7.centos',
+}
+
+# Fields of meta packages with their aliases
+PKG_FIELD_ALIASES = dict(
+    architecture=['buildarch'],
+    maintainer=['packager'],
+    summary=['synopsis'],
+)
+
+RELATIONSHIPS = ['conflicts', 'depends', 'enhances', 'recommends', 'suggests']
+
+
+def rpm_dist_from_facts(facts):
+    distribution = facts.get('distribution')
+    major = facts.get('distribution_major_version')
+    if (distribution, major) in RPM_DIST_TAG_EXCEPTIONS:
+        return RPM_DIST_TAG_EXCEPTIONS[(distribution, major)]
+
+    dist_tag = RPM_DIST_TAGS.get(distribution)
+    if not dist_tag or not major:
+        return None
+    return dist_tag.format(major=major)
+
+
+def pkg_fields(args):
+    """Return fields of a meta package from args, converted like the module's argument spec does, None if undefined."""
+    fields = {}
+    for key in PKG_DEFAULTS:
+        value = None
+        for name in [key] + PKG_FIELD_ALIASES.get(key, []):
+            if args.get(name) is not None:
+                value = args[name]
+                break
+
+        if value is None:
+            fields[key] = None
+        elif key in RELATIONSHIPS:
+            fields[key] = value.split(',') if isinstance(value, string_types) else list(value)
+        else:
+            fields[key] = to_text(value)
+    return fields
+
+
+def build_artifact(cache_dir, key, suffix, build):
+    """Return package with key from cache_dir or build it, concurrent builds of the same package are serialized."""
+    pkg_path = os.path.join(cache_dir, key + suffix)
+    if not os.path.exists(pkg_path):
+        try:
+            os.makedirs(cache_dir, mode=0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        with open(pkg_path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if not os.path.exists(pkg_path):
+                tmp_path = '%s.%d.tmp' % (pkg_path, os.getpid())
+                with open(tmp_path, 'wb') as f:
+                    f.write(build())
+                # rename is atomic, hence other forks will never see partially written packages
+                os.rename(tmp_path, pkg_path)
+
+    with open(pkg_path, 'rb') as f:
+        return f.read()
+
+
+class ActionModule(ActionBase):
+
+    def _is_buildable(self, module_args):
+        """Return whether meta packages can be built on the controller at all."""
+        if module_args.get('manager') not in SUPPORTED_MANAGERS \
+                or module_args.get('state', 'present') != 'present' \
+                or module_args.get('builder', 'native') != 'native' \
+                or self._play_context.check_mode:
+            return False
+
+        # Wildcards are expanded against packages of the managed host
+        packages = module_args.get('packages')
+        items = [pkg_fields(module_args)] + ([] if packages is None else [pkg_fields(item) for item in packages])
+        return not any(is_glob(relationship)
+                       for item in items for key in RELATIONSHIPS for relationship in (item[key] or []))
+
+    def _controller_pkgs(self, module_args, maintainer):
+        """Return meta packages like the module defines them, with maintainer as default maintainer."""
+        defaults = dict(PKG_DEFAULTS)
+        defaults.update((key, value) for key, value in pkg_fields(module_args).items() if value is not None)
+        if not defaults['architecture']:
+            defaults['architecture'] = 'all' if module_args['manager'] == 'apt' else 'noarch'
+        defaults['maintainer'] = maintainer
+
+        packages = module_args.get('packages')
+        return meta_packages(defaults, None if packages is None else [pkg_fields(item) for item in packages])
+
+    def _build_on_controller(self, manager, dist, pkgs):
+        """Build meta packages on the controller and return them base64 encoded by their keys."""
+        cache_dir = os.path.join(C.DEFAULT_LOCAL_TMP, 'jm1-pkg')
+        artifacts = {}
+        for pkg in pkgs:
+            key, suffix, build = native_artifact(manager, dist, pkg)
+            artifacts[key] = base64.b64encode(build_artifact(cache_dir, key, suffix, build)).decode('ascii')
+        return artifacts
+
+    def run(self, tmp=None, task_vars=None):
+        if task_vars is None:
+            task_vars = dict()
+
+        result = super(ActionModule, self).run(tmp, task_vars)
+        del tmp  # tmp no longer has any effect
+
+        module_args = self._task.args.copy()
+
+        detection = None
+        if module_args.get('manager', 'auto') == 'auto':
+            start = time.time()
+            pkg_mgr = task_vars.get('ansible_facts', {}).get('pkg_mgr')
+            if pkg_mgr in SUPPORTED_MANAGERS:
+                module_args['manager'] = pkg_mgr
+                detection = dict(source='facts', elapsed=time.time() - start)
+
+        wrap_async = self._task.async_val and not self._connection.has_native_async
+
+        controller_build = None
+        is_buildable = boolean(module_args.get('build_on_controller', True), strict=False) and \
+            self._is_buildable(module_args)
+        if is_buildable and (wrap_async or module_args.get('publish_to') or module_args.get('stamp_dir') == ''):
+            # Results of asynchronous tasks are not available here, published packages are compared with packages in
+            # the repository and without stamps the module cannot tell cheaply whether meta packages have been
+            # installed already, so packages are passed to a single run of the module up front. The maintainer and the
+            # distribution tag of the managed host are unknown here, so packages are built on the managed host unless
+            # both can be derived from the task and facts.
+            maintainer = pkg_fields(module_args)['maintainer']
+            dist = None
+            if module_args['manager'] != 'apt':
+                dist = rpm_dist_from_facts(task_vars.get('ansible_facts', {}))
+
+            if maintainer and (dist or module_args['manager'] == 'apt'):
+                start = time.time()
+                module_args['artifacts'] = self._build_on_controller(
+                    module_args['manager'], dist, self._controller_pkgs(module_args, maintainer))
+                controller_build = dict(packages=len(module_args['artifacts']), elapsed=time.time() - start)
+        elif is_buildable:
+            # Packages are built and passed to the module only if the module requests them, i.e. not if meta packages
+            # have been installed on the managed host already
+            module_args['request_artifacts'] = True
+
+        module_result = self._execute_module(module_name='jm1.pkg.meta_pkg',
+                                             module_args=module_args,
+                                             task_vars=task_vars,
+                                             wrap_async=wrap_async)
+
+        if module_result.get('artifacts_requested'):
+            # Packages are built with maintainer and distribution tag of the managed host, so their keys match
+            start = time.time()
+            module_args['artifacts'] = self._build_on_controller(
+                module_args['manager'], module_result.get('dist'),
+                self._controller_pkgs(module_args, module_result['maintainer']))
+            module_args['request_artifacts'] = False
+            controller_build = dict(packages=len(module_args['artifacts']), elapsed=time.time() - start)
+            module_result = self._execute_module(module_name='jm1.pkg.meta_pkg',
+                                                 module_args=module_args,
+                                                 task_vars=task_vars,
+                                                 wrap_async=wrap_async)
+
+        result = merge_hash(result, module_result)
+
+        if not wrap_async:
+            # remove a temporary path we created
+            self._remove_tmp_path(self._connection._shell.tmpdir)
+
+        if detection is not None and 'detection' in result:
+            result['detection'] = detection
+
+        if controller_build is not None:
+            result['controller_build'] = controller_build
+
+        return result
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2024, Jakob Meng <jakobmeng@web.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Fields, fingerprints and native builds of meta packages, shared by module jm1.pkg.meta_pkg and its action plugin.
+#
+# Meta packages which are built natively are identified by a key which is computed from all fields of the package, the
+# package manager and the distribution tag. The action plugin builds meta packages on the controller and passes them
+# with their keys to the module, which uses them instead of building the packages itself if the keys match.
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+from ansible.module_utils._text import to_text
+from ansible_collections.jm1.pkg.plugins.module_utils.deb import make_deb_archive
+from ansible_collections.jm1.pkg.plugins.module_utils.rpm import make_rpm_archive
+import hashlib
+import json
+import os
+import pwd
+import socket
+import textwrap
+
+# A line break marks the end of control file
+DEBIAN_CONTROLFILE_TEMPLATE = r'''
+Section: metapackages
+Priority: optional
+Standards-Version:  4.5.0
+Package: {name}
+Version: {version}
+Architecture: {architecture}
+Maintainer: {maintainer}
+Rules-Requires-Root: no
+Multi-Arch: foreign
+Conflicts: {conflicts}
+Depends: {depends}
+Enhances: {enhances}
+Recommends: {recommends}
+Suggests: {suggests}
+Description: {summary}
+ {description}
+Jm1-Pkg-Fingerprint: {fingerprint}
+'''
+
+# Fingerprints of relationships are embedded in Debian packages as a user-defined control field and in RPM packages as
+# the last line of the description, because RPM does not support user-defined header tags.
+DEB_FINGERPRINT_FIELD = 'Jm1-Pkg-Fingerprint'
+RPM_FINGERPRINT_PREFIX = 'jm1-pkg-fingerprint: '
+
+# Fields of a meta package with their default values, each can be defined per item of option packages
+PKG_DEFAULTS = dict(
+    architecture=None,
+    conflicts=[],
+    depends=[],
+    description='Package management made easy.',
+    enhances=[],
+    maintainer=None,
+    name=None,
+    recommends=[],
+    suggests=[],
+    summary='Meta package to simplify package management',
+    version='1',
+)
+
+
+def fingerprint(conflicts, depends, enhances, recommends, suggests):
+    # Relationships are normalized, i.e. whitespaces are collapsed and order is ignored
+    relationships = dict(
+        conflicts=conflicts,
+        depends=depends,
+        enhances=enhances,
+        recommends=recommends,
+        suggests=suggests)
+    normalized = dict((key, sorted(' '.join(relationship.split()) for relationship in value))
+                      for key, value in relationships.items())
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def rpm_fingerprint(description):
+    for line in reversed((description or '').splitlines()):
+        if line.startswith(RPM_FINGERPRINT_PREFIX):
+            return line[len(RPM_FINGERPRINT_PREFIX):].strip()
+    return None
+
+
+def default_maintainer():
+    pwuid = pwd.getpwuid(os.getuid())
+
+    username = pwuid.pw_name
+
+    if pwuid.pw_gecos:
+        fullname = pwuid.pw_gecos.split(',')[0]
+    else:
+        # fallback to username
+        fullname = username
+
+    fqdn = socket.getfqdn()
+
+    return '{fullname} <{username}@{fqdn}>'.format(fullname=fullname, username=username, fqdn=fqdn)
+
+
+def meta_packages(defaults, packages):
+    """Return a list of meta packages with their fingerprints.
+
+    Fields which are not defined in an item of packages default to the values in defaults. If packages is None, then a
+    single meta package is defined by defaults.
+    """
+    if packages is None:
+        pkgs = [dict((key, defaults[key]) for key in PKG_DEFAULTS)]
+    else:
+        pkgs = [dict((key, defaults[key] if item.get(key) is None else item[key]) for key in PKG_DEFAULTS)
+                for item in packages]
+
+    names = [pkg['name'] for pkg in pkgs]
+    for pkg_name in names:
+        if names.count(pkg_name) > 1:
+            raise ValueError('package %s is listed more than once' % pkg_name)
+
+    for pkg in pkgs:
+        pkg['fingerprint'] = fingerprint(
+            pkg['conflicts'], pkg['depends'], pkg['enhances'], pkg['recommends'], pkg['suggests'])
+
+    return pkgs
+
+
+def artifact_key(manager, builder, dist, content):
+    sha256 = hashlib.sha256()
+    for value in [manager, builder, dist or '', content]:
+        sha256.update(value.encode('utf-8'))
+        sha256.update(b'\0')
+    return sha256.hexdigest()
+
+
+def render_control(**fields):
+    """Return the control file of a Debian meta package.
+
+    The control file is rendered with plain string formatting, so jinja2 is not required on managed hosts. The
+    description is wrapped and indented like jinja2's filters wordwrap(width=80) and indent(1) would do.
+    """
+    wrapper = textwrap.TextWrapper(width=80, expand_tabs=False, replace_whitespace=False)
+    lines = [wrapped for line in fields['description'].splitlines() for wrapped in wrapper.wrap(line) or ['']]
+    # continuation lines are indented by a single space, except for blank lines
+    description = '\n'.join(lines[:1] + [' ' + line if line else line for line in lines[1:]])
+
+    values = dict(fields, description=description)
+    for key in ['conflicts', 'depends', 'enhances', 'recommends', 'suggests']:
+        values[key] = ', '.join(fields[key])
+    # the template is a byte string on Python 2, which cannot be formatted with non-ascii text
+    return to_text(DEBIAN_CONTROLFILE_TEMPLATE).format(**values)
+
+
+def native_artifact(manager, dist, pkg):
+    """Return key, file suffix and a function which builds meta package pkg natively and returns it as bytes.
+
+    dist is the distribution tag, e.g. '.fc39', and is ignored on apt-based distributions.
+    """
+    fields = dict((key, pkg[key]) for key in PKG_DEFAULTS)
+
+    if manager == 'apt':
+        fields['fingerprint'] = pkg['fingerprint']
+        key = artifact_key(manager, 'native', None, json.dumps(fields, sort_keys=True))
+        return key, '.deb', lambda: make_deb_archive(render_control(**fields))
+
+    fields.update(
+        description='{description}\n\n{prefix}{fingerprint}'.format(
+            description=pkg['description'], prefix=RPM_FINGERPRINT_PREFIX, fingerprint=pkg['fingerprint']).lstrip('\n'),
+        release='1' + dist)
+    key = artifact_key(manager, 'native', dist, json.dumps(fields, sort_keys=True))
+    return key, '.rpm', lambda: make_rpm_archive(buildhost=socket.gethostname(), **fields)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2024, Jakob Meng <jakobmeng@web.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Pure Python writer for Debian binary packages without any payload, i.e. meta packages, and reader for control files of
+# Debian binary packages.
+#
+# A Debian binary package is an ar archive which holds the members debian-binary, control.tar.gz and data.tar.gz.
+# All timestamps, owners and permissions are fixed, hence the same control file will always produce the same package.
+#
+# Ref.: man deb, man deb-control
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import gzip
+import io
+import tarfile
+
+# Fixed timestamp for archive members and tar entries, allows to build reproducible packages
+DEB_MTIME = 0
+
+AR_MAGIC = b'!<arch>\n'
+
+
+def normalize_control(content):
+    """Strip blank lines and drop fields without any value from a control file.
+
+    Relationship fields such as Depends or Conflicts are rendered even if no relationship has been declared, but an
+    empty field is not valid in a binary package control file.
+    """
+    fields = []
+    for line in content.strip('\n').split('\n'):
+        if not line.strip():
+            continue
+
+        if line[0] in ' \t':
+            # continuation line
+            if not fields:
+                raise ValueError('control file must not start with a continuation line: %s' % line)
+            fields[-1].append(line.rstrip())
+        else:
+            if ':' not in line:
+                raise ValueError('invalid line in control file: %s' % line)
+            fields.append([line.rstrip()])
+
+    lines = []
+    for field in fields:
+        value = field[0].split(':', 1)[1]
+        if not value.strip() and len(field) == 1:
+            continue
+        lines.extend(field)
+
+    return '\n'.join(lines) + '\n'
+
+
+def _ar_member(name, data):
+    # ar member header: name, mtime, uid, gid, mode (octal), size, magic
+    header = '%-16s%-12d%-6d%-6d%-8s%-10d`\n' % (name, DEB_MTIME, 0, 0, '100644', len(data))
+    member = header.encode('ascii') + data
+    if len(data) % 2:
+        # members are aligned to even offsets
+        member += b'\n'
+    return member
+
+
+def _tar_info(name, tar_type, mode, size=0):
+    info = tarfile.TarInfo(name)
+    info.type = tar_type
+    info.mode = mode
+    info.size = size
+    info.mtime = DEB_MTIME
+    info.uid = 0
+    info.gid = 0
+    info.uname = 'root'
+    info.gname = 'root'
+    return info
+
+
+def _tar_gz(files):
+    """Create a gzip compressed tar archive holding directory ./ and files, a list of tuples (name, data)."""
+    tar_buffer = io.BytesIO()
+    tar = tarfile.open(fileobj=tar_buffer, mode='w', format=tarfile.GNU_FORMAT)
+    try:
+        tar.addfile(_tar_info('./', tarfile.DIRTYPE, 0o755))
+        for name, data in files:
+            tar.addfile(_tar_info('./' + name, tarfile.REGTYPE, 0o644, len(data)), io.BytesIO(data))
+    finally:
+        tar.close()
+
+    gz_buffer = io.BytesIO()
+    gz = gzip.GzipFile(filename='', mode='wb', fileobj=gz_buffer, mtime=DEB_MTIME)
+    try:
+        gz.write(tar_buffer.getvalue())
+    finally:
+        gz.close()
+
+    return gz_buffer.getvalue()
+
+
+def make_deb_archive(control_content):
+    """Return a Debian binary package without payload for the given control file content as bytes."""
+    control = normalize_control(control_content).encode('utf-8')
+
+    return b''.join([
+        AR_MAGIC,
+        _ar_member('debian-binary', b'2.0\n'),
+        _ar_member('control.tar.gz', _tar_gz([('control', control)])),
+        _ar_member('data.tar.gz', _tar_gz([]))])
+
+
+def write_deb(path, control_content):
+    with open(path, 'wb') as f:
+        f.write(make_deb_archive(control_content))
+
+
+def _ar_members(data):
+    """Yield tuples (name, data) of all members of an ar archive."""
+    if not data.startswith(AR_MAGIC):
+        raise ValueError('not an ar archive')
+
+    offset = len(AR_MAGIC)
+    while offset + 60 <= len(data):
+        header = data[offset:offset + 60]
+        if header[58:60] != b'`\n':
+            raise ValueError('invalid ar member header at offset %d' % offset)
+
+        name = header[0:16].decode('ascii').rstrip()
+        if name.endswith('/'):
+            # GNU ar terminates names with a slash
+            name = name[:-1]
+        size = int(header[48:58].decode('ascii'))
+
+        offset += 60
+        yield name, data[offset:offset + size]
+        offset += size + size % 2
+
+
+def read_deb_control(path):
+    """Return the content of the control file of a Debian binary package.
+
+    Member control.tar of the package may be uncompressed or compressed with gzip, bzip2 or xz, the latter is supported
+    on Python 3 only.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    for name, member in _ar_members(data):
+        if not name.startswith('control.tar'):
+            continue
+
+        tar = tarfile.open(fileobj=io.BytesIO(member), mode='r:*')
+        try:
+            for info in tar:
+                if info.isfile() and info.name in ('control', './control'):
+                    return tar.extractfile(info).read().decode('utf-8')
+        finally:
+            tar.close()
+        raise ValueError('control.tar of %s does not contain a control file' % path)
+
+    raise ValueError('%s is not a Debian binary package' % path)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2024, Jakob Meng <jakobmeng@web.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Configuration files which are changed in memory by several tasks and written at once, shared by modules
+# jm1.pkg.apt_sources and jm1.pkg.yum_repositories.
+#
+# Each file is read once. Afterwards it is written only if the hash of its content differs from the file on disk, so
+# modules report exactly which files have changed, even if tasks revert changes of previous tasks.
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+from ansible.module_utils._text import to_bytes, to_text
+import errno
+import glob
+import hashlib
+import os
+import tempfile
+
+# Common file arguments of Ansible modules which are applied to files after they have been written
+FILE_ATTRIBUTES = ['attributes', 'group', 'mode', 'owner', 'selevel', 'serole', 'setype', 'seuser', 'unsafe_writes']
+
+
+class Files(object):
+    """Files which are read once, changed in memory and written at once if their content hash has changed."""
+
+    def __init__(self, module):
+        self.module = module
+        self.order = []
+        self.checksums = dict()
+        self.contents = dict()
+        self.attributes = dict()
+        self.binary = set()
+        self.diffs = []
+
+    def read(self, path):
+        """Return content of file at path as bytes or None if it does not exist."""
+        if path not in self.contents:
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except (IOError, OSError) as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                data = None
+
+            self.order.append(path)
+            self.checksums[path] = None if data is None else hashlib.sha256(data).hexdigest()
+            self.contents[path] = data
+        return self.contents[path]
+
+    def read_text(self, path):
+        data = self.read(path)
+        return None if data is None else to_text(data, errors='surrogate_or_strict')
+
+    def write(self, path, data, binary=False):
+        """Change content of file at path to data, which is removed if data is None."""
+        self.read(path)
+        self.contents[path] = data
+        if binary:
+            self.binary.add(path)
+
+    def write_text(self, path, text):
+        self.write(path, None if text is None else to_bytes(text, errors='surrogate_or_strict'))
+
+    def set_attributes(self, path, **attributes):
+        """Change attributes of file at path, i.e. any of FILE_ATTRIBUTES. Attributes which are None are not changed."""
+        for key, value in attributes.items():
+            if key not in FILE_ATTRIBUTES:
+                raise ValueError('unsupported file attribute %s' % key)
+            if value is not None:
+                self.attributes.setdefault(path, dict())[key] = value
+
+    def paths(self, directory, suffix):
+        """Return paths of files in directory with suffix, both on disk and in memory."""
+        paths = sorted(glob.glob(os.path.join(directory, '*' + suffix)))
+        paths.extend(path for path in self.order
+                     if os.path.dirname(path) == directory and path.endswith(suffix) and path not in paths)
+        return [path for path in paths if self.read(path) is not None]
+
+    def _write_atomic(self, path, data, unsafe_writes=False):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o755)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.%s-' % os.path.basename(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        self.module.atomic_move(tmp_path, path, unsafe_writes=unsafe_writes)
+
+    def _diff(self, path, data):
+        if path in self.binary:
+            return
+        before = '' if self.checksums[path] is None else to_text(open(path, 'rb').read(),
+                                                                 errors='surrogate_or_strict')
+        after = '' if data is None else to_text(data, errors='surrogate_or_strict')
+        self.diffs.append(dict(before_header=path, after_header=path, before=before, after=after))
+
+    def commit(self):
+        """Write changed files and return their paths."""
+        changed = []
+        for path in self.order:
+            data = self.contents[path]
+            attributes = dict(self.attributes.get(path, dict()))
+            unsafe_writes = attributes.pop('unsafe_writes', False)
+            checksum = None if data is None else hashlib.sha256(data).hexdigest()
+            if checksum != self.checksums[path]:
+                if self.module._diff:
+                    self._diff(path, data)
+                if not self.module.check_mode:
+                    if data is None:
+                        os.remove(path)
+                    else:
+                        self._write_atomic(path, data, unsafe_writes)
+                changed.append(path)
+
+            if attributes and data is not None and os.path.exists(path):
+                file_args = self.module.load_file_common_arguments(dict(attributes, path=path))
+                if self.module.set_fs_attributes_if_different(file_args, False) and path not in changed:
+                    changed.append(path)
+        return changed
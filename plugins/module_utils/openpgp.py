@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2024, Jakob Meng <jakobmeng@web.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Pure Python reader for OpenPGP public keys as used in keyrings of apt, e.g. in /etc/apt/trusted.gpg.d/.
+#
+# apt reads keyrings which are a plain sequence of binary OpenPGP packets, i.e. public keys which have been dearmored
+# like with 'gpg --dearmor'. Keys are identified by their fingerprints, which are computed from the public key packets
+# without any help from gpg. Keys in keybox files, which gpg might write, are not supported.
+#
+# Ref.: RFC 4880, RFC 9580
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import base64
+import binascii
+import hashlib
+import struct
+
+ARMOR_BEGIN = '-----BEGIN PGP PUBLIC KEY BLOCK-----'
+ARMOR_END = '-----END PGP PUBLIC KEY BLOCK-----'
+
+PUBLIC_KEY_TAG = 6
+PUBLIC_SUBKEY_TAG = 14
+
+CRC24_INIT = 0xB704CE
+CRC24_POLY = 0x1864CFB
+
+
+def is_armored(data):
+    return ARMOR_BEGIN.encode('ascii') in data
+
+
+def _crc24(data):
+    crc = CRC24_INIT
+    for octet in bytearray(data):
+        crc ^= octet << 16
+        for dummy in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= CRC24_POLY
+    return crc & 0xFFFFFF
+
+
+def dearmor(data):
+    """Return binary OpenPGP packets of all ASCII armored public key blocks in data, like 'gpg --dearmor'."""
+    packets = []
+    block = None
+    for line in data.decode('ascii', 'replace').splitlines():
+        line = line.strip()
+        if line == ARMOR_BEGIN:
+            block = dict(headers=True, lines=[], checksum=None)
+        elif block is None:
+            continue
+        elif line == ARMOR_END:
+            decoded = base64.b64decode(''.join(block['lines']))
+            if block['checksum'] is not None and struct.unpack('>I', b'\0' + block['checksum'])[0] != _crc24(decoded):
+                raise ValueError('checksum of armored public key block does not match')
+            packets.append(decoded)
+            block = None
+        elif block['headers']:
+            # armor headers such as 'Comment: ...' are terminated by an empty line
+            if not line:
+                block['headers'] = False
+            elif ':' not in line:
+                block['headers'] = False
+                block['lines'].append(line)
+        elif line.startswith('=') and len(line) == 5:
+            block['checksum'] = base64.b64decode(line[1:])
+        elif line:
+            block['lines'].append(line)
+
+    if block is not None:
+        raise ValueError('armored public key block is incomplete')
+    if not packets:
+        raise ValueError('no armored public key block found')
+    return b''.join(packets)
+
+
+def _packets(data):
+    """Yield tag, header offset, body offset and end offset of each packet in data."""
+    data = bytearray(data)
+    offset = 0
+    while offset < len(data):
+        start = offset
+        octet = data[offset]
+        if not octet & 0x80:
+            raise ValueError('invalid OpenPGP packet at offset %d' % offset)
+
+        if octet & 0x40:
+            # new packet format, partial body lengths are not allowed for keys
+            tag = octet & 0x3F
+            first = data[offset + 1]
+            if first < 192:
+                length, offset = first, offset + 2
+            elif first < 224:
+                length, offset = ((first - 192) << 8) + data[offset + 2] + 192, offset + 3
+            elif first == 255:
+                length, offset = struct.unpack('>I', bytes(data[offset + 2:offset + 6]))[0], offset + 6
+            else:
+                raise ValueError('partial body length of OpenPGP packet at offset %d not supported' % start)
+        else:
+            # old packet format
+            tag = (octet >> 2) & 0x0F
+            length_type = octet & 0x03
+            if length_type == 3:
+                length, offset = len(data) - offset - 1, offset + 1
+            else:
+                size = 1 << length_type
+                length = int(binascii.hexlify(bytes(data[offset + 1:offset + 1 + size])), 16)
+                offset = offset + 1 + size
+
+        if offset + length > len(data):
+            raise ValueError('OpenPGP packet at offset %d is truncated' % start)
+        yield tag, start, offset, offset + length
+        offset += length
+
+
+def _fingerprint(body):
+    version = bytearray(body[:1])[0] if body else None
+    if version == 4:
+        return hashlib.sha1(b'\x99' + struct.pack('>H', len(body)) + body).hexdigest().upper()
+    if version == 5:
+        return hashlib.sha256(b'\x9a' + struct.pack('>I', len(body)) + body).hexdigest().upper()
+    if version == 6:
+        return hashlib.sha256(b'\x9b' + struct.pack('>I', len(body)) + body).hexdigest().upper()
+    # version 3 keys have been deprecated long ago and are not supported by apt
+    return None
+
+
+def keys(data):
+    """Return list of keys in binary OpenPGP data as dicts.
+
+    Each key has the fingerprints of its primary key and subkeys and its transferable public key, i.e. its packets
+    from the primary key packet up to the next primary key packet.
+    """
+    result = []
+    for tag, start, body, end in _packets(data):
+        if tag == PUBLIC_KEY_TAG:
+            result.append(dict(fingerprints=[], start=start, end=end))
+        elif not result:
+            raise ValueError('OpenPGP data does not start with a public key packet')
+
+        if tag in [PUBLIC_KEY_TAG, PUBLIC_SUBKEY_TAG]:
+            fingerprint = _fingerprint(data[body:end])
+            if fingerprint:
+                result[-1]['fingerprints'].append(fingerprint)
+
+        result[-1]['end'] = end
+
+    for key in result:
+        key['data'] = data[key.pop('start'):key.pop('end')]
+    return result
+
+
+def normalize_key_id(key_id):
+    """Return key id or fingerprint such as '0x605c 66f0 0d6c 9793' in upper case without prefix and whitespaces."""
+    key_id = ''.join(key_id.split()).upper()
+    return key_id[2:] if key_id.startswith('0X') else key_id
+
+
+def matches(key, key_id):
+    """Return whether short or long key id or fingerprint key_id identifies the primary key or a subkey of key.
+
+    Key ids are the last 8 respectively 16 digits of fingerprints of version 4 keys, but the first digits of
+    fingerprints of version 5 and 6 keys.
+    """
+    key_id = normalize_key_id(key_id)
+    return any((fingerprint.endswith(key_id) if len(fingerprint) == 40 else fingerprint.startswith(key_id))
+               for fingerprint in key['fingerprints'])
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2024, Jakob Meng <jakobmeng@web.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Index of package names for expanding shell-style wildcards such as 'python3-*-doc' in package relationships.
+#
+# Package names are kept sorted and sorted in reverse, i.e. by suffix, so that a pattern is only matched against
+# names which share its literal prefix or suffix. Even many patterns against tens of thousands of package names
+# require a few bisections and a small number of regular expression matches only.
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import bisect
+import fnmatch
+import re
+
+GLOB_CHARS = '*?['
+
+
+def is_glob(relationship):
+    """Return whether any package name in relationship contains wildcards.
+
+    All tokens are scanned, so wildcards in alternatives such as 'a | b*' and in rich dependencies such as '(a or b*)'
+    are found, too.
+    """
+    return any(char in token for token in re.split(r'[\s(),|]+', relationship) for char in GLOB_CHARS)
+
+
+def _literal_prefix(pattern):
+    for index, char in enumerate(pattern):
+        if char in GLOB_CHARS:
+            return pattern[:index]
+    return pattern
+
+
+def _literal_suffix(pattern):
+    for index in range(len(pattern) - 1, -1, -1):
+        if pattern[index] in '*?]':
+            return pattern[index + 1:]
+    return pattern
+
+
+def _range(names, prefix):
+    start = bisect.bisect_left(names, prefix)
+    end = start
+    while end < len(names) and names[end].startswith(prefix):
+        end += 1
+    return names[start:end]
+
+
+class PackageIndex(object):
+    """Sorted index of package names which expands shell-style wildcards in package relationships."""
+
+    def __init__(self, names):
+        self.names = sorted(set(names))
+        self.reversed_names = sorted(name[::-1] for name in self.names)
+
+    def match(self, pattern):
+        """Return sorted list of package names which match pattern."""
+        prefix = _literal_prefix(pattern)
+        suffix = _literal_suffix(pattern)
+
+        if len(prefix) >= len(suffix):
+            candidates = _range(self.names, prefix)
+        else:
+            candidates = sorted(name[::-1] for name in _range(self.reversed_names, suffix[::-1]))
+
+        regex = re.compile(fnmatch.translate(pattern))
+        return [name for name in candidates if regex.match(name)]
+
+    def expand(self, relationships):
+        """Expand wildcards in package names of relationships.
+
+        A relationship such as 'fonts-noto* (>= 20201225)' is replaced by one relationship per matching package, each
+        with the same version constraint. Relationships without wildcards are returned as is. Returns the expanded
+        relationships and the list of patterns which did not match any package.
+        """
+        expanded = []
+        unmatched = []
+        for relationship in relationships:
+            if not is_glob(relationship):
+                expanded.append(relationship)
+                continue
+
+            if relationship.lstrip().startswith('(') or '|' in relationship:
+                raise ValueError("wildcards are not supported in alternatives or rich dependencies: '%s'"
+                                 % relationship)
+
+            parts = relationship.split(None, 1)
+            pattern = parts[0]
+            constraint = ' ' + parts[1] if len(parts) > 1 else ''
+
+            names = self.match(pattern)
+            if not names:
+                unmatched.append(pattern)
+            expanded.extend(name + constraint for name in names)
+
+        return expanded, unmatched
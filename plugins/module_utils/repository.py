@@ -0,0 +1,545 @@
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2024, Jakob Meng <jakobmeng@web.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Incremental indexes of local package repositories, i.e. flat apt repositories and rpm-md repositories.
+#
+# Indexes are updated per package. Entries of packages which have not been changed are kept verbatim as text, only
+# entries of added or removed packages are generated. Hence neither are package files in the repository rescanned nor
+# are the indexes parsed completely. A repository holds a single version of each package, it is identified by its name.
+#
+# Ref.:
+#  https://wiki.debian.org/DebianRepository/Format#Flat_Repository_Format
+#  https://github.com/rpm-software-management/createrepo_c
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+from ansible_collections.jm1.pkg.plugins.module_utils.deb import normalize_control, read_deb_control
+from ansible_collections.jm1.pkg.plugins.module_utils.rpm import (
+    RPMSENSE_EQUAL,
+    RPMSENSE_GREATER,
+    RPMSENSE_LESS,
+    RPMSIGTAG_PAYLOADSIZE,
+    RPMTAG_ARCH,
+    RPMTAG_BUILDHOST,
+    RPMTAG_BUILDTIME,
+    RPMTAG_CHANGELOGNAME,
+    RPMTAG_CHANGELOGTEXT,
+    RPMTAG_CHANGELOGTIME,
+    RPMTAG_CONFLICTFLAGS,
+    RPMTAG_CONFLICTNAME,
+    RPMTAG_CONFLICTVERSION,
+    RPMTAG_DESCRIPTION,
+    RPMTAG_ENHANCEFLAGS,
+    RPMTAG_ENHANCENAME,
+    RPMTAG_ENHANCEVERSION,
+    RPMTAG_EPOCH,
+    RPMTAG_GROUP,
+    RPMTAG_LICENSE,
+    RPMTAG_NAME,
+    RPMTAG_PACKAGER,
+    RPMTAG_PROVIDEFLAGS,
+    RPMTAG_PROVIDENAME,
+    RPMTAG_PROVIDEVERSION,
+    RPMTAG_RECOMMENDFLAGS,
+    RPMTAG_RECOMMENDNAME,
+    RPMTAG_RECOMMENDVERSION,
+    RPMTAG_RELEASE,
+    RPMTAG_REQUIREFLAGS,
+    RPMTAG_REQUIRENAME,
+    RPMTAG_REQUIREVERSION,
+    RPMTAG_SIZE,
+    RPMTAG_SOURCERPM,
+    RPMTAG_SUGGESTFLAGS,
+    RPMTAG_SUGGESTNAME,
+    RPMTAG_SUGGESTVERSION,
+    RPMTAG_SUMMARY,
+    RPMTAG_URL,
+    RPMTAG_VENDOR,
+    RPMTAG_VERSION,
+    header_relationships,
+    read_rpm_header,
+    rpm_filename,
+)
+from xml.sax.saxutils import escape, quoteattr, unescape
+import bz2
+import email.utils
+import errno
+import fcntl
+import gzip
+import hashlib
+import io
+import os
+import re
+import shutil
+import time
+import xml.etree.ElementTree as ET
+
+LOCK_NAME = '.lock'
+
+RPM_MD_COMMON_NS = 'http://linux.duke.edu/metadata/common'
+RPM_MD_FILELISTS_NS = 'http://linux.duke.edu/metadata/filelists'
+RPM_MD_OTHER_NS = 'http://linux.duke.edu/metadata/other'
+RPM_MD_REPO_NS = 'http://linux.duke.edu/metadata/repo'
+RPM_MD_RPM_NS = 'http://linux.duke.edu/metadata/rpm'
+
+# Metadata types which hold one entry per package, with the tag and namespaces of their root element
+RPM_MD_TYPES = [
+    ('primary', 'metadata', 'xmlns="%s" xmlns:rpm="%s"' % (RPM_MD_COMMON_NS, RPM_MD_RPM_NS)),
+    ('filelists', 'filelists', 'xmlns="%s"' % RPM_MD_FILELISTS_NS),
+    ('other', 'otherdata', 'xmlns="%s"' % RPM_MD_OTHER_NS),
+]
+
+RPM_MD_FLAGS = {
+    RPMSENSE_LESS: 'LT',
+    RPMSENSE_LESS | RPMSENSE_EQUAL: 'LE',
+    RPMSENSE_EQUAL: 'EQ',
+    RPMSENSE_GREATER | RPMSENSE_EQUAL: 'GE',
+    RPMSENSE_GREATER: 'GT',
+}
+
+PACKAGE_ENTRY_RE = re.compile(r'<package[\s>].*?</package>', re.DOTALL)
+REPOMD_DATA_RE = re.compile(r'<data\s+type="([^"]+)"\s*>.*?</data>', re.DOTALL)
+LOCATION_RE = re.compile(r'<location\s[^>]*href="([^"]+)"')
+
+
+def _digests(path):
+    """Return size, md5, sha1 and sha256 hex digests of a file."""
+    md5 = hashlib.md5()
+    sha1 = hashlib.sha1()
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            md5.update(chunk)
+            sha1.update(chunk)
+            sha256.update(chunk)
+            size += len(chunk)
+    return size, md5.hexdigest(), sha1.hexdigest(), sha256.hexdigest()
+
+
+def _gzip(data):
+    buffer = io.BytesIO()
+    gz = gzip.GzipFile(filename='', mode='wb', fileobj=buffer, mtime=0)
+    try:
+        gz.write(data)
+    finally:
+        gz.close()
+    return buffer.getvalue()
+
+
+def _decompress(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if path.endswith('.gz'):
+        return gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+    elif path.endswith('.bz2'):
+        return bz2.decompress(data)
+    elif path.endswith('.xz'):
+        import lzma  # Python 3 only
+        return lzma.decompress(data)
+    elif path.endswith('.zst') or path.endswith('.zck'):
+        raise ValueError('compression of %s is not supported, please use gzip instead' % path)
+    return data
+
+
+def _write_atomic(path, data):
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.chmod(tmp_path, 0o644)
+    # rename is atomic, hence clients will never see partially written files
+    os.rename(tmp_path, path)
+
+
+class _Repository(object):
+    """Base class of package repositories in directory path.
+
+    Repositories are used as context managers. Entering locks the repository and loads its index, subclasses
+    implement load(), get(), add(), remove() and write().
+    """
+
+    def __init__(self, path):
+        self.path = os.path.normpath(path)
+        self.changed = False
+        # files which will be removed once the index has been written
+        self.obsolete = set()
+        self.lock_file = None
+
+    def __enter__(self):
+        try:
+            os.makedirs(self.path, mode=0o755)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        # concurrent runs, e.g. from several hosts delegated to the same repository host, are serialized
+        self.lock_file = open(os.path.join(self.path, LOCK_NAME), 'a')
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        self.load()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.lock_file.close()
+        self.lock_file = None
+
+    def _copy(self, pkg_path, filename):
+        target_path = os.path.normpath(os.path.join(self.path, filename))
+        tmp_path = '%s.%d.tmp' % (target_path, os.getpid())
+        shutil.copyfile(pkg_path, tmp_path)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, target_path)
+        self.obsolete.discard(target_path)
+        return target_path
+
+    def _remove_obsolete(self, keep):
+        for path in self.obsolete - set(keep) - set([None]):
+            try:
+                os.remove(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        self.obsolete = set()
+
+
+def _control_fields(stanza):
+    """Return fields of a control stanza as dict, continuation lines of multiline fields are joined with newlines."""
+    fields = {}
+    field = None
+    for line in stanza.split('\n'):
+        if line[:1] in (' ', '\t'):
+            if field is not None:
+                fields[field] += '\n' + line
+            continue
+
+        field, sep, value = line.partition(':')
+        if not sep:
+            field = None
+            continue
+        fields[field] = value.strip()
+    return fields
+
+
+class AptRepository(_Repository):
+    """Flat apt repository with index files Packages, Packages.gz and Release in directory path.
+
+    Clients use it with e.g. 'deb [trusted=yes] file:/srv/repo ./' in apt's sources.list. The Release file is not
+    signed.
+    """
+
+    def load(self):
+        # maps package names to stanzas without trailing newlines
+        self.stanzas = {}
+        try:
+            with io.open(os.path.join(self.path, 'Packages'), encoding='utf-8') as f:
+                content = f.read()
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+
+        for stanza in content.split('\n\n'):
+            stanza = stanza.strip('\n')
+            if not stanza:
+                continue
+            name = _control_fields(stanza).get('Package')
+            if name:
+                self.stanzas[name] = stanza
+
+    def get(self, name):
+        """Return fields of package name as dict or None if the repository does not hold it."""
+        stanza = self.stanzas.get(name)
+        return None if stanza is None else _control_fields(stanza)
+
+    def _filename_path(self, name):
+        filename = self.get(name).get('Filename')
+        return os.path.normpath(os.path.join(self.path, filename)) if filename else None
+
+    def add(self, pkg_path):
+        """Copy Debian package pkg_path into the repository and replace any other version of it in the index."""
+        control = normalize_control(read_deb_control(pkg_path)).strip('\n')
+        fields = _control_fields(control)
+        name = fields['Package']
+
+        # the epoch is not part of file names
+        filename = '{name}_{version}_{architecture}.deb'.format(
+            name=name, version=fields['Version'].split(':', 1)[-1], architecture=fields['Architecture'])
+
+        if name in self.stanzas:
+            self.obsolete.add(self._filename_path(name))
+
+        target_path = self._copy(pkg_path, filename)
+        size, md5, sha1, sha256 = _digests(target_path)
+
+        self.stanzas[name] = '\n'.join([
+            control,
+            'Filename: ./%s' % filename,
+            'Size: %d' % size,
+            'MD5sum: %s' % md5,
+            'SHA1: %s' % sha1,
+            'SHA256: %s' % sha256])
+        self.changed = True
+
+    def remove(self, name):
+        """Remove package name from the index and its file from the repository. Returns whether it has been held."""
+        if name not in self.stanzas:
+            return False
+
+        self.obsolete.add(self._filename_path(name))
+        del self.stanzas[name]
+        self.changed = True
+        return True
+
+    def write(self):
+        """Write index files if packages have been added or removed and remove files of replaced packages."""
+        if not self.changed:
+            return
+
+        packages = ''.join(self.stanzas[name] + '\n\n' for name in sorted(self.stanzas)).encode('utf-8')
+        indexes = [('Packages', packages), ('Packages.gz', _gzip(packages))]
+
+        release = ['Date: %s' % email.utils.formatdate(usegmt=True)]
+        for field, algorithm in [('MD5Sum', hashlib.md5), ('SHA1', hashlib.sha1), ('SHA256', hashlib.sha256)]:
+            release.append('%s:' % field)
+            release.extend(' %s %d %s' % (algorithm(data).hexdigest(), len(data), filename)
+                           for filename, data in indexes)
+
+        for filename, data in indexes:
+            _write_atomic(os.path.join(self.path, filename), data)
+        _write_atomic(os.path.join(self.path, 'Release'), ('\n'.join(release) + '\n').encode('utf-8'))
+
+        self._remove_obsolete(keep=[self._filename_path(name) for name in self.stanzas])
+        self.changed = False
+
+
+def _split_evr(evr):
+    epoch, sep, version_release = evr.partition(':')
+    if not sep:
+        epoch, version_release = '0', evr
+    version, sep, release = version_release.partition('-')
+    return epoch, version, release
+
+
+def _rpm_md_relationships(tag, relationships):
+    entries = []
+    for name, flags, evr in relationships:
+        if name.startswith('rpmlib('):
+            # createrepo does not list requirements of rpm features
+            continue
+
+        attributes = 'name=%s' % quoteattr(name)
+        operator = RPM_MD_FLAGS.get(flags & (RPMSENSE_LESS | RPMSENSE_GREATER | RPMSENSE_EQUAL))
+        if operator and evr:
+            epoch, version, release = _split_evr(evr)
+            attributes += ' flags="%s" epoch=%s ver=%s' % (operator, quoteattr(epoch), quoteattr(version))
+            if release:
+                attributes += ' rel=%s' % quoteattr(release)
+        entries.append('      <rpm:entry %s/>\n' % attributes)
+
+    if not entries:
+        return ''
+    return '    <rpm:%s>\n%s    </rpm:%s>\n' % (tag, ''.join(entries), tag)
+
+
+class RpmMdRepository(_Repository):
+    """rpm-md repository with metadata in subdirectory repodata of directory path.
+
+    Metadata files are gzip compressed and their names are prefixed with their checksums, like createrepo does by
+    default. Metadata of other types, e.g. updateinfo or comps, is kept as is. SQLite databases and zchunk files would
+    become stale and hence are dropped from repomd.xml.
+    """
+
+    def load(self):
+        # maps metadata types to dicts which map package names to entries
+        self.entries = dict((md_type, {}) for md_type, tag, namespaces in RPM_MD_TYPES)
+        self.other_data = []
+        self.metadata_paths = set()
+
+        try:
+            with io.open(os.path.join(self.path, 'repodata', 'repomd.xml'), encoding='utf-8') as f:
+                repomd = f.read()
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+
+        for match in REPOMD_DATA_RE.finditer(repomd):
+            md_type, data = match.group(1), match.group(0)
+            location = LOCATION_RE.search(data)
+            md_path = os.path.join(self.path, unescape(location.group(1))) if location else None
+
+            if md_type not in self.entries:
+                if md_type.endswith('_db') or md_type.endswith('_zck'):
+                    self.obsolete.add(md_path)
+                else:
+                    self.other_data.append(data)
+                continue
+
+            self.metadata_paths.add(md_path)
+            content = _decompress(md_path).decode('utf-8')
+            for entry in PACKAGE_ENTRY_RE.finditer(content):
+                self.entries[md_type][self._entry_name(md_type, entry.group(0))] = entry.group(0)
+
+    @staticmethod
+    def _entry_name(md_type, entry):
+        if md_type == 'primary':
+            return unescape(re.search(r'<name>([^<]*)</name>', entry).group(1))
+        return unescape(re.search(r'<package\s[^>]*\bname="([^"]*)"', entry).group(1))
+
+    def get(self, name):
+        """Return dict with epoch, version, release and description of package name or None if it is not held."""
+        entry = self.entries['primary'].get(name)
+        if entry is None:
+            return None
+
+        element = ET.fromstring(('<metadata xmlns="%s" xmlns:rpm="%s">%s</metadata>' % (
+            RPM_MD_COMMON_NS, RPM_MD_RPM_NS, entry)).encode('utf-8'))
+        version = element.find('{%s}package/{%s}version' % (RPM_MD_COMMON_NS, RPM_MD_COMMON_NS))
+        description = element.find('{%s}package/{%s}description' % (RPM_MD_COMMON_NS, RPM_MD_COMMON_NS))
+        return dict(
+            description=description.text if description is not None else None,
+            epoch=version.get('epoch'),
+            release=version.get('rel'),
+            version=version.get('ver'))
+
+    def _location_path(self, name):
+        location = LOCATION_RE.search(self.entries['primary'][name])
+        return os.path.normpath(os.path.join(self.path, unescape(location.group(1)))) if location else None
+
+    def add(self, pkg_path):
+        """Copy RPM package pkg_path into the repository and replace any other version of it in the metadata."""
+        signature, header, header_range = read_rpm_header(pkg_path)
+
+        name = header[RPMTAG_NAME]
+        architecture = header[RPMTAG_ARCH]
+        epoch = str(header.get(RPMTAG_EPOCH, [0])[0])
+        version = header[RPMTAG_VERSION]
+        release = header[RPMTAG_RELEASE]
+        filename = rpm_filename(architecture, name, release, version)
+
+        if name in self.entries['primary']:
+            self.obsolete.add(self._location_path(name))
+
+        target_path = self._copy(pkg_path, filename)
+        size, md5, sha1, sha256 = _digests(target_path)
+
+        package = 'name=%s arch=%s' % (quoteattr(name), quoteattr(architecture))
+        version_element = '<version epoch=%s ver=%s rel=%s/>' % (quoteattr(epoch), quoteattr(version),
+                                                                 quoteattr(release))
+
+        provides = header_relationships(header, RPMTAG_PROVIDENAME, RPMTAG_PROVIDEFLAGS, RPMTAG_PROVIDEVERSION)
+        requires = header_relationships(header, RPMTAG_REQUIRENAME, RPMTAG_REQUIREFLAGS, RPMTAG_REQUIREVERSION)
+        conflicts = header_relationships(header, RPMTAG_CONFLICTNAME, RPMTAG_CONFLICTFLAGS, RPMTAG_CONFLICTVERSION)
+        recommends = header_relationships(header, RPMTAG_RECOMMENDNAME, RPMTAG_RECOMMENDFLAGS, RPMTAG_RECOMMENDVERSION)
+        suggests = header_relationships(header, RPMTAG_SUGGESTNAME, RPMTAG_SUGGESTFLAGS, RPMTAG_SUGGESTVERSION)
+        enhances = header_relationships(header, RPMTAG_ENHANCENAME, RPMTAG_ENHANCEFLAGS, RPMTAG_ENHANCEVERSION)
+
+        self.entries['primary'][name] = ''.join([
+            '<package type="rpm">\n',
+            '  <name>%s</name>\n' % escape(name),
+            '  <arch>%s</arch>\n' % escape(architecture),
+            '  %s\n' % version_element,
+            '  <checksum type="sha256" pkgid="YES">%s</checksum>\n' % sha256,
+            '  <summary>%s</summary>\n' % escape(header.get(RPMTAG_SUMMARY, '')),
+            '  <description>%s</description>\n' % escape(header.get(RPMTAG_DESCRIPTION, '')),
+            '  <packager>%s</packager>\n' % escape(header.get(RPMTAG_PACKAGER, '')),
+            '  <url>%s</url>\n' % escape(header.get(RPMTAG_URL, '')),
+            '  <time file="%d" build="%d"/>\n' % (int(os.stat(target_path).st_mtime),
+                                                  header.get(RPMTAG_BUILDTIME, [0])[0]),
+            '  <size package="%d" installed="%d" archive="%d"/>\n' % (
+                size, header.get(RPMTAG_SIZE, [0])[0], signature.get(RPMSIGTAG_PAYLOADSIZE, [0])[0]),
+            '  <location href=%s/>\n' % quoteattr(filename),
+            '  <format>\n',
+            '    <rpm:license>%s</rpm:license>\n' % escape(header.get(RPMTAG_LICENSE, '')),
+            '    <rpm:vendor>%s</rpm:vendor>\n' % escape(header.get(RPMTAG_VENDOR, '')),
+            '    <rpm:group>%s</rpm:group>\n' % escape(header.get(RPMTAG_GROUP, '')),
+            '    <rpm:buildhost>%s</rpm:buildhost>\n' % escape(header.get(RPMTAG_BUILDHOST, '')),
+            '    <rpm:sourcerpm>%s</rpm:sourcerpm>\n' % escape(header.get(RPMTAG_SOURCERPM, '')),
+            '    <rpm:header-range start="%d" end="%d"/>\n' % header_range,
+            _rpm_md_relationships('provides', provides),
+            _rpm_md_relationships('requires', requires),
+            _rpm_md_relationships('conflicts', conflicts),
+            _rpm_md_relationships('recommends', recommends),
+            _rpm_md_relationships('suggests', suggests),
+            _rpm_md_relationships('enhances', enhances),
+            '  </format>\n',
+            '</package>'])
+
+        # meta packages do not ship any files
+        self.entries['filelists'][name] = '<package pkgid="%s" %s>\n  %s\n</package>' % (
+            sha256, package, version_element)
+
+        changelogs = zip(header.get(RPMTAG_CHANGELOGNAME, []),
+                         header.get(RPMTAG_CHANGELOGTIME, []),
+                         header.get(RPMTAG_CHANGELOGTEXT, []))
+        self.entries['other'][name] = '<package pkgid="%s" %s>\n  %s\n%s</package>' % (
+            sha256, package, version_element,
+            ''.join('  <changelog author=%s date="%d">%s</changelog>\n' % (quoteattr(author), date, escape(text))
+                    for author, date, text in changelogs))
+        self.changed = True
+
+    def remove(self, name):
+        """Remove package name from the metadata and its file from the repository. Returns whether it has been held."""
+        if name not in self.entries['primary']:
+            return False
+
+        self.obsolete.add(self._location_path(name))
+        for md_type, tag, namespaces in RPM_MD_TYPES:
+            self.entries[md_type].pop(name, None)
+        self.changed = True
+        return True
+
+    def write(self):
+        """Write metadata if packages have been added or removed and remove files of replaced packages and metadata."""
+        if not self.changed:
+            return
+
+        repodata_path = os.path.join(self.path, 'repodata')
+        try:
+            os.makedirs(repodata_path, mode=0o755)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        timestamp = int(time.time())
+        data = []
+        md_paths = []
+        for md_type, tag, namespaces in RPM_MD_TYPES:
+            entries = self.entries[md_type]
+            content = ('<?xml version="1.0" encoding="UTF-8"?>\n<%s %s packages="%d">\n%s</%s>\n' % (
+                tag, namespaces, len(entries), ''.join(entries[name] + '\n' for name in sorted(entries)), tag)
+            ).encode('utf-8')
+            compressed = _gzip(content)
+            checksum = hashlib.sha256(compressed).hexdigest()
+
+            href = 'repodata/%s-%s.xml.gz' % (checksum, md_type)
+            md_path = os.path.join(self.path, href)
+            _write_atomic(md_path, compressed)
+            md_paths.append(md_path)
+
+            data.append('\n'.join([
+                '<data type="%s">' % md_type,
+                '    <checksum type="sha256">%s</checksum>' % checksum,
+                '    <open-checksum type="sha256">%s</open-checksum>' % hashlib.sha256(content).hexdigest(),
+                '    <location href="%s"/>' % href,
+                '    <timestamp>%d</timestamp>' % timestamp,
+                '    <size>%d</size>' % len(compressed),
+                '    <open-size>%d</open-size>' % len(content),
+                '  </data>']))
+
+        repomd = '<?xml version="1.0" encoding="UTF-8"?>\n<repomd xmlns="%s" xmlns:rpm="%s">\n' \
+                 '  <revision>%d</revision>\n%s</repomd>\n' % (
+                     RPM_MD_REPO_NS, RPM_MD_RPM_NS, timestamp,
+                     ''.join('  %s\n' % item for item in data + self.other_data))
+        _write_atomic(os.path.join(repodata_path, 'repomd.xml'), repomd.encode('utf-8'))
+
+        # metadata files which have been replaced are removed after repomd.xml has been updated
+        self.obsolete.update(self.metadata_paths)
+        self.metadata_paths = set(md_paths)
+        self._remove_obsolete(keep=md_paths + [self._location_path(name) for name in self.entries['primary']])
+        self.changed = False
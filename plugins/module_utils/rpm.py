@@ -0,0 +1,538 @@
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2024, Jakob Meng <jakobmeng@web.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Pure Python writer for RPM packages without any payload, i.e. meta packages, and reader for headers of RPM packages.
+#
+# An RPM package consists of a lead, a signature header, a header and a payload. The signature header holds sizes and
+# digests of header and payload. The header holds all package metadata including the relationships to other packages.
+# The payload is a gzip compressed cpio archive which is empty for meta packages.
+#
+# Ref.:
+#  https://rpm-software-management.github.io/rpm/manual/format_v4.html
+#  https://rpm-software-management.github.io/rpm/manual/tags.html
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import glob
+import gzip
+import hashlib
+import io
+import re
+import struct
+import time
+
+RPM_LEAD_MAGIC = b'\xed\xab\xee\xdb'
+RPM_HEADER_MAGIC = b'\x8e\xad\xe8\x01\x00\x00\x00\x00'
+
+# Tag data types
+RPM_CHAR_TYPE = 1
+RPM_INT8_TYPE = 2
+RPM_INT16_TYPE = 3
+RPM_INT32_TYPE = 4
+RPM_INT64_TYPE = 5
+RPM_STRING_TYPE = 6
+RPM_BIN_TYPE = 7
+RPM_STRING_ARRAY_TYPE = 8
+RPM_I18NSTRING_TYPE = 9
+
+# Signature tags
+RPMSIGTAG_SHA1 = 269
+RPMSIGTAG_SHA256 = 273
+RPMSIGTAG_SIZE = 1000
+RPMSIGTAG_MD5 = 1004
+RPMSIGTAG_PAYLOADSIZE = 1007
+
+# Header tags
+RPMTAG_HEADERSIGNATURES = 62
+RPMTAG_HEADERIMMUTABLE = 63
+RPMTAG_HEADERI18NTABLE = 100
+RPMTAG_NAME = 1000
+RPMTAG_VERSION = 1001
+RPMTAG_RELEASE = 1002
+RPMTAG_EPOCH = 1003
+RPMTAG_SUMMARY = 1004
+RPMTAG_DESCRIPTION = 1005
+RPMTAG_BUILDTIME = 1006
+RPMTAG_BUILDHOST = 1007
+RPMTAG_SIZE = 1009
+RPMTAG_VENDOR = 1011
+RPMTAG_LICENSE = 1014
+RPMTAG_PACKAGER = 1015
+RPMTAG_GROUP = 1016
+RPMTAG_URL = 1020
+RPMTAG_OS = 1021
+RPMTAG_ARCH = 1022
+RPMTAG_SOURCERPM = 1044
+RPMTAG_PROVIDENAME = 1047
+RPMTAG_REQUIREFLAGS = 1048
+RPMTAG_REQUIRENAME = 1049
+RPMTAG_REQUIREVERSION = 1050
+RPMTAG_CONFLICTFLAGS = 1053
+RPMTAG_CONFLICTNAME = 1054
+RPMTAG_CONFLICTVERSION = 1055
+RPMTAG_RPMVERSION = 1064
+RPMTAG_CHANGELOGTIME = 1080
+RPMTAG_CHANGELOGNAME = 1081
+RPMTAG_CHANGELOGTEXT = 1082
+RPMTAG_PROVIDEFLAGS = 1112
+RPMTAG_PROVIDEVERSION = 1113
+RPMTAG_PAYLOADFORMAT = 1124
+RPMTAG_PAYLOADCOMPRESSOR = 1125
+RPMTAG_PAYLOADFLAGS = 1126
+RPMTAG_RECOMMENDNAME = 5046
+RPMTAG_RECOMMENDVERSION = 5047
+RPMTAG_RECOMMENDFLAGS = 5048
+RPMTAG_SUGGESTNAME = 5049
+RPMTAG_SUGGESTVERSION = 5050
+RPMTAG_SUGGESTFLAGS = 5051
+RPMTAG_ENHANCENAME = 5055
+RPMTAG_ENHANCEVERSION = 5056
+RPMTAG_ENHANCEFLAGS = 5057
+RPMTAG_ENCODING = 5062
+RPMTAG_PAYLOADDIGEST = 5092
+RPMTAG_PAYLOADDIGESTALGO = 5093
+
+PGPHASHALGO_SHA256 = 8
+
+# Dependency flags
+RPMSENSE_LESS = 1 << 1
+RPMSENSE_GREATER = 1 << 2
+RPMSENSE_EQUAL = 1 << 3
+RPMSENSE_RPMLIB = 1 << 24
+
+RPMSENSE_OPERATORS = {
+    '<': RPMSENSE_LESS,
+    '<=': RPMSENSE_LESS | RPMSENSE_EQUAL,
+    '=': RPMSENSE_EQUAL,
+    '==': RPMSENSE_EQUAL,
+    '>=': RPMSENSE_GREATER | RPMSENSE_EQUAL,
+    '>': RPMSENSE_GREATER,
+}
+
+# Files which define macro %dist, in the order in which rpm reads them
+RPM_MACROS_PATHS = [
+    '/usr/lib/rpm/macros.d/macros.*',
+    '/etc/rpm/macros.*',
+]
+
+_dist = None
+
+
+def parse_relationship(relationship):
+    """Split a relationship such as 'foo >= 1.0' into a tuple (name, flags, version).
+
+    Rich (boolean) dependencies such as '(foo or bar)' are returned verbatim as name without flags nor version.
+    """
+    relationship = relationship.strip()
+    if relationship.startswith('('):
+        return relationship, 0, ''
+
+    tokens = relationship.split()
+    if len(tokens) == 1:
+        return tokens[0], 0, ''
+
+    if len(tokens) == 3 and tokens[1] in RPMSENSE_OPERATORS:
+        return tokens[0], RPMSENSE_OPERATORS[tokens[1]], tokens[2]
+
+    raise ValueError('invalid relationship: %s' % relationship)
+
+
+def _expand_macros(value, macros, depth=0):
+    """Expand a subset of the rpm macro language which is sufficient to evaluate macro %dist.
+
+    Supported are %name, %{name}, %{?name}, %{!?name}, %{?name:value}, %{!?name:value} and %{expand:value}. Lua
+    macros are expanded to empty strings because distributions use them only to prepend optional %distprefix macros.
+    """
+    if depth > 16:
+        raise ValueError('macro recursion too deep: %s' % value)
+
+    result = []
+    i = 0
+    while i < len(value):
+        c = value[i]
+        if c != '%':
+            result.append(c)
+            i += 1
+            continue
+
+        if value[i + 1:i + 2] == '%':
+            result.append('%')
+            i += 2
+            continue
+
+        if value[i + 1:i + 2] == '{':
+            # find matching closing brace
+            level = 0
+            j = i + 1
+            while j < len(value):
+                if value[j] == '{':
+                    level += 1
+                elif value[j] == '}':
+                    level -= 1
+                    if level == 0:
+                        break
+                j += 1
+            else:
+                raise ValueError('unterminated macro: %s' % value[i:])
+            body = value[i + 2:j]
+            i = j + 1
+        else:
+            match = re.match(r'[A-Za-z_][A-Za-z0-9_]*', value[i + 1:])
+            if not match:
+                result.append(c)
+                i += 1
+                continue
+            body = match.group(0)
+            i += 1 + len(body)
+
+        if body.startswith('lua:'):
+            continue
+
+        if body.startswith('expand:'):
+            result.append(_expand_macros(_expand_macros(body[len('expand:'):], macros, depth + 1), macros, depth + 1))
+            continue
+
+        negate = conditional = False
+        if body.startswith('!?'):
+            negate = conditional = True
+            body = body[2:]
+        elif body.startswith('?!'):
+            negate = conditional = True
+            body = body[2:]
+        elif body.startswith('?'):
+            conditional = True
+            body = body[1:]
+
+        name, sep, alternative = body.partition(':')
+
+        if conditional:
+            defined = name in macros
+            if defined != negate:
+                if sep:
+                    result.append(_expand_macros(alternative, macros, depth + 1))
+                elif not negate:
+                    result.append(_expand_macros(macros[name], macros, depth + 1))
+            continue
+
+        if name not in macros:
+            raise ValueError('undefined macro: %s' % name)
+
+        result.append(_expand_macros(macros[name], macros, depth + 1))
+
+    return ''.join(result)
+
+
+def read_macros(paths):
+    """Read macro definitions from rpm macro files, later definitions override earlier ones."""
+    macros = {}
+    for path in paths:
+        with io.open(path, encoding='utf-8', errors='replace') as f:
+            lines = f.read().split('\n')
+
+        definition = None
+        for line in lines:
+            if definition is not None:
+                definition += '\n' + line
+            elif line.startswith('%') and not line.startswith('%%'):
+                definition = line[1:]
+            else:
+                continue
+
+            if definition.endswith('\\'):
+                # continuation line
+                definition = definition[:-1]
+                continue
+
+            match = re.match(r'([A-Za-z_][A-Za-z0-9_]*)(\([^)]*\))?\s+(.*)$', definition, re.DOTALL)
+            definition = None
+            if match and not match.group(2):  # parametric macros are not needed
+                macros[match.group(1)] = match.group(3).strip()
+
+    return macros
+
+
+def rpm_dist(macros_paths=None):
+    """Evaluate macro %dist, e.g. '.fc39' or '.el9', from rpm macro files without spawning rpm.
+
+    The result is cached, hence macro files are read once per process only.
+    """
+    global _dist
+
+    if macros_paths is None and _dist is not None:
+        return _dist
+
+    paths = []
+    for pattern in (RPM_MACROS_PATHS if macros_paths is None else macros_paths):
+        paths.extend(sorted(glob.glob(pattern)))
+
+    macros = read_macros(paths)
+    dist = _expand_macros(macros['dist'], macros) if 'dist' in macros else ''
+
+    if macros_paths is None:
+        _dist = dist
+    return dist
+
+
+def _header(entries, region_tag):
+    """Build a header structure from a list of tuples (tag, type, count, data) including an immutable region."""
+
+    # Region tag comes first, all other tags are sorted by number
+    entries = sorted(entries, key=lambda entry: entry[0])
+    il = len(entries) + 1
+
+    index = []
+    store = io.BytesIO()
+    for tag, tag_type, count, data in entries:
+        if tag_type == RPM_INT32_TYPE:
+            # integers are aligned to their size
+            store.write(b'\0' * (-store.tell() % 4))
+        index.append(struct.pack('>iiii', tag, tag_type, store.tell(), count))
+        store.write(data)
+
+    # The trailer of the region tag is stored at the end of the data store. Its negative offset denotes the size of
+    # the index entries which are covered by the region, i.e. all of them.
+    region_offset = store.tell()
+    store.write(struct.pack('>iiii', region_tag, RPM_BIN_TYPE, -il * 16, 16))
+    index.insert(0, struct.pack('>iiii', region_tag, RPM_BIN_TYPE, region_offset, 16))
+
+    data = store.getvalue()
+    return RPM_HEADER_MAGIC + struct.pack('>ii', il, len(data)) + b''.join(index) + data
+
+
+def _string(tag, value, tag_type=RPM_STRING_TYPE):
+    return (tag, tag_type, 1, value.encode('utf-8') + b'\0')
+
+
+def _string_array(tag, values):
+    return (tag, RPM_STRING_ARRAY_TYPE, len(values), b''.join(value.encode('utf-8') + b'\0' for value in values))
+
+
+def _int32(tag, values):
+    return (tag, RPM_INT32_TYPE, len(values), b''.join(struct.pack('>I', value) for value in values))
+
+
+def _bin(tag, value):
+    return (tag, RPM_BIN_TYPE, len(value), value)
+
+
+def _relationships(name_tag, flags_tag, version_tag, relationships):
+    if not relationships:
+        return []
+
+    names, flags, versions = zip(*relationships)
+    return [
+        _string_array(name_tag, names),
+        _int32(flags_tag, flags),
+        _string_array(version_tag, versions),
+    ]
+
+
+def _empty_cpio():
+    # An empty newc cpio archive consists of the trailer entry only
+    name = b'TRAILER!!!\0'
+    fields = [0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, len(name), 0]
+    header = ('070701' + ''.join('%08X' % value for value in fields)).encode('ascii')
+    archive = header + name
+    return archive + b'\0' * (-len(archive) % 4)
+
+
+def make_rpm_archive(architecture,
+                     conflicts,
+                     depends,
+                     description,
+                     enhances,
+                     maintainer,
+                     name,
+                     recommends,
+                     release,
+                     suggests,
+                     summary,
+                     version,
+                     buildhost='localhost',
+                     buildtime=None):
+    """Return an RPM package without payload as bytes."""
+
+    if buildtime is None:
+        buildtime = int(time.time())
+
+    evr = '%s-%s' % (version, release)
+    nevr = '%s-%s' % (name, evr)
+
+    relationships = dict((key, [parse_relationship(relationship) for relationship in value])
+                         for key, value in [('conflicts', conflicts), ('depends', depends), ('enhances', enhances),
+                                            ('recommends', recommends), ('suggests', suggests)])
+
+    requires = list(relationships['depends'])
+    # rpm refuses to install packages with rich dependencies in any relationship tag unless they require this feature
+    if any(relationship[0].startswith('(') for value in relationships.values() for relationship in value):
+        requires.append(('rpmlib(RichDependencies)', RPMSENSE_RPMLIB | RPMSENSE_LESS | RPMSENSE_EQUAL, '4.12.0-1'))
+
+    cpio = _empty_cpio()
+    payload_buffer = io.BytesIO()
+    gz = gzip.GzipFile(filename='', mode='wb', fileobj=payload_buffer, mtime=0)
+    try:
+        gz.write(cpio)
+    finally:
+        gz.close()
+    payload = payload_buffer.getvalue()
+
+    # changelog entries are dated at noon
+    changelogtime = buildtime - buildtime % 86400 + 43200
+
+    entries = [
+        _string_array(RPMTAG_HEADERI18NTABLE, ['C']),
+        _string(RPMTAG_NAME, name),
+        _string(RPMTAG_VERSION, version),
+        _string(RPMTAG_RELEASE, release),
+        _string(RPMTAG_SUMMARY, summary, RPM_I18NSTRING_TYPE),
+        _string(RPMTAG_DESCRIPTION, description, RPM_I18NSTRING_TYPE),
+        _int32(RPMTAG_BUILDTIME, [buildtime]),
+        _string(RPMTAG_BUILDHOST, buildhost),
+        _int32(RPMTAG_SIZE, [0]),
+        _string(RPMTAG_LICENSE, 'GPL'),
+        _string(RPMTAG_PACKAGER, maintainer),
+        _string(RPMTAG_GROUP, 'Unspecified', RPM_I18NSTRING_TYPE),
+        _string(RPMTAG_OS, 'linux'),
+        _string(RPMTAG_ARCH, architecture),
+        # A binary package is identified by the name of its source package
+        _string(RPMTAG_SOURCERPM, '%s.src.rpm' % nevr),
+        _string_array(RPMTAG_PROVIDENAME, [name]),
+        _int32(RPMTAG_PROVIDEFLAGS, [RPMSENSE_EQUAL]),
+        _string_array(RPMTAG_PROVIDEVERSION, [evr]),
+        _string(RPMTAG_RPMVERSION, '4.11.3'),
+        _int32(RPMTAG_CHANGELOGTIME, [changelogtime]),
+        _string_array(RPMTAG_CHANGELOGNAME, ['%s %s' % (maintainer, version)]),
+        _string_array(RPMTAG_CHANGELOGTEXT, ['- Initial RPM release']),
+        _string(RPMTAG_PAYLOADFORMAT, 'cpio'),
+        _string(RPMTAG_PAYLOADCOMPRESSOR, 'gzip'),
+        _string(RPMTAG_PAYLOADFLAGS, '9'),
+        _string(RPMTAG_ENCODING, 'utf-8'),
+        _string_array(RPMTAG_PAYLOADDIGEST, [hashlib.sha256(payload).hexdigest()]),
+        _int32(RPMTAG_PAYLOADDIGESTALGO, [PGPHASHALGO_SHA256]),
+    ]
+    entries += _relationships(RPMTAG_REQUIRENAME, RPMTAG_REQUIREFLAGS, RPMTAG_REQUIREVERSION, requires)
+    entries += _relationships(RPMTAG_CONFLICTNAME, RPMTAG_CONFLICTFLAGS, RPMTAG_CONFLICTVERSION,
+                              relationships['conflicts'])
+    entries += _relationships(RPMTAG_RECOMMENDNAME, RPMTAG_RECOMMENDFLAGS, RPMTAG_RECOMMENDVERSION,
+                              relationships['recommends'])
+    entries += _relationships(RPMTAG_SUGGESTNAME, RPMTAG_SUGGESTFLAGS, RPMTAG_SUGGESTVERSION,
+                              relationships['suggests'])
+    entries += _relationships(RPMTAG_ENHANCENAME, RPMTAG_ENHANCEFLAGS, RPMTAG_ENHANCEVERSION,
+                              relationships['enhances'])
+
+    header = _header(entries, RPMTAG_HEADERIMMUTABLE)
+
+    signature = _header([
+        _string(RPMSIGTAG_SHA1, hashlib.sha1(header).hexdigest()),
+        _string(RPMSIGTAG_SHA256, hashlib.sha256(header).hexdigest()),
+        _int32(RPMSIGTAG_SIZE, [len(header) + len(payload)]),
+        _bin(RPMSIGTAG_MD5, hashlib.md5(header + payload).digest()),
+        _int32(RPMSIGTAG_PAYLOADSIZE, [len(cpio)]),
+    ], RPMTAG_HEADERSIGNATURES)
+    # signature header is padded to a multiple of 8 bytes
+    signature += b'\0' * (-len(signature) % 8)
+
+    # Lead is obsolete but still required, rpm checks its magic, version and signature type only
+    lead = struct.pack('>4sBBhh66shh16s',
+                       RPM_LEAD_MAGIC,
+                       3, 0,  # major and minor version
+                       0,  # binary package
+                       0,  # architecture number
+                       nevr.encode('utf-8')[:65],
+                       1,  # operating system number of Linux
+                       5,  # signature type of header-style signatures
+                       b'')
+
+    return lead + signature + header + payload
+
+
+def write_rpm(path, **kwargs):
+    with open(path, 'wb') as f:
+        f.write(make_rpm_archive(**kwargs))
+
+
+def rpm_filename(architecture, name, release, version):
+    return '{name}-{version}-{release}.{architecture}.rpm'.format(
+        architecture=architecture, name=name, release=release, version=version)
+
+
+def _read_header(f):
+    """Read a header structure from file object f.
+
+    Returns a dict which maps tags to values and the size of the header structure. Strings are returned as str, string
+    arrays and integers as lists and binary data as bytes. I18N strings are returned in the default locale only.
+    """
+    intro = f.read(16)
+    if intro[:8] != RPM_HEADER_MAGIC:
+        raise ValueError('invalid header magic')
+
+    il, dl = struct.unpack('>ii', intro[8:])
+    index = f.read(il * 16)
+    store = f.read(dl)
+    if len(index) != il * 16 or len(store) != dl:
+        raise ValueError('truncated header')
+
+    def strings(offset, count):
+        values = []
+        for i in range(count):
+            end = store.index(b'\0', offset)
+            values.append(store[offset:end].decode('utf-8'))
+            offset = end + 1
+        return values
+
+    integer_formats = {
+        RPM_CHAR_TYPE: 'B',
+        RPM_INT8_TYPE: 'B',
+        RPM_INT16_TYPE: 'H',
+        RPM_INT32_TYPE: 'I',
+        RPM_INT64_TYPE: 'Q',
+    }
+
+    tags = {}
+    for i in range(il):
+        tag, tag_type, offset, count = struct.unpack('>iiii', index[i * 16:(i + 1) * 16])
+        if tag_type in (RPM_STRING_TYPE, RPM_I18NSTRING_TYPE):
+            tags[tag] = strings(offset, 1)[0]
+        elif tag_type == RPM_STRING_ARRAY_TYPE:
+            tags[tag] = strings(offset, count)
+        elif tag_type in integer_formats:
+            integer_format = '>%d%s' % (count, integer_formats[tag_type])
+            tags[tag] = list(struct.unpack_from(integer_format, store, offset))
+        elif tag_type == RPM_BIN_TYPE:
+            tags[tag] = store[offset:offset + count]
+
+    return tags, 16 + len(index) + len(store)
+
+
+def read_rpm_header(path):
+    """Read signature header and header of an RPM package.
+
+    Returns the tags of the signature header and of the header as dicts, see _read_header(), and a tuple with start and
+    end offset of the header in the package file.
+    """
+    with open(path, 'rb') as f:
+        lead = f.read(96)
+        if lead[:4] != RPM_LEAD_MAGIC:
+            raise ValueError('%s is not an RPM package' % path)
+
+        signature, size = _read_header(f)
+        # signature header is padded to a multiple of 8 bytes
+        f.read(-size % 8)
+
+        start = f.tell()
+        header, size = _read_header(f)
+
+    return signature, header, (start, start + size)
+
+
+def header_relationships(header, name_tag, flags_tag, version_tag):
+    """Return relationships of an RPM header as a list of tuples (name, flags, version)."""
+    names = header.get(name_tag, [])
+    return list(zip(names,
+                    header.get(flags_tag, [0] * len(names)),
+                    header.get(version_tag, [''] * len(names))))
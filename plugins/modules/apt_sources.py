@@ -0,0 +1,592 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2024, Jakob Meng <jakobmeng@web.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = r'''
+---
+
+module: apt_sources
+
+short_description: Write apt keyrings and data sources in a single pass.
+
+description:
+    - "This module runs a list of tasks for Ansible modules C(apt_key), C(apt_repository), C(blockinfile),
+       C(deb822_repository) and C(replace) at once, e.g. all tasks of a distribution in variable
+       C(apt_repository_config) of role C(jm1.pkg.apt_repository). All files are read once, changed in memory by all
+       tasks in order and written only if their content hash or attributes differ from the files on disk afterwards.
+       Hence the module reports exactly which keyrings and sources files have changed, e.g. a file which one task
+       comments out and another task restores is not changed at all. The apt cache is never updated by this module,
+       instead the caller is expected to update it if any file has changed.
+
+       Parameters of tasks follow the Ansible modules with the same names, with these differences:
+       C(apt_key) requires C(keyring), downloads keys without gpg and writes dearmored keys, i.e. binary OpenPGP
+       packets, to C(keyring). Keys are downloaded only if C(id) is not found in C(keyring) already. Keys are fetched
+       from C(keyserver) via HKP, with C(https) unless another scheme such as C(hkp://) is given.
+       C(apt_repository) does not support PPAs and ignores C(update_cache).
+       C(blockinfile) supports regular expressions, C(BOF) and C(EOF) for C(insertafter) and C(insertbefore) only.
+       C(deb822_repository) writes fields in a fixed order, starting with C(X-Repolib-Name)."
+
+requirements: []
+
+options:
+
+    config:
+        description:
+            - "List of tasks to run in order. Each task is a dict with a single key, the name of the module, e.g.
+               C(ansible.builtin.apt_repository) or C(apt_repository), which maps to the module parameters. Keywords
+               such as C(when) are not supported."
+        required: true
+        type: list
+        elements: dict
+
+    sources_list:
+        default: /etc/apt/sources.list
+        description:
+            - "Path to the main apt data sources file, which is checked by C(apt_repository) tasks for existing
+               repositories."
+        type: path
+
+    sources_parts:
+        default: /etc/apt/sources.list.d
+        description:
+            - "Directory of apt data sources files, where C(apt_repository) and C(deb822_repository) tasks write to."
+        type: path
+
+notes:
+    - "Supports check mode and diff mode. In check mode keys are still downloaded to find out whether keyrings would
+       change."
+
+author: "Jakob Meng (@jm1)"
+'''
+
+EXAMPLES = r'''
+- jm1.pkg.apt_sources:
+    config:
+    - ansible.builtin.apt_key:
+        id: 605C66F00D6C9793
+        url: https://ftp-master.debian.org/keys/release-11.asc
+        keyring: /etc/apt/trusted.gpg.d/debian-archive-bullseye-stable.gpg
+    - ansible.builtin.replace:
+        path: /etc/apt/sources.list
+        regexp: '^([^#\n]*)$'
+        replace: '#\1'
+    - ansible.builtin.apt_repository:
+        repo: deb http://deb.debian.org/debian bullseye main contrib non-free
+        filename: debian-bullseye
+  register: result
+
+- ansible.builtin.apt:
+    update_cache: true
+  when: result is changed
+
+- jm1.pkg.apt_sources:
+    config: "{{ apt_repository_config_debian_13.trixie.deb + apt_repository_config_debian_13.trixie_security.deb }}"
+'''
+
+RETURN = r'''
+changed_files:
+    description: Paths of keyrings and sources files whose content or attributes have been changed, in order of tasks
+    returned: changed or success
+    type: list
+    elements: str
+    sample: [ '/etc/apt/sources.list', '/etc/apt/sources.list.d/debian-bullseye.list' ]
+
+changed_sources:
+    description:
+      - "Paths of sources files which have been changed and have not been removed, i.e. sources whose package lists
+         have to be updated. If only sources files have changed, then package lists of other sources are still
+         valid and the update can be limited to these files, e.g. with C(apt-get update -o Dir::Etc::sourcelist=PATH
+         -o Dir::Etc::sourceparts=- -o APT::Get::List-Cleanup=0) for each path."
+    returned: changed or success
+    type: list
+    elements: str
+    sample: [ '/etc/apt/sources.list.d/debian-bullseye.list' ]
+'''
+
+# NOTE: Synchronize imports with DOCUMENTATION string above
+from ansible.module_utils._text import to_bytes, to_native, to_text
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.module_utils.urls import open_url
+from ansible_collections.jm1.pkg.plugins.module_utils import openpgp
+from ansible_collections.jm1.pkg.plugins.module_utils.files import Files
+import os
+import re
+import traceback
+
+KEYRINGS_DIR = '/etc/apt/keyrings'
+
+VALID_SOURCE_TYPES = ('deb', 'deb-src')
+
+HKP_PORT = 11371
+
+# Parameters of tasks with their default values, per module. Parameters such as update_cache are accepted for
+# compatibility with Ansible's modules but have no effect.
+TASK_PARAMS = dict(
+    apt_key=dict(
+        data=None,
+        file=None,
+        id=None,
+        keyring=None,
+        keyserver=None,
+        state='present',
+        url=None,
+        validate_certs=True),
+    apt_repository=dict(
+        codename=None,
+        filename=None,
+        install_python_apt=True,
+        mode=None,
+        repo=None,
+        state='present',
+        update_cache=True,
+        update_cache_retries=None,
+        update_cache_retry_max_delay=None,
+        validate_certs=True),
+    blockinfile=dict(
+        block='',
+        create=False,
+        group=None,
+        insertafter=None,
+        insertbefore=None,
+        marker='# {mark} ANSIBLE MANAGED BLOCK',
+        marker_begin='BEGIN',
+        marker_end='END',
+        mode=None,
+        owner=None,
+        path=None,
+        state='present'),
+    deb822_repository=dict(
+        architectures=None,
+        by_hash=None,
+        check_date=None,
+        check_valid_until=None,
+        components=None,
+        enabled=None,
+        install_python_debian=False,
+        languages=None,
+        mode='0644',
+        name=None,
+        pdiffs=None,
+        signed_by=None,
+        state='present',
+        suites=None,
+        targets=None,
+        trusted=None,
+        types=['deb', 'deb-src'],
+        uris=None),
+    replace=dict(
+        group=None,
+        mode=None,
+        owner=None,
+        path=None,
+        regexp=None,
+        replace=''),
+)
+
+TASK_ALIASES = dict(
+    blockinfile=dict(dest='path', destfile='path', name='path'),
+    replace=dict(dest='path', destfile='path', name='path'),
+)
+
+MODULE_PREFIXES = ['ansible.builtin.', 'ansible.legacy.']
+
+# Fields of deb822 data sources in the order they are written
+DEB822_FIELDS = [
+    ('types', 'Types'),
+    ('uris', 'URIs'),
+    ('suites', 'Suites'),
+    ('components', 'Components'),
+    ('architectures', 'Architectures'),
+    ('languages', 'Languages'),
+    ('targets', 'Targets'),
+    ('pdiffs', 'PDiffs'),
+    ('by_hash', 'By-Hash'),
+    ('check_date', 'Check-Date'),
+    ('check_valid_until', 'Check-Valid-Until'),
+    ('enabled', 'Enabled'),
+    ('trusted', 'Trusted'),
+    ('signed_by', 'Signed-By'),
+]
+
+
+def fetch(url, validate_certs):
+    try:
+        return open_url(url, validate_certs=validate_certs).read()
+    except Exception as e:
+        raise Exception('failed to download %s: %s' % (url, to_native(e)))
+
+
+def keyserver_url(keyserver, key_id):
+    if '://' not in keyserver:
+        keyserver = 'https://' + keyserver
+
+    scheme, address = keyserver.split('://', 1)
+    address = address.rstrip('/')
+    if scheme == 'hkp':
+        scheme = 'http'
+        if ':' not in address:
+            address = '%s:%d' % (address, HKP_PORT)
+    elif scheme == 'hkps':
+        scheme = 'https'
+
+    return '%s://%s/pks/lookup?op=get&options=mr&search=0x%s' % (scheme, address, openpgp.normalize_key_id(key_id))
+
+
+def apt_key(params, files, module):
+    keyring = params['keyring']
+    key_id = params['id']
+    if not keyring:
+        raise ValueError('keyring is required, because apt-key is deprecated')
+
+    data = files.read(keyring) or b''
+    try:
+        existing = openpgp.keys(data)
+        invalid = False
+    except ValueError:
+        # e.g. keybox files written by gpg, which apt is not able to read, are replaced
+        existing = []
+        invalid = True
+
+    if params['state'] == 'absent':
+        if not key_id:
+            raise ValueError('id is required if state is absent')
+        remaining = [key for key in existing if not openpgp.matches(key, key_id)]
+        if len(remaining) != len(existing):
+            files.write(keyring, b''.join(key['data'] for key in remaining) if remaining else None, binary=True)
+        return
+
+    if key_id and any(openpgp.matches(key, key_id) for key in existing):
+        return
+
+    if params['data']:
+        source = 'data'
+        content = to_bytes(params['data'])
+    elif params['file']:
+        source = params['file']
+        with open(params['file'], 'rb') as f:
+            content = f.read()
+    elif params['url']:
+        source = params['url']
+        content = fetch(source, boolean(params['validate_certs']))
+    elif params['keyserver']:
+        if not key_id:
+            raise ValueError('id is required if keyserver is used')
+        source = keyserver_url(params['keyserver'], key_id)
+        content = fetch(source, boolean(params['validate_certs']))
+    else:
+        raise ValueError('one of data, file, keyserver or url is required')
+
+    keys = openpgp.keys(openpgp.dearmor(content) if openpgp.is_armored(content) else content)
+    if key_id and not any(openpgp.matches(key, key_id) for key in keys):
+        raise ValueError('key %s has not been found in %s' % (key_id, source))
+
+    known = set(fingerprint for key in existing for fingerprint in key['fingerprints'])
+    added = [key for key in keys if not known.issuperset(key['fingerprints'])]
+    if added or invalid:
+        files.write(keyring, b''.join(key['data'] for key in existing + added), binary=True)
+
+
+def parse_source(line):
+    """Return whether line is a valid one-line-style source, whether it is enabled, the source and its comment."""
+    valid = False
+    enabled = True
+    comment = ''
+
+    line = line.strip()
+    if line.startswith('#'):
+        enabled = False
+        line = line[1:]
+
+    index = line.find('#')
+    if index > 0:
+        comment = line[index + 1:].strip()
+        line = line[:index]
+
+    source = line.strip()
+    if source:
+        chunks = source.split()
+        if chunks[0] in VALID_SOURCE_TYPES:
+            valid = True
+            # duplicated whitespaces are removed
+            source = ' '.join(chunks)
+
+    return valid, enabled, source, comment
+
+
+def render_source(enabled, source, comment):
+    return '%s%s%s\n' % ('' if enabled else '# ', source, ' # ' + comment if comment else '')
+
+
+def source_filename(source, filename):
+    """Return filename of sources file for source, derived from its uri if filename is None, like apt_repository."""
+    if filename is None:
+        # drop options, protocols, types, usernames and passwords
+        line = re.sub(r'\[[^\]]+\]', '', source)
+        line = re.sub(r'\w+://', '', line)
+        uri = [part for part in line.split() if part not in VALID_SOURCE_TYPES][0]
+        filename = '_'.join(re.sub('[^a-zA-Z0-9]', ' ', uri.split('@', 1)[-1]).split())
+    return filename + '.list'
+
+
+def apt_repository(params, files, module):
+    repo = params['repo']
+    if not repo:
+        raise ValueError('repo is required')
+    if repo.startswith('ppa:'):
+        raise ValueError('PPA repositories are not supported')
+
+    valid, enabled, source, comment = parse_source(repo)
+    if not valid or not enabled:
+        raise ValueError("invalid repository string: '%s'" % repo)
+
+    paths = [module.params['sources_list']] + files.paths(module.params['sources_parts'], '.list')
+    found = False
+    for path in paths:
+        text = files.read_text(path)
+        if text is None:
+            continue
+
+        lines = text.splitlines(True)
+        kept = []
+        for line in lines:
+            line_valid, line_enabled, line_source, line_comment = parse_source(line)
+            if not line_valid or line_source != source:
+                kept.append(line)
+            elif params['state'] == 'present':
+                # disabled sources are reused, if any
+                found = True
+                kept.append(line if line_enabled else render_source(True, line_source, line_comment))
+
+        if kept != lines:
+            files.write_text(path, ''.join(kept) if kept or path == module.params['sources_list'] else None)
+
+    if params['state'] == 'absent' or found:
+        return
+
+    filename = source_filename(source, params['filename'])
+    if '/' not in filename:
+        filename = os.path.join(module.params['sources_parts'], filename)
+
+    text = files.read_text(filename)
+    if text is None:
+        files.set_attributes(filename, mode=params['mode'] or '0644')
+        text = ''
+    elif text and not text.endswith('\n'):
+        text += '\n'
+    files.write_text(filename, text + render_source(True, source, ''))
+
+
+def blockinfile(params, files, module):
+    path = params['path']
+    if not path:
+        raise ValueError('path is required')
+
+    text = files.read_text(path)
+    if text is None:
+        if not boolean(params['create']):
+            raise ValueError('Path %s does not exist !' % path)
+        text = ''
+
+    marker0 = params['marker'].replace('{mark}', params['marker_begin'])
+    marker1 = params['marker'].replace('{mark}', params['marker_end'])
+    if params['state'] == 'present' and params['block']:
+        blocklines = [marker0] + params['block'].splitlines() + [marker1]
+    else:
+        blocklines = []
+
+    lines = text.splitlines()
+    n0 = n1 = None
+    for index, line in enumerate(lines):
+        if line == marker0:
+            n0 = index
+        if line == marker1:
+            n1 = index
+
+    if None in (n0, n1):
+        insertafter = params['insertafter']
+        insertbefore = params['insertbefore']
+        n0 = len(lines)
+        if insertbefore == 'BOF':
+            n0 = 0
+        elif insertbefore or (insertafter and insertafter != 'EOF'):
+            regex = re.compile(insertbefore or insertafter)
+            matches = [index for index, line in enumerate(lines) if regex.search(line)]
+            if matches:
+                n0 = matches[-1] + (0 if insertbefore else 1)
+    elif n0 < n1:
+        lines[n0:n1 + 1] = []
+    else:
+        lines[n1:n0 + 1] = []
+        n0 = n1
+
+    lines[n0:n0] = blocklines
+    result = '\n'.join(lines)
+    if lines and (not text or text.endswith('\n')):
+        result += '\n'
+
+    if result != text or files.read(path) is None:
+        files.write_text(path, result)
+    files.set_attributes(path, mode=params['mode'], owner=params['owner'], group=params['group'])
+
+
+def replace(params, files, module):
+    path = params['path']
+    if not path or not params['regexp']:
+        raise ValueError('path and regexp are required')
+
+    text = files.read_text(path)
+    if text is None:
+        raise ValueError('Path %s does not exist !' % path)
+
+    result = re.compile(params['regexp'], re.MULTILINE).sub(params['replace'], text)
+    if result != text:
+        files.write_text(path, result)
+    files.set_attributes(path, mode=params['mode'], owner=params['owner'], group=params['group'])
+
+
+def deb822_filename(name):
+    return re.sub(r'[^a-z0-9-]+', '', re.sub(r'[_\s]+', '-', name.lower()))
+
+
+def deb822_value(value):
+    if isinstance(value, bool):
+        return 'yes' if value else 'no'
+    if isinstance(value, (list, tuple)):
+        return ' '.join(to_text(item) for item in value)
+    value = to_text(value).strip()
+    if '\n' in value:
+        # multiline values such as inline keys are continued with indented lines, empty lines are written as ' .'
+        return '\n' + '\n'.join(' ' + (line.strip() or '.') for line in value.splitlines())
+    return value
+
+
+def deb822_repository(params, files, module):
+    name = params['name']
+    if not name:
+        raise ValueError('name is required')
+
+    filename = deb822_filename(name)
+    path = os.path.join(module.params['sources_parts'], filename + '.sources')
+    key_paths = [os.path.join(KEYRINGS_DIR, '%s.%s' % (filename, extension)) for extension in ['asc', 'gpg']]
+
+    if params['state'] == 'absent':
+        for remove_path in [path] + key_paths:
+            if files.read(remove_path) is not None:
+                files.write(remove_path, None)
+        return
+
+    if not params['types'] or not params['uris'] or not params['suites']:
+        raise ValueError('types, uris and suites are required')
+
+    signed_by = params['signed_by']
+    if signed_by and '://' in signed_by:
+        # keys are downloaded to a keyring for this data source, like deb822_repository does
+        content = fetch(signed_by, True)
+        armored = openpgp.is_armored(content)
+        signed_by = key_paths[0 if armored else 1]
+        files.write(signed_by, content, binary=not armored)
+        files.set_attributes(signed_by, mode='0644')
+
+    values = dict(params, signed_by=signed_by)
+    for key in ['by_hash', 'check_date', 'check_valid_until', 'enabled', 'pdiffs', 'trusted']:
+        if values[key] is not None:
+            values[key] = boolean(values[key])
+
+    lines = ['X-Repolib-Name: %s\n' % name]
+    for key, field in DEB822_FIELDS:
+        if values[key] is not None:
+            lines.append('%s: %s\n' % (field, deb822_value(values[key])))
+
+    files.write_text(path, ''.join(lines))
+    files.set_attributes(path, mode=params['mode'])
+
+
+TASK_HANDLERS = dict(
+    apt_key=apt_key,
+    apt_repository=apt_repository,
+    blockinfile=blockinfile,
+    deb822_repository=deb822_repository,
+    replace=replace,
+)
+
+
+def is_sources(path, module):
+    return path == module.params['sources_list'] or (
+        os.path.dirname(path) == module.params['sources_parts'] and path.endswith(('.list', '.sources')))
+
+
+def task_params(item):
+    """Return module name and parameters with defaults of task item."""
+    if not isinstance(item, dict) or len(item) != 1:
+        raise ValueError('each task must be a dict with a single module, got: %s' % to_native(item))
+
+    name, args = list(item.items())[0]
+    short_name = name
+    for prefix in MODULE_PREFIXES:
+        if name.startswith(prefix):
+            short_name = name[len(prefix):]
+
+    if short_name not in TASK_PARAMS:
+        raise ValueError('module %s is not supported' % name)
+
+    params = dict(TASK_PARAMS[short_name])
+    for key, value in (args or {}).items():
+        key = TASK_ALIASES.get(short_name, {}).get(key, key)
+        if key not in params:
+            raise ValueError('unsupported parameter %s of module %s' % (key, name))
+        if value is not None:
+            params[key] = value
+    return short_name, params
+
+
+def core(module):
+    files = Files(module)
+
+    for index, item in enumerate(module.params['config']):
+        try:
+            name, params = task_params(item)
+            TASK_HANDLERS[name](params, files, module)
+        except ValueError as e:
+            raise ValueError('config[%d]: %s' % (index, to_native(e)))
+
+    changed_files = files.commit()
+    changed_sources = [path for path in changed_files
+                       if files.contents[path] is not None and is_sources(path, module)]
+    result = dict(changed=bool(changed_files), changed_files=changed_files, changed_sources=changed_sources)
+    if module._diff:
+        result['diff'] = files.diffs
+    return result
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            config=dict(type='list', elements='dict', required=True),
+            sources_list=dict(type='path', default='/etc/apt/sources.list'),
+            sources_parts=dict(type='path', default='/etc/apt/sources.list.d'),
+        ),
+        supports_check_mode=True,
+    )
+
+    try:
+        result = core(module)
+    except Exception as e:
+        module.fail_json(msg=to_native(e), exception=traceback.format_exc())
+
+    module.exit_json(**result)
+
+
+if __name__ == '__main__':
+    main()
@@ -44,16 +44,53 @@ description:
 
 requirements:
     - apt (e.g. in debian package python3-apt) [apt-based distributions only]
-    - babel (e.g. part of package python3-babel) [dnf-based, dnf5-based or yum-based distributions only]
     - backports.tempfile (python 2 only)
     - dnf [dnf-based distributions only]
-    - jinja2 (e.g. part of package python3-jinja2)
+    - dpkg-deb (e.g. in package dpkg) [apt-based distributions with I(builder=external) only]
+    - jinja2 (e.g. part of package python3-jinja2) [dnf-based, dnf5-based or yum-based distributions with
+      I(builder=external) only]
     - libdnf5 [dnf5-based distributions only]
-    - rpmbuild (e.g. in package rpm-build) [dnf-based, dnf5-based or yum-based distributions only]
+    - rpm (e.g. in package python3-rpm) [optional, dnf-based, dnf5-based or yum-based distributions only]
+    - rpmbuild (e.g. in package rpm-build) [dnf-based, dnf5-based or yum-based distributions with I(builder=external)
+      only]
     - yum (python 2 only) [yum-based distributions only]
 
 options:
 
+    artifact_cache:
+        default: /var/cache/jm1-pkg
+        description:
+            - "Directory where built meta packages are stored for reuse. Packages are identified by a hash of the
+               rendered Debian control file or RPM spec file, the package manager and the distribution tag. When a
+               package with the same hash is installed again, e.g. on reinstalls or re-provisioned hosts, then the
+               stored package will be installed without building it again. Set to an empty string to disable the
+               artifact cache."
+        type: path
+
+    artifact_cache_max_age:
+        default: 2592000
+        description:
+            - "Stored packages which have not been used for I(artifact_cache_max_age) seconds will be removed from
+               I(artifact_cache)."
+        type: int
+
+    artifact_cache_max_size:
+        default: 67108864
+        description:
+            - "Maximum size of I(artifact_cache) in bytes. When this size is exceeded, least recently used packages
+               will be removed from I(artifact_cache)."
+        type: int
+
+    artifacts:
+        description:
+            - "Meta packages which have been built on the controller, as a dict which maps keys of packages in
+               I(artifact_cache) to base64 encoded packages. This option is set by the action plugin if
+               I(build_on_controller) is enabled and is not meant to be set manually. Packages whose keys do not match
+               any meta package which has to be installed, e.g. because of a different distribution tag, are ignored
+               and the meta packages are built on the managed host instead. Packages are never logged on the managed
+               host."
+        type: dict
+
     architecture:
         aliases: [ buildarch ]
         default: all or noarch
@@ -61,6 +98,45 @@ options:
             - "Architecture specification string, e.g. C(all) for Debian or C(noarch) for Fedora."
         type: str
 
+    build_on_controller:
+        default: true
+        description:
+            - "Whether meta packages are built natively on the Ansible controller by the action plugin instead of on
+               each managed host. Each meta package is built once per package manager, distribution tag and content and
+               concurrent forks share a single build. Built packages are passed to the module with its arguments, so no
+               additional file transfers are required. Meta packages are built on the controller only if I(state) is
+               C(present), I(builder) is C(native), check mode is disabled and relationships do not contain wildcards.
+               The package manager is taken from I(manager) or gathered facts. By default, the module is run once to
+               find out whether meta packages have to be installed, e.g. not if they have been installed by this module
+               before and have not been changed since according to I(stamp_dir). Only then, meta packages are built
+               with the I(maintainer) and distribution tag reported by the module and passed to a second run of the
+               module, hence a task which installs or changes meta packages costs two module runs. If the task runs
+               asynchronously, meta packages are published or I(stamp_dir) is empty, then meta packages are built up
+               front and passed to a single run of the module instead, but only if I(maintainer) has been set and, on
+               dnf-based, dnf5-based and yum-based distributions, if the distribution tag can be derived from gathered
+               facts. Otherwise meta packages are built on the managed host."
+        type: bool
+
+    builder:
+        choices: [native, external]
+        default: native
+        description:
+            - "How meta packages are built. With C(native), Debian and RPM packages are written directly by this module,
+               which is fast and does not need any external tools. With C(external), Debian packages are built with
+               C(dpkg-deb) and RPM packages are built with C(rpmbuild)."
+        type: str
+
+    cache_only:
+        default: false
+        description:
+            - "Whether metadata of repositories is used from the package manager's cache only, i.e. without checking
+               whether it has expired and without downloading it, like C(dnf --cacheonly) or C(yum --cacheonly). On
+               dnf5-based distributions, option C(cacheonly) is set to C(metadata). On apt-based distributions, package
+               lists are never updated, like when C(apt-get update) is skipped. If cached metadata is missing or
+               cannot satisfy the dependencies of meta packages, then the module fails. Packages which have to be
+               installed are still downloaded from repositories. Mutually exclusive with I(metadata_max_age)."
+        type: bool
+
     conflicts:
         default: []
         description:
@@ -94,6 +170,19 @@ options:
                package can enhance the functionality of another package."
         type: list
 
+    lock_timeout:
+        default: 60
+        description:
+            - "Maximum time in seconds to wait for locks of package managers which are held by other processes, e.g.
+               by unattended-upgrades, PackageKit or parallel tasks. Locks are checked with exponential backoff and
+               random jitter. All waits of a module run share this budget. Checked locks are
+               C(/var/lib/dpkg/lock-frontend) and C(/var/lib/dpkg/lock) on apt-based distributions, the rpm transaction
+               lock C(.rpm.lock) on rpm-based distributions, dnf's C(rpmdb_lock.pid), dnf5's
+               C(/run/dnf/rpmtransaction.lock) and yum's C(/var/run/yum.pid). Locks are checked in C(/proc/locks)
+               without acquiring them. If a lock is still held when the budget is exhausted, the module fails. C(0)
+               disables waiting."
+        type: int
+
     maintainer:
         aliases: [ packager ]
         default: "{{Full Name}} <{{username}}@{{fqdn}}>"
@@ -107,15 +196,71 @@ options:
         default: auto
         description:
             - "The package manager to use, e.g. apt or yum. The default C(auto) will use existing facts or try to
-               autodetect it. You should only use this field if the automatic selection is not working for some reason."
+               autodetect it. If facts have been gathered, then fact C(pkg_mgr) will be passed to the module by the
+               action plugin. Else the module probes for the binary and the Python bindings of each supported package
+               manager and falls back to Ansible's fact collector. The detected package manager will be cached in
+               I(stamp_dir) until C(/etc/os-release) changes. You should only use this field if the automatic
+               selection is not working for some reason."
         type: str
 
+    metadata_max_age:
+        description:
+            - "Maximum age in seconds of metadata of repositories. Older metadata is refreshed when it is loaded. On
+               dnf-based, dnf5-based and yum-based distributions, this option overrides C(metadata_expire) of the
+               package manager's configuration and of all repositories. On apt-based distributions, package lists are
+               updated like with C(apt-get update) prior to installing meta packages if they are older, except in
+               check mode. The age of package lists is derived from C(/var/lib/apt/periodic/update-success-stamp) or,
+               if it does not exist, from C(/var/lib/apt/lists). If this option is omitted, the package manager's
+               configuration applies, i.e. package lists of apt are not updated by this module. Mutually exclusive
+               with I(cache_only)."
+        type: int
+
     name:
         description:
-            - "Meta package name."
-        required: true
+            - "Meta package name. Either I(name) or I(packages) is required."
         type: str
 
+    packages:
+        description:
+            - "List of meta packages which will be built, installed or removed together. Each item accepts the same
+               fields as the module itself, i.e. I(name), I(version), I(depends), I(conflicts), I(recommends),
+               I(suggests), I(enhances), I(summary), I(description), I(maintainer) and I(architecture). Fields which
+               are not defined in an item default to the module's values. If I(state) is C(absent), then only I(name)
+               is required for each item. Installing or removing all items from a single I(packages) list requires one
+               package cache or sack to be loaded and one package manager transaction only, which is considerably
+               faster than calling this module once per meta package. Mutually exclusive with I(name)."
+        elements: dict
+        type: list
+
+    plugins:
+        default: false
+        description:
+            - "Whether plugins of package managers dnf and dnf5 will be loaded. Plugins add noticeable startup time
+               and are rarely required to install or remove meta packages, e.g. plugins which update caches of other
+               tools. Ignored for other package managers."
+        type: bool
+
+    profile:
+        description:
+            - "Path on the managed host where a profile of the module run will be written to, using Python's
+               cProfile. The profile can be analyzed with Python's pstats module, e.g.
+               C(python3 -m pstats /tmp/meta_pkg.prof). The profile is written even if the module fails."
+        type: path
+
+    publish_to:
+        description:
+            - "Directory of a local package repository where meta packages will be published to instead of being
+               installed. If I(manager) evaluates to C(apt), then a flat apt repository with index files C(Packages),
+               C(Packages.gz) and an unsigned C(Release) is maintained, which clients use with e.g.
+               C(deb [trusted=yes] file:/srv/repo ./). Else an rpm-md repository with metadata in subdirectory
+               C(repodata) is maintained, like C(createrepo) generates it. Only index entries of meta packages which
+               have been added, changed or removed are regenerated, neither are other packages in the repository
+               rescanned. The repository holds a single version of each meta package. If I(state) is C(absent), then
+               meta packages are removed from the repository. Python bindings of the package manager are not
+               required for publishing, hence I(manager) may be set to publish meta packages for distributions other
+               than the one of the managed host. Wildcards in relationships are not supported."
+        type: path
+
     recommends:
         default: []
         description:
@@ -124,6 +269,27 @@ options:
                be available by default for users, I(recommends) should be used, and I(suggests) otherwise."
         type: list
 
+    request_artifacts:
+        default: false
+        description:
+            - "Whether the module returns without any change and with C(artifacts_requested) if meta packages have
+               to be installed but I(artifacts) have not been passed. Along with C(artifacts_requested), the module
+               returns the I(maintainer) and the distribution tag C(dist) of the managed host, with which the action
+               plugin builds meta packages on the controller and passes them in I(artifacts) to a second run of the
+               module. This option is set by the action plugin if I(build_on_controller) is enabled and I(stamp_dir) is
+               not empty, and is not meant to be set manually."
+        type: bool
+
+    stamp_dir:
+        default: /var/lib/jm1-pkg
+        description:
+            - "Directory where this module records name, version and relationship fingerprint of every meta package it
+               has installed. When all meta packages have been recorded with the same version and the same
+               relationships before, then this module returns without loading the package cache or sack. The package
+               manager detected with I(manager=auto) is cached here, too. Set to an empty string to always query the
+               package manager."
+        type: path
+
     state:
         choices: [present, absent]
         default: present
@@ -154,10 +320,46 @@ options:
         type: str
 
 notes:
-  - "If a package with the same name and version is installed already then this module exists without applying any
-     changes to the system."
+  - "If a package with the same name and version is installed already and it declares the same relationships, then
+     this module exists without applying any changes to the system. Relationships are compared using a fingerprint,
+     i.e. a hash of the normalized relationships I(depends), I(conflicts), I(recommends), I(suggests) and
+     I(enhances), which is embedded in the meta package. If the relationships have been changed but the version has
+     not, then the meta package will be rebuilt and reinstalled. Meta packages built by previous releases of this
+     module do not embed a fingerprint and hence will be reinstalled once."
+  - "Whether meta packages are installed already is probed without loading the package cache of apt or the sack of dnf
+     and dnf5. On apt-based distributions dpkg's status file C(/var/lib/dpkg/status) is read directly, on dnf-based,
+     dnf5-based and yum-based distributions the rpm database is queried using the rpm Python bindings if available.
+     The package cache or sack is loaded only if packages have to be installed or removed."
+  - "Package names in I(depends), I(conflicts), I(recommends), I(suggests) and I(enhances) may contain shell-style
+     wildcards, e.g. C(python3-*-doc) or C(fonts-noto* (>= 20201225)). Wildcards are expanded against all packages
+     which are available from the package manager's repositories or installed already, each match inheriting the
+     version constraint. Patterns in I(depends) which do not match any package are an error, other patterns without
+     any match are dropped. Wildcards are not supported in alternatives such as C(a | b) or in rich dependencies.
+     Wildcards are expanded only when a meta package is built. Because the fingerprint of the relationships is
+     computed from the patterns, packages which match a pattern later will be added on the next change of the
+     version or the relationships only."
+  - "If I(packages) is used, then all meta packages which are not installed already will be installed with a single
+     transaction. If this transaction fails, then none of the meta packages will have been installed. Likewise, if
+     I(state) is C(absent), then all meta packages which are installed will be removed with a single transaction,
+     followed by a single autoremove pass on dnf-based, dnf5-based and yum-based distributions."
+  - "On apt-based distributions, meta packages are installed within the module's process using python-apt. Their
+     dependencies and recommendations are marked on the apt cache which has been loaded for probing already and are
+     installed first, followed by a single run of dpkg for all meta packages. apt's frontend lock is held throughout,
+     see I(lock_timeout) if it is held by another process. Progress of dpkg is reported as debug messages. If
+     python-apt cannot resolve the meta packages on its own, e.g. because they conflict with installed packages or
+     depend on each other, then they are installed with apt-get instead."
+  - "On yum-based distributions, meta packages are installed and removed within the module's process, using a single
+     instance of yum's YumBase for probing, resolving and running the transaction, hence yum's plugins and metadata of
+     repositories are loaded at most once. yum's lock is held while the transaction is run, see I(lock_timeout) if it
+     is held by another process."
   - "Prior to installing a meta package on apt (deb) based distributions, one might use M(apt) to update the package
      cache and hence avoid unsatisfied dependency errors."
+  - "In check mode the installed state of meta packages is probed like in normal runs and the transaction is resolved
+     without being run. Packages which would be installed or removed are returned in I(would_install) and
+     I(would_remove). On apt-based distributions, relationships of meta packages are marked on apt's in-memory
+     depcache without building any package and without evaluating version constraints. On dnf-based, dnf5-based and
+     yum-based distributions, meta packages are built natively in a temporary directory for resolving, but are not
+     stored in I(artifact_cache)."
   - "If I(state) is C(absent), any package with the given name is removed, regardless of the version and whether or not
      its a meta package."
   - "If I(state) is C(absent) and I(manager) evaluates to C(apt), then this module will act as module M(apt), i.e. it
@@ -188,6 +390,42 @@ EXAMPLES = r'''
     - vim
     conflicts:
     - clang
+
+- jm1.pkg.meta_pkg:
+    maintainer: "Jakob Meng <jakobmeng@web.de>"
+    packages:
+    - name: "developer-tools"
+      version: "2"
+      depends:
+      - make
+      - gcc
+      - git
+    - name: "editors"
+      depends:
+      - vim
+      - emacs
+
+- jm1.pkg.meta_pkg:
+    name: "developer-tools"
+    depends:
+    - make
+    - gcc
+    manager: dnf
+    publish_to: /srv/repo/fedora
+  delegate_to: repo.example.com
+
+- jm1.pkg.meta_pkg:
+    name: "developer-tools"
+    depends:
+    - make
+    - gcc
+    metadata_max_age: 86400
+
+- jm1.pkg.meta_pkg:
+    packages:
+    - name: "developer-tools"
+    - name: "editors"
+    state: absent
 '''
 
 RETURN = r'''
@@ -197,18 +435,46 @@ conflicts:
     type: list
     sample: [ 'clang' ]
 
+controller_build:
+    description: Number of meta packages which have been built on the controller and the time it took in seconds
+    returned: if meta packages have been built on the controller
+    type: dict
+    sample: { 'packages': 2, 'elapsed': 0.0042 }
+
 depends:
     description: List of required packages after wildcard expansion
     returned: changed or success
     type: list
     sample: [ 'make', 'gcc', 'git', 'vim' ]
 
+detection:
+    description:
+      - "How the package manager has been detected and how long it took in seconds. Source is one of C(parameter)
+         if I(manager) is not C(auto), C(facts) if gathered facts have been used, C(cache) if the detection has
+         been cached in I(stamp_dir), C(probe) if binaries and Python bindings have been probed and C(collector) if
+         Ansible's fact collector has been used."
+    returned: changed or success
+    type: dict
+    sample: { 'source': 'facts', 'elapsed': 0.0001 }
+
 enhances:
     description: List of enhanced packages after wildcard expansion
     returned: changed or success
     type: list
     sample: []
 
+fingerprint:
+    description: Hash of the normalized relationships which is embedded in the meta package
+    returned: changed or success
+    type: str
+    sample: '0d1ab2f0c3a5e8b6d4e0f1a2b3c4d5e6f708192a3b4c5d6e7f8091a2b3c4d5e6'
+
+lock_wait:
+    description: Time in seconds which has been spent waiting for locks of package managers held by other processes
+    returned: changed or success
+    type: float
+    sample: 0.0
+
 maintainer:
     description: The package maintainer’s name and email address
     returned: changed or success
@@ -221,17 +487,71 @@ manager:
     type: str
     sample: 'apt'
 
+packages:
+    description: Meta packages and whether each of them has been changed, if I(packages) was used
+    returned: changed or success
+    type: list
+    elements: dict
+    sample: [ { 'name': 'developer-tools', 'version': '2', 'changed': true, 'depends': [ 'make', 'gcc', 'git' ] } ]
+
+peak_rss:
+    description: Peak resident set size of the module process in kilobytes
+    returned: changed or success
+    type: int
+    sample: 52312
+
 recommends:
     description: List of recommended packages after wildcard expansion
     returned: changed or success
     type: list
     sample: []
 
+repository:
+    description: Path and format, i.e. C(apt) or C(rpm-md), of the repository which meta packages have been published to
+    returned: if I(publish_to) has been used
+    type: dict
+    sample: { 'path': '/srv/repo', 'format': 'apt' }
+
+resolved_from:
+    description:
+      - "Whether dependencies of installed meta packages have been resolved from installed packages only
+         (C(installed)) or required metadata of repositories (C(repositories)). Only dnf and dnf5 are able to resolve
+         from installed packages only. C(null) if no meta package had to be installed."
+    returned: changed or success
+    type: str
+    sample: 'installed'
+
 suggests:
     description: List of suggested packages after wildcard expansion
     returned: changed or success
     type: list
     sample: []
+
+timings:
+    description:
+      - "Wall time in seconds spent in each phase of the module run and in total. Phases are C(setup), C(detection)
+         of the package manager, C(import) of its Python bindings, C(stamp) checks and updates, C(probe) of installed
+         packages, C(load) of package caches, sacks or repositories, C(expand) of wildcards, C(render) of control files
+         or spec files, C(build) of packages, C(resolve) of dependencies, package manager C(transaction),
+         C(publish) to repositories and C(cleanup) of build directories. Phases which have not been run are
+         omitted."
+    returned: changed or success
+    type: dict
+    sample: { 'setup': 0.0012, 'detection': 0.0001, 'import': 0.0213, 'stamp': 0.0004, 'total': 0.0230 }
+
+would_install:
+    description: Packages which would be installed, including the meta packages themselves, in check mode only
+    returned: check mode
+    type: list
+    elements: str
+    sample: [ 'developer-tools', 'gcc', 'make' ]
+
+would_remove:
+    description: Packages which would be removed, e.g. due to conflicts or removal of meta packages, in check mode only
+    returned: check mode
+    type: list
+    elements: str
+    sample: []
 '''
 
 # NOTE: Synchronize imports with DOCUMENTATION string above
@@ -241,58 +561,50 @@ from ansible.module_utils.common.dict_transformations import dict_merge
 from ansible.module_utils.facts import ansible_collector
 from ansible.module_utils.facts import default_collectors
 from ansible.module_utils.facts.namespace import PrefixFactNamespace
+from ansible_collections.jm1.pkg.plugins.module_utils.build import (
+    DEB_FINGERPRINT_FIELD,
+    PKG_DEFAULTS,
+    artifact_key,
+    default_maintainer,
+    meta_packages,
+    native_artifact,
+    render_control,
+    rpm_fingerprint,
+)
+from ansible_collections.jm1.pkg.plugins.module_utils.package_index import PackageIndex, is_glob
+from ansible_collections.jm1.pkg.plugins.module_utils.repository import AptRepository, RpmMdRepository
+from ansible_collections.jm1.pkg.plugins.module_utils.rpm import rpm_dist, rpm_filename
 import ansible.module_utils.six as six
+import base64
+import cProfile
 import datetime
-import jinja2
+import errno
+import hashlib
+import json
+import mmap
 import os
-import pwd
-import socket
+import random
+import resource
+import shutil
+import time
 import traceback
 
-try:
-    import apt
-except ImportError:
-    APT_IMPORT_ERROR = traceback.format_exc()
-    HAS_APT = False
-else:
-    APT_IMPORT_ERROR = None
-    HAS_APT = True
-
-try:
-    import babel.dates
-except ImportError:
-    BABEL_IMPORT_ERROR = traceback.format_exc()
-    HAS_BABEL = False
-else:
-    BABEL_IMPORT_ERROR = None
-    HAS_BABEL = True
-
-try:
-    import dnf
-except ImportError:
-    DNF_IMPORT_ERROR = traceback.format_exc()
-    HAS_DNF = False
-else:
-    DNF_IMPORT_ERROR = None
-    HAS_DNF = True
-
-try:
-    import libdnf5
-except ImportError:
-    LIBDNF5_IMPORT_ERROR = traceback.format_exc()
-    HAS_LIBDNF5 = False
-else:
-    LIBDNF5_IMPORT_ERROR = None
-    HAS_LIBDNF5 = True
-
-try:
-    import yum  # is Python 2 only
-except ImportError:
-    YUM_IMPORT_ERROR = traceback.format_exc()
-    HAS_YUM = False
-else:
-    YUM_IMPORT_ERROR = None
-    HAS_YUM = True
+# Python bindings of package managers are imported with import_bindings() once the package manager is known, because
+# importing e.g. dnf and libdnf5 takes a considerable share of the run time of this module.
+apt = None
+apt_pkg = None
+dnf = None
+libdnf5 = None
+rpm = None
+yum = None
+
+# Python modules which provide the bindings of each package manager
+MANAGER_BINDINGS = dict(
+    apt='apt',
+    dnf='dnf',
+    dnf5='libdnf5',
+    yum='yum',  # is Python 2 only
+)
 
 
 if six.PY2:
@@ -308,27 +620,6 @@ elif six.PY3:
     import tempfile
 
 
-# A blank line marks the end of control file
-DEBIAN_CONTROLFILE_TEMPLATE = r'''
-Section: metapackages
-Priority: optional
-Standards-Version:  4.5.0
-Package: {{ name }}
-Version: {{ version }}
-Architecture: {{ architecture }}
-Maintainer: {{ maintainer }}
-Rules-Requires-Root: no
-Multi-Arch: foreign
-Conflicts: {{ conflicts|join(', ') }}
-Depends: {{ depends|join(', ') }}
-Enhances: {{ enhances|join(', ') }}
-Recommends: {{ recommends|join(', ') }}
-Suggests: {{ suggests|join(', ') }}
-Description: {{ summary }}
- {{ description|wordwrap(width=80)|indent(1) }}
-
-'''
-
 RPM_SPEC_TEMPLATE = r'''
 {% if summary %}
 Summary: {{ summary }}
@@ -360,10 +651,12 @@ Requires: {{ depends|join(', ') }}
 Suggests:  {{ suggests|join(', ') }}
 {% endif %}
 
-{% if description %}
 %description
+{% if description %}
 {{ description|wordwrap(width=80) }}
+
 {% endif %}
+jm1-pkg-fingerprint: {{ fingerprint }}
 
 %prep
 %setup -c -T
@@ -375,11 +668,18 @@ Suggests:  {{ suggests|join(', ') }}
 %files
 
 %changelog
-* {{ format_date(now(), "EEE MMM dd yyyy", locale='en') }} {{ maintainer }} {{ version }}
+* {{ changelog_date }} {{ maintainer }} {{ version }}
 - Initial RPM release
 
 '''
 
+DPKG_STATUS_PATH = '/var/lib/dpkg/status'
+
+OS_RELEASE_PATHS = ['/etc/os-release', '/usr/lib/os-release']
+
+# Name of the file in stamp_dir which caches the detected package manager. Package names cannot start with a dot.
+MANAGER_CACHE_NAME = '.manager'
+
 ENV_VARS = dict(
     # We screenscrape apt-get, yum and dnf output for information so
     # we need to make sure we use the C locale when running commands
@@ -394,6 +694,594 @@ APT_ENV_VARS = dict(
     DEBIAN_PRIORITY='critical',
 )
 
+# Touched by apt after package lists have been updated successfully, e.g. by apt-get update
+APT_UPDATE_SUCCESS_STAMP_PATH = '/var/lib/apt/periodic/update-success-stamp'
+
+# Locks of dpkg, which are held by frontends such as apt-get or unattended-upgrades and by dpkg itself
+DPKG_LOCK_PATHS = ['/var/lib/dpkg/lock-frontend', '/var/lib/dpkg/lock']
+
+# Transaction lock of rpm, which has been moved along with the rpm database on recent distributions
+RPM_LOCK_PATHS = ['/usr/lib/sysimage/rpm/.rpm.lock', '/var/lib/rpm/.rpm.lock']
+
+# Transaction lock of libdnf5
+DNF5_LOCK_PATH = '/run/dnf/rpmtransaction.lock'
+
+# Pid files of dnf's rpmdb lock, relative to dnf's persistdir, and of yum's lock
+DNF_LOCK_NAME = 'rpmdb_lock.pid'
+YUM_LOCK_PATH = '/var/run/yum.pid'
+
+PROC_LOCKS_PATH = '/proc/locks'
+
+# Delays in seconds between checks of locks which are held by other processes, doubled after each check
+LOCK_BACKOFF_INITIAL = 0.1
+LOCK_BACKOFF_MAX = 5.0
+
+# Appended to errors of resolving transactions if option cache_only is enabled
+CACHE_ONLY_HINT = ' (metadata of repositories has been used from cache only, because cache_only is enabled)'
+
+CHANGELOG_WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+CHANGELOG_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def changelog_date(date):
+    # Changelog dates have to be in English regardless of the locale, e.g. 'Wed Jul 10 2024'
+    return '{weekday} {month} {day:02d} {year}'.format(
+        weekday=CHANGELOG_WEEKDAYS[date.weekday()],
+        month=CHANGELOG_MONTHS[date.month - 1],
+        day=date.day,
+        year=date.year)
+
+
+def find_bindings(manager):
+    """Return whether Python bindings of manager are available without importing them."""
+    try:
+        import importlib.util
+    except ImportError:  # Python 2
+        import imp
+        try:
+            imp.find_module(MANAGER_BINDINGS[manager])
+        except ImportError:
+            return False
+        return True
+    try:
+        return importlib.util.find_spec(MANAGER_BINDINGS[manager]) is not None
+    except ValueError:  # bindings have been imported already but lack a module spec
+        return True
+
+
+def import_bindings(manager):
+    """Import Python bindings of manager.
+
+    Returns None on success and the traceback if bindings of manager could not be imported.
+    """
+    global apt, apt_pkg, dnf, libdnf5, yum
+
+    try:
+        if manager == 'apt':
+            import apt
+            import apt.debfile
+            import apt.progress.base
+            import apt_pkg
+        elif manager == 'dnf':
+            import dnf
+        elif manager == 'dnf5':
+            import libdnf5
+        elif manager == 'yum':
+            import yum
+    except ImportError:
+        return traceback.format_exc()
+
+    return None
+
+
+def import_rpm(manager):
+    """Import Python bindings of rpm on rpm-based distributions, which are cheap compared to those of manager."""
+    global rpm
+
+    if manager in ['dnf', 'dnf5', 'yum']:
+        try:
+            import rpm
+        except ImportError:
+            pass  # rpm bindings are optional, the package manager will be queried instead
+
+
+def require_bindings(manager, timings, module):
+    bindings_import_error = import_bindings(manager)
+    if bindings_import_error:
+        module.fail_json(msg=missing_required_lib(MANAGER_BINDINGS[manager]), exception=bindings_import_error)
+    timings.lap('import')
+
+
+def read_stamp(stamp_dir, name):
+    try:
+        with open(os.path.join(stamp_dir, name)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_stamp(stamp_dir, manager, pkg, module):
+    stamp = dict(fingerprint=pkg['fingerprint'], manager=manager, name=pkg['name'], version=pkg['version'])
+    stamp_path = os.path.join(stamp_dir, pkg['name'])
+    tmp_path = '%s.%d.tmp' % (stamp_path, os.getpid())
+    try:
+        if not os.path.isdir(stamp_dir):
+            os.makedirs(stamp_dir, mode=0o755)
+        with open(tmp_path, 'w') as f:
+            json.dump(stamp, f, sort_keys=True)
+        os.rename(tmp_path, stamp_path)
+    except (IOError, OSError) as e:
+        module.warn('stamp file %s could not be written: %s' % (stamp_path, to_native(e)))
+
+
+def remove_stamp(stamp_dir, name):
+    try:
+        os.remove(os.path.join(stamp_dir, name))
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def is_stamped(stamp_dir, manager, pkg):
+    stamp = read_stamp(stamp_dir, pkg['name'])
+    if stamp is None:
+        return False
+
+    expected = dict(fingerprint=pkg['fingerprint'], manager=manager, version=pkg['version'])
+    return all(stamp.get(key) == value for key, value in expected.items())
+
+
+def os_release_hash():
+    for path in OS_RELEASE_PATHS:
+        try:
+            with open(path, 'rb') as f:
+                return hashlib.sha256(f.read()).hexdigest()
+        except (IOError, OSError):
+            continue
+    return None
+
+
+def probe_manager(module):
+    # Decision table: A package manager is usable if both its binary and its Python bindings are available. If dnf is
+    # a link to dnf5, e.g. on Fedora 41 and later, then dnf5 is preferred although dnf's Python bindings might exist.
+    dnf_path = module.get_bin_path('dnf')
+    if dnf_path and os.path.basename(os.path.realpath(dnf_path)) == 'dnf5' and find_bindings('dnf5'):
+        return 'dnf5'
+
+    for manager, binary in [('dnf', 'dnf'),
+                            ('dnf5', 'dnf5'),
+                            ('yum', 'yum'),
+                            ('apt', 'apt-get')]:
+        if module.get_bin_path(binary) and find_bindings(manager):
+            return manager
+
+    return None
+
+
+def collect_manager(module):
+    # Inspired by https://github.com/ansible/ansible/blob/devel/lib/ansible/modules/setup.py
+    namespace = PrefixFactNamespace(namespace_name='ansible', prefix='ansible_')
+
+    fact_collector = \
+        ansible_collector.get_ansible_collector(all_collector_classes=default_collectors.collectors,
+                                                namespace=namespace,
+                                                filter_spec='*',
+                                                gather_subset=['pkg_mgr'],
+                                                minimal_gather_subset=frozenset(['pkg_mgr']))
+
+    facts_dict = fact_collector.collect(module=module)
+    return facts_dict['ansible_pkg_mgr']
+
+
+def detect_manager(stamp_dir, module):
+    """Return the package manager of the host and the source it has been detected from.
+
+    The detected package manager is cached in stamp_dir, keyed by a hash of os-release, which changes on distribution
+    upgrades. If no usable package manager can be probed, then Ansible's fact collector is used as a fallback.
+    """
+    os_release = os_release_hash()
+
+    if stamp_dir and os_release:
+        cached = read_stamp(stamp_dir, MANAGER_CACHE_NAME)
+        if cached and cached.get('os_release') == os_release:
+            return cached['manager'], 'cache'
+
+    manager = probe_manager(module)
+    if manager:
+        source = 'probe'
+    else:
+        manager = collect_manager(module)
+        source = 'collector'
+
+    if stamp_dir and os_release and manager in ['apt', 'dnf', 'dnf5', 'yum']:
+        cache_path = os.path.join(stamp_dir, MANAGER_CACHE_NAME)
+        tmp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+        try:
+            if not os.path.isdir(stamp_dir):
+                os.makedirs(stamp_dir, mode=0o755)
+            with open(tmp_path, 'w') as f:
+                json.dump(dict(manager=manager, os_release=os_release), f, sort_keys=True)
+            os.rename(tmp_path, cache_path)
+        except (IOError, OSError) as e:
+            module.warn('package manager cache %s could not be written: %s' % (cache_path, to_native(e)))
+
+    return manager, source
+
+
+def is_probed(manager, pkgs):
+    # Stamps might be outdated, e.g. when packages have been removed without this module. If a cheap probe is
+    # available, then it is used to verify that stamped packages are still installed.
+    installed = probe_installed(manager, [pkg['name'] for pkg in pkgs])
+    if installed is None:
+        return True
+
+    # packages which have to be reinstalled are part of missing_pkgs already
+    missing_pkgs, _ = check_installed(pkgs, installed)
+    return not missing_pkgs
+
+
+class Timings(object):
+    """Wall time per phase of a module run.
+
+    Time is accounted with laps, i.e. lap(phase) adds the time since the previous lap to phase. This is cheap enough
+    to be always enabled.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.start = self.last = time.time()
+
+    def lap(self, phase):
+        now = time.time()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def result(self):
+        return dict(self.phases, total=time.time() - self.start)
+
+
+class LockHeldError(Exception):
+    pass
+
+
+def lock_holders(paths):
+    """Return pids of other processes which hold a lock on any file in paths, e.g. with fcntl() or flock().
+
+    Locks are looked up in /proc/locks by inode, so locks are never acquired for checking, which could let another
+    process fail to acquire its lock. Returns an empty list if no lock is held or if /proc/locks is not available.
+    """
+    inodes = set()
+    for path in paths:
+        try:
+            inodes.add(os.stat(path).st_ino)
+        except OSError:
+            pass  # lock files which do not exist cannot be locked
+
+    if not inodes:
+        return []
+
+    holders = []
+    try:
+        with open(PROC_LOCKS_PATH) as f:
+            for line in f:
+                # e.g. '1: POSIX  ADVISORY  WRITE 1234 fe:00:553964 0 EOF', processes blocked on a lock are listed
+                # with '->' after the lock id
+                fields = line.split()
+                if len(fields) < 6 or fields[1] == '->':
+                    continue
+                pid = int(fields[4])
+                inode = int(fields[5].rsplit(':', 1)[1])
+                if inode in inodes and pid != os.getpid() and pid not in holders:
+                    holders.append(pid)
+    except (IOError, OSError, ValueError):
+        return []
+    return holders
+
+
+def pid_file_holder(path):
+    """Return the pid in pid file path as a list if it belongs to another running process, like locks of dnf and yum."""
+    try:
+        with open(path) as f:
+            pid = int(f.read().strip())
+    except (IOError, OSError, ValueError):
+        return []
+    return [pid] if pid != os.getpid() and os.path.exists('/proc/%d' % pid) else []
+
+
+def process_names(pids):
+    names = []
+    for pid in pids:
+        try:
+            with open('/proc/%d/comm' % pid) as f:
+                names.append('%d (%s)' % (pid, f.read().strip()))
+        except (IOError, OSError):
+            names.append(str(pid))
+    return ', '.join(names)
+
+
+class LockWaiter(object):
+    """Waits with exponential backoff for locks of package managers which are held by other processes.
+
+    All waits of a module run share a budget of timeout seconds, the total time waited is kept in waited.
+    """
+
+    def __init__(self, timeout, module):
+        self.timeout = timeout
+        self.waited = 0.0
+        self.module = module
+
+    def remaining(self):
+        return max(0.0, self.timeout - self.waited)
+
+    def acquire(self, description, holders, fn=None, lock_errors=()):
+        """Wait until no other process holds a lock, then call fn and return its result.
+
+        holders is a function which returns the pids of other processes holding the lock. If fn raises one of
+        lock_errors, e.g. because another process has acquired the lock in the meantime, then fn is retried.
+        """
+        delay = LOCK_BACKOFF_INITIAL
+        while True:
+            pids = holders()
+            if pids:
+                reason = 'held by process %s' % process_names(pids)
+            elif fn is None:
+                return None
+            else:
+                try:
+                    return fn()
+                except lock_errors as e:
+                    reason = to_native(e)
+
+            if self.waited >= self.timeout:
+                raise Exception('Timed out after waiting {waited:.1f} seconds for {description}: {reason}'.format(
+                    waited=self.waited, description=description, reason=reason))
+
+            # Random jitter spreads retries of module runs which are waiting for the same lock
+            sleep = min(delay * random.uniform(0.5, 1.0), self.remaining())
+            self.module.debug('waiting {sleep:.1f} seconds for {description}: {reason}'.format(
+                sleep=sleep, description=description, reason=reason))
+            start = time.time()
+            time.sleep(sleep)
+            self.waited += time.time() - start
+            delay = min(delay * 2, LOCK_BACKOFF_MAX)
+
+
+class ArtifactCache(object):
+    """Content-addressed store for built packages with age- and size-based eviction."""
+
+    def __init__(self, path, max_age, max_size, module, prebuilt=None):
+        self.path = path
+        self.max_age = max_age
+        self.max_size = max_size
+        self.module = module
+        # maps keys to base64 encoded packages which have been built on the controller
+        self.prebuilt = prebuilt or {}
+
+        if not self.path:
+            return
+
+        try:
+            os.makedirs(self.path, mode=0o755)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                self.module.warn('artifact cache %s is not available and will be ignored: %s'
+                                 % (self.path, to_native(e)))
+                self.path = None
+
+    def lookup(self, key, suffix, cwd):
+        if key in self.prebuilt:
+            pkg_path = os.path.join(cwd, key + suffix)
+            with open(pkg_path, 'wb') as f:
+                f.write(base64.b64decode(self.prebuilt.pop(key)))
+            self.module.debug('prebuilt package: %s' % pkg_path)
+            return self.store(key, suffix, pkg_path)
+
+        if not self.path:
+            return None
+
+        pkg_path = os.path.join(self.path, key + suffix)
+        try:
+            # mtime marks the last use of a stored package
+            os.utime(pkg_path, None)
+        except OSError:
+            return None
+
+        self.module.debug('artifact cache hit: %s' % pkg_path)
+        return pkg_path
+
+    def store(self, key, suffix, pkg_path):
+        if not self.path:
+            return pkg_path
+
+        cached_path = os.path.join(self.path, key + suffix)
+        tmp_path = '%s.%d.tmp' % (cached_path, os.getpid())
+        try:
+            shutil.copyfile(pkg_path, tmp_path)
+            os.chmod(tmp_path, 0o644)
+            # rename is atomic, hence concurrent runs will never see partially written packages
+            os.rename(tmp_path, cached_path)
+        except (IOError, OSError) as e:
+            self.module.warn('package %s could not be stored in artifact cache %s: %s' % (
+                pkg_path, self.path, to_native(e)))
+            return pkg_path
+
+        self.evict(keep=cached_path)
+        return cached_path
+
+    def evict(self, keep=None):
+        now = time.time()
+
+        entries = []
+        for filename in os.listdir(self.path):
+            entry_path = os.path.join(self.path, filename)
+            try:
+                stat = os.stat(entry_path)
+            except OSError:
+                continue  # removed concurrently
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+
+        # least recently used packages first
+        entries.sort()
+
+        size = sum(entry_size for entry_mtime, entry_size, entry_path in entries)
+        for entry_mtime, entry_size, entry_path in entries:
+            if entry_path == keep:
+                continue
+
+            if now - entry_mtime <= self.max_age and size <= self.max_size:
+                continue
+
+            try:
+                os.remove(entry_path)
+            except OSError:
+                continue
+            size -= entry_size
+
+
+class DpkgStatus(object):
+    """Memory-mapped index of the stanzas in dpkg's status file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.data = b''
+
+        # Map package names to offsets of their stanzas, stanzas are separated by blank lines
+        self.index = {}
+        offset = 0 if self.data[:len(b'Package: ')] == b'Package: ' else self.data.find(b'\nPackage: ')
+        while offset != -1:
+            field_start = offset if offset == 0 else offset + 1
+            name_start = field_start + len(b'Package: ')
+            name_end = self.data.find(b'\n', name_start)
+            if name_end == -1:
+                name_end = len(self.data)
+            stanza_start = self.data.rfind(b'\n\n', 0, field_start)
+            stanza_start = 0 if stanza_start == -1 else stanza_start + 2
+            name = to_native(self.data[name_start:name_end].strip())
+            self.index.setdefault(name, []).append(stanza_start)
+            offset = self.data.find(b'\nPackage: ', name_end)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def stanzas(self, name):
+        for stanza_start in self.index.get(name, []):
+            stanza_end = self.data.find(b'\n\n', stanza_start)
+            if stanza_end == -1:
+                stanza_end = len(self.data)
+
+            fields = {}
+            field = None
+            for line in to_native(self.data[stanza_start:stanza_end], errors='surrogate_or_replace').split('\n'):
+                if line[:1] in [' ', '\t']:
+                    if field:
+                        fields[field] += '\n' + line
+                elif ':' in line:
+                    field, value = line.split(':', 1)
+                    fields[field] = value.strip()
+            yield fields
+
+    def installed(self, name):
+        """Return fields of all installed packages named name, e.g. all architectures."""
+        return [fields for fields in self.stanzas(name)
+                if fields.get('Status', '').split(' ')[-1:] == ['installed']]
+
+
+def probe_installed(manager, names):
+    """Return installed versions and fingerprints of packages without loading the package cache or sack.
+
+    Returns a dict which maps each installed package in names to a list of dicts with keys version and fingerprint.
+    Returns None if no probe is available for manager, then callers have to query the package manager instead.
+    """
+    installed = {}
+
+    if manager == 'apt':
+        try:
+            status = DpkgStatus(DPKG_STATUS_PATH)
+        except (IOError, OSError):
+            return None
+
+        with status:
+            for name in names:
+                versions = [dict(version=fields.get('Version'), fingerprint=fields.get(DEB_FINGERPRINT_FIELD))
+                            for fields in status.installed(name)]
+                if versions:
+                    installed[name] = versions
+        return installed
+
+    elif manager in ['dnf', 'dnf5', 'yum']:
+        if rpm is None:
+            return None
+
+        # Query the rpm database directly instead of filling a sack
+        ts = rpm.TransactionSet()
+        try:
+            for name in names:
+                versions = [dict(version=to_native(header[rpm.RPMTAG_VERSION]),
+                                 fingerprint=rpm_fingerprint(to_native(header[rpm.RPMTAG_DESCRIPTION])))
+                            for header in ts.dbMatch('name', name)]
+                if versions:
+                    installed[name] = versions
+        finally:
+            ts.closeDB()
+        return installed
+
+    return None
+
+
+def check_installed(pkgs, installed):
+    """Split pkgs into packages which have to be installed and those which have to be reinstalled.
+
+    Meta packages which are installed with the same version but with different relationships have to be reinstalled,
+    because package managers consider packages with equal versions to be equal.
+    """
+    missing_pkgs = []
+    reinstall_pkgs = []
+    for pkg in pkgs:
+        versions = [version for version in installed.get(pkg['name'], []) if version['version'] == pkg['version']]
+        if not versions:
+            missing_pkgs.append(pkg)
+        elif not any(version['fingerprint'] == pkg['fingerprint'] for version in versions):
+            missing_pkgs.append(pkg)
+            reinstall_pkgs.append(pkg)
+    return missing_pkgs, reinstall_pkgs
+
+
+RELATIONSHIPS = ['conflicts', 'depends', 'enhances', 'recommends', 'suggests']
+
+
+def has_wildcards(pkgs):
+    return any(is_glob(relationship) for pkg in pkgs for key in RELATIONSHIPS for relationship in pkg[key])
+
+
+def expand_wildcards(pkgs, names):
+    """Replace relationships with wildcards in pkgs with relationships to all matching package names.
+
+    Packages are changed in place, so relationships will be returned expanded. Patterns in depends which do not match
+    any package are an error, patterns in other relationships which do not match any package are dropped.
+    """
+    index = PackageIndex(names)
+    for pkg in pkgs:
+        for key in RELATIONSHIPS:
+            pkg[key], unmatched = index.expand(pkg[key])
+            if key == 'depends' and unmatched:
+                raise ValueError('no package matches %s required by %s' % (', '.join(unmatched), pkg['name']))
+
+
+def apt_package_names(cache):
+    # The low-level cache of apt_pkg which backs apt.Cache is used, because iterating over all packages of apt.Cache is
+    # slow
+    return [package.name for package in cache._cache.packages if package.has_versions or package.has_provides]
+
 
 def apt_package_status(name, cache):
     is_installed = False
@@ -414,31 +1302,355 @@ def apt_package_status(name, cache):
     return is_installed, is_virtual, installed_pkg
 
 
+def apt_relationship_names(relationship):
+    # e.g. 'python3 (>= 3.7) | python3-minimal:any' yields 'python3' and 'python3-minimal'
+    for alternative in relationship.split('|'):
+        name = alternative.split('(')[0].strip()
+        if name:
+            yield name.split(':')[0]
+
+
+def apt_mark_relationship(relationship, cache):
+    """Mark the first available alternative of relationship for installation unless it is installed already.
+
+    Returns whether any alternative is available. Packages are marked as automatically installed, like dependencies of
+    packages which are installed with apt-get.
+    """
+    for name in apt_relationship_names(relationship):
+        if name in cache:
+            candidate = cache[name]
+        elif cache.is_virtual_package(name):
+            candidate = cache.get_providing_packages(name)[0]
+        else:
+            continue
+
+        if not candidate.is_installed:
+            candidate.mark_install(from_user=False)
+        return True
+    return False
+
+
+def apt_simulate_install(pkgs, cache):
+    """Return names of packages which would be installed and removed when installing pkgs.
+
+    Relationships of the meta packages are marked on apt's in-memory depcache, no packages have to be built. Version
+    constraints of relationships are not evaluated.
+    """
+    with cache.actiongroup():
+        for pkg in pkgs:
+            for relationship in pkg['conflicts']:
+                for name in apt_relationship_names(relationship):
+                    if name in cache and cache[name].is_installed:
+                        cache[name].mark_delete(auto_fix=False)
+
+            for key in ['depends', 'recommends']:
+                for relationship in pkg[key]:
+                    if not apt_mark_relationship(relationship, cache) and key == 'depends':
+                        raise ValueError("package %s depends on '%s' which is not available"
+                                         % (pkg['name'], relationship))
+
+    if cache.broken_count:
+        raise ValueError('dependencies of %s cannot be satisfied' % ', '.join(pkg['name'] for pkg in pkgs))
+
+    install = set(pkg['name'] for pkg in pkgs)
+    remove = set()
+    for change in cache.get_changes():
+        if change.marked_install or change.marked_upgrade:
+            install.add(change.name)
+        elif change.marked_delete:
+            remove.add(change.name)
+    return dict(install=sorted(install), remove=sorted(remove))
+
+
+def apt_lists_age():
+    """Return the age of apt's package lists in seconds or None if it is unknown."""
+    for path in [APT_UPDATE_SUCCESS_STAMP_PATH, apt_pkg.config.find_dir('Dir::State::Lists')]:
+        try:
+            return time.time() - os.stat(path).st_mtime
+        except OSError:
+            continue
+    return None
+
+
+def apt_update(cache, locks):
+    """Update apt's package lists like apt-get update and reopen cache."""
+    lists_lock_path = os.path.join(apt_pkg.config.find_dir('Dir::State::Lists'), 'lock')
+    try:
+        locks.acquire('lock of package lists ' + lists_lock_path, lambda: lock_holders([lists_lock_path]),
+                      cache.update, (apt.cache.LockFailedException,))
+    except apt.cache.FetchFailedException as e:
+        raise Exception('Failed to update package lists of apt: %s' % to_native(e))
+    cache.open()
+
+
+def apt_check_available(pkgs, cache, cache_only):
+    """Raise an error if a dependency of pkgs is neither available nor another meta package of pkgs.
+
+    Version constraints of relationships are not evaluated.
+    """
+    pkg_names = set(pkg['name'] for pkg in pkgs)
+    for pkg in pkgs:
+        for relationship in pkg['depends']:
+            if not any(name in pkg_names or name in cache or cache.is_virtual_package(name)
+                       for name in apt_relationship_names(relationship)):
+                raise ValueError("package %s depends on '%s' which is not available%s"
+                                 % (pkg['name'], relationship, CACHE_ONLY_HINT if cache_only else ''))
+
+
+def apt_wait_for_lock(locks):
+    locks.acquire('dpkg lock ' + DPKG_LOCK_PATHS[0], lambda: lock_holders(DPKG_LOCK_PATHS))
+
+
+def apt_lock_timeout_option(locks):
+    # apt-get waits for dpkg's lock itself, if another process acquired it after apt_wait_for_lock() returned
+    return '-o DPkg::Lock::Timeout={timeout} '.format(timeout=int(locks.remaining()))
+
+
+def apt_install_progress(module, log):
+    """Return an install progress of python-apt which reports dpkg's progress and redirects dpkg's output to log."""
+
+    class InstallProgress(apt.progress.base.InstallProgress):
+        def fork(self):
+            pid = os.fork()
+            if pid == 0:
+                # dpkg and maintainer scripts must not write to stdout, because the module's result is written there
+                os.dup2(log.fileno(), 1)
+                os.dup2(log.fileno(), 2)
+                os.environ.update(dict_merge(ENV_VARS, APT_ENV_VARS))
+            return pid
+
+        def status_change(self, pkg, percent, status):
+            module.debug('apt progress: {percent:.0f}% {status}'.format(percent=percent, status=status))
+
+        def error(self, pkg, errormsg):
+            module.debug('apt error: {pkg}: {errormsg}'.format(pkg=pkg, errormsg=errormsg))
+
+    return InstallProgress()
+
+
+def apt_install(pkgs, pkg_paths, cache, cwd, locks, module):
+    """Install meta packages pkgs from the Debian packages at pkg_paths within this process.
+
+    Dependencies and recommendations are marked on cache, i.e. the apt cache which has been loaded already, and
+    installed with python-apt, followed by a single run of dpkg for all meta packages. apt's frontend lock is held
+    during both steps, waiting for it with locks if required. Returns False without changing the system if python-apt
+    cannot resolve the meta packages on its own, e.g. because they conflict with installed packages or depend on each
+    other, or if python-apt is too old.
+    Output of dpkg is written to a log file in directory cwd.
+    """
+    if not hasattr(apt_pkg, 'pkgsystem_lock_inner'):
+        # python-apt prior to 1.7 cannot release dpkg's lock while keeping apt's frontend lock
+        return False
+
+    with cache.actiongroup():
+        for pkg_path in pkg_paths:
+            deb = apt.debfile.DebPackage(pkg_path, cache=cache)
+            if not deb.check():
+                # python-apt does not expose why a package cannot be installed, only which dependencies are missing
+                missing_deps = getattr(deb, 'missing_deps', None)
+                module.debug('python-apt cannot install %s: %s' % (
+                    pkg_path, 'missing dependencies ' + ', '.join(missing_deps) if missing_deps
+                    else 'dependencies cannot be satisfied or package conflicts with installed packages'))
+                cache.clear()
+                return False
+
+        if apt_pkg.config.find_b('APT::Install-Recommends', True):
+            for pkg in pkgs:
+                for relationship in pkg['recommends']:
+                    apt_mark_relationship(relationship, cache)
+
+    if cache.broken_count:
+        module.debug('python-apt cannot satisfy dependencies of %s' % ', '.join(pkg['name'] for pkg in pkgs))
+        cache.clear()
+        return False
+
+    locks.acquire('dpkg lock ' + DPKG_LOCK_PATHS[0], lambda: lock_holders(DPKG_LOCK_PATHS),
+                  apt_pkg.pkgsystem_lock, (SystemError,))
+
+    try:
+        if cache.get_changes():
+            with open(os.path.join(cwd, 'dpkg.log'), 'w+b') as log:
+                try:
+                    cache.commit(apt.progress.base.AcquireProgress(), apt_install_progress(module, log))
+                except SystemError as e:
+                    log.seek(0)
+                    raise Exception('Failed to install dependencies: {0}\n{1}'.format(
+                        to_native(e), to_native(log.read(), errors='surrogate_or_replace')))
+
+        # dpkg acquires its own lock and skips apt's frontend lock, which is held by this process
+        apt_pkg.pkgsystem_unlock_inner()
+        try:
+            cmd = "dpkg -i {pkg_paths}".format(pkg_paths=' '.join("'%s'" % pkg_path for pkg_path in pkg_paths))
+            environ_update = dict_merge(dict_merge(ENV_VARS, APT_ENV_VARS), dict(DPKG_FRONTEND_LOCKED='1'))
+            module.run_command(cmd, check_rc=True, environ_update=environ_update)
+        finally:
+            apt_pkg.pkgsystem_lock_inner()
+    finally:
+        apt_pkg.pkgsystem_unlock()
+
+    return True
+
+
+def dnf_changes(transaction):
+    return dict(
+        install=sorted(set(dnf_pkg.name for dnf_pkg in transaction.install_set)),
+        remove=sorted(set(dnf_pkg.name for dnf_pkg in transaction.remove_set)))
+
+
+def dnf5_changes(transaction):
+    install = set()
+    remove = set()
+    for item in transaction.get_transaction_packages():
+        if libdnf5.transaction.transaction_item_action_is_inbound(item.get_action()):
+            install.add(item.get_package().get_name())
+        elif libdnf5.transaction.transaction_item_action_is_outbound(item.get_action()):
+            remove.add(item.get_package().get_name())
+    # Upgrades and reinstalls replace packages which are inbound and outbound at the same time
+    return dict(install=sorted(install), remove=sorted(remove - install))
+
+
+def yum_changes(yb):
+    return dict(
+        install=sorted(set(txmbr.name for txmbr in yb.tsInfo.getMembers() if txmbr.ts_state in ['i', 'u'])),
+        remove=sorted(set(txmbr.name for txmbr in yb.tsInfo.getMembers() if txmbr.ts_state == 'e')))
+
+
+def resolve_error(problems, cache_only):
+    return Exception('Failed to resolve transaction: {0}{1}'.format(problems, CACHE_ONLY_HINT if cache_only else ''))
+
+
+def yum_base(cache_only, metadata_max_age):
+    yb = yum.YumBase()
+    # yum must not write to stdout, because the module's result is written there
+    yb.preconf.debuglevel = 0
+    yb.preconf.errorlevel = 0
+    if cache_only:
+        # like 'yum --cacheonly', i.e. metadata of repositories is used from yum's cache without checking for expiry
+        yb.conf.cache = 1
+    if metadata_max_age is not None:
+        # metadata_expire of repositories overrides the main configuration
+        yb.conf.metadata_expire = metadata_max_age
+        for repo in yb.repos.listEnabled():
+            repo.metadata_expire = metadata_max_age
+    # import gpg keys of repositories like 'yum -y'
+    yb.conf.assumeyes = True
+    return yb
+
+
+def yum_resolve(yb, cache_only):
+    rescode, restring = yb.buildTransaction()
+    if rescode == 1:
+        raise resolve_error('; '.join(restring), cache_only)
+
+
+def yum_run_transaction(yb, locks):
+    locks.acquire('yum lock ' + YUM_LOCK_PATH, lambda: pid_file_holder(YUM_LOCK_PATH) + lock_holders(RPM_LOCK_PATHS),
+                  yb.doLock, (yum.Errors.LockError,))
+    try:
+        yb.processTransaction()
+    finally:
+        yb.doUnlock()
+
+
+def dnf_base(plugins, cache_only, metadata_max_age):
+    base = dnf.Base()
+    if cache_only:
+        base.conf.cacheonly = True
+    if metadata_max_age is not None:
+        base.conf.metadata_expire = metadata_max_age
+    if plugins:
+        base.init_plugins()
+        base.pre_configure_plugins()
+    # Variables in /etc/dnf/vars, e.g. $stream on CentOS Stream or $contentdir and $infra on Red Hat Enterprise Linux,
+    # are used in urls of repositories
+    base.conf.substitutions.update_from_etc(base.conf.installroot)
+    base.read_all_repos()
+    if plugins:
+        base.configure_plugins()
+
+    if cache_only or metadata_max_age is not None:
+        for repo in base.repos.iter_enabled():
+            if cache_only:
+                # like 'dnf --cacheonly'
+                repo._repo.setSyncStrategy(dnf.repo.SYNC_ONLY_CACHE)
+            if metadata_max_age is not None:
+                # metadata_expire of repositories overrides the main configuration
+                repo.metadata_expire = metadata_max_age
+    return base
+
+
+def dnf_wait_for_lock(base, locks):
+    # dnf itself waits for its lock without any timeout
+    dnf_lock_path = os.path.join(base.conf.persistdir, DNF_LOCK_NAME)
+    locks.acquire('dnf lock ' + dnf_lock_path, lambda: pid_file_holder(dnf_lock_path) + lock_holders(RPM_LOCK_PATHS))
+
+
+def dnf5_base(plugins, cache_only, metadata_max_age):
+    # Only the system repo is loaded, available repos will be loaded on demand with dnf5_load_available_repos()
+    base = libdnf5.base.Base()
+    base_config = base.get_config()
+    base_config.plugins = plugins
+    base.load_config()
+    if cache_only:
+        # like 'dnf5 --cacheonly', but packages which have to be installed are still downloaded
+        base_config.cacheonly = 'metadata'
+    if metadata_max_age is not None:
+        base_config.metadata_expire = metadata_max_age
+    base.setup()
+
+    repo_sack = base.get_repo_sack()
+    repo_sack.create_repos_from_system_configuration()
+    if metadata_max_age is not None:
+        # metadata_expire of repositories overrides the main configuration
+        for repo in libdnf5.repo.RepoQuery(base):
+            repo.get_config().metadata_expire = metadata_max_age
+    repo_sack.load_repos(libdnf5.repo.Repo.Type_SYSTEM)
+    return base
+
+
+def dnf5_load_available_repos(base):
+    base.get_repo_sack().load_repos(libdnf5.repo.Repo.Type_AVAILABLE)
+
+
+def dnf5_run_transaction(transaction, locks):
+    def run():
+        result = transaction.run()
+        if result == libdnf5.base.Transaction.TransactionRunResult_ERROR_LOCK:
+            raise LockHeldError(transaction.transaction_result_to_string(result))
+        if result != libdnf5.base.Transaction.TransactionRunResult_SUCCESS:
+            raise Exception('Failed to run transaction: {0}'.format(transaction.transaction_result_to_string(result)))
+
+    locks.acquire('dnf5 lock ' + DNF5_LOCK_PATH, lambda: lock_holders([DNF5_LOCK_PATH] + RPM_LOCK_PATHS), run,
+                  (LockHeldError,))
+
+
 def make_deb(architecture,
+             artifact_cache,
+             builder,
              conflicts,
              cwd,
              depends,
              description,
              enhances,
+             fingerprint,
              maintainer,
              manager,
              name,
              recommends,
              suggests,
              summary,
+             timings,
              version,
              module):
-    debian_path = os.path.join(cwd, name, 'DEBIAN')
-    os.makedirs(debian_path, mode=0o755)
+    timings.lap('build')  # time since previous lap has been spent on building the previous package, if any
 
-    control_path = os.path.join(debian_path, 'control')
-    control_template = jinja2.Template(DEBIAN_CONTROLFILE_TEMPLATE)
-    control_content = control_template.render(
+    pkg = dict(
         architecture=architecture,
         conflicts=conflicts,
         depends=depends,
         description=description,
         enhances=enhances,
+        fingerprint=fingerprint,
         maintainer=maintainer,
         name=name,
         recommends=recommends,
@@ -446,6 +1658,34 @@ def make_deb(architecture,
         summary=summary,
         version=version)
 
+    pkg_filename = '{name}.deb'.format(name=name)
+
+    module.debug('package filename: %s' % pkg_filename)
+
+    pkg_path = os.path.join(cwd, pkg_filename)
+
+    if builder == 'native':
+        cache_key, suffix, build = native_artifact(manager, None, pkg)
+        cached_path = artifact_cache.lookup(cache_key, suffix, cwd)
+        if cached_path:
+            return cached_path
+
+        with open(pkg_path, 'wb') as f:
+            f.write(build())
+        return artifact_cache.store(cache_key, suffix, pkg_path)
+
+    control_content = render_control(**pkg)
+    timings.lap('render')
+
+    cache_key = artifact_key(manager, builder, None, control_content)
+    cached_path = artifact_cache.lookup(cache_key, '.deb', cwd)
+    if cached_path:
+        return cached_path
+
+    debian_path = os.path.join(cwd, name, 'DEBIAN')
+    os.makedirs(debian_path, mode=0o755)
+
+    control_path = os.path.join(debian_path, 'control')
     with open(control_path, 'w') as f:
         f.write(control_content)
 
@@ -453,379 +1693,648 @@ def make_deb(architecture,
     cmd = "dpkg-deb --build '{binary_directory}'".format(binary_directory=name)
     module.run_command(cmd, check_rc=True, cwd=cwd, environ_update=dict_merge(ENV_VARS, APT_ENV_VARS))
 
-    pkg_filename = '{name}.deb'.format(name=name)
+    return artifact_cache.store(cache_key, '.deb', pkg_path)
 
-    module.debug('package filename: %s' % pkg_filename)
 
-    pkg_path = os.path.join(cwd, pkg_filename)
+def get_rpm_dist(cwd, module):
+    try:
+        return rpm_dist()
+    except (IOError, OSError, ValueError) as e:
+        # macro files use features which are not supported by rpm_dist()
+        module.debug('reading dist tag from rpm macro files failed: %s' % to_native(e))
 
-    return pkg_path
+    cmd = "sh -c 'rpm -E %dist | head -c -1'"
+    rc, stdout, stderr = module.run_command(cmd, check_rc=True, cwd=cwd, environ_update=ENV_VARS)
+    return stdout
 
 
 def make_rpm(architecture,
+             artifact_cache,
+             builder,
              conflicts,
              cwd,
              depends,
              description,
              enhances,
+             fingerprint,
              maintainer,
              manager,
              name,
              recommends,
              suggests,
              summary,
+             timings,
              version,
              module):
+    timings.lap('build')  # time since previous lap has been spent on building the previous package, if any
+
+    dist = get_rpm_dist(cwd, module)
+    release = '1' + dist
+
+    if builder == 'native':
+        pkg = dict(
+            architecture=architecture,
+            conflicts=conflicts,
+            depends=depends,
+            description=description,
+            enhances=enhances,
+            fingerprint=fingerprint,
+            maintainer=maintainer,
+            name=name,
+            recommends=recommends,
+            suggests=suggests,
+            summary=summary,
+            version=version)
+        cache_key, suffix, build = native_artifact(manager, dist, pkg)
+        cached_path = artifact_cache.lookup(cache_key, suffix, cwd)
+        if cached_path:
+            return cached_path
+
+        pkg_path = os.path.join(cwd, rpm_filename(architecture, name, release, version))
+        with open(pkg_path, 'wb') as f:
+            f.write(build())
+        return artifact_cache.store(cache_key, suffix, pkg_path)
+
+    # jinja2 is imported lazily, because it is required to render spec files for builder external only
+    import jinja2
+
     spec_path = os.path.join(cwd, '%s.spec' % name)
     spec_template = jinja2.Template(RPM_SPEC_TEMPLATE)
-    spec_template.globals['now'] = datetime.datetime.utcnow
-    spec_template.globals['format_date'] = babel.dates.format_date
     spec_content = spec_template.render(
         architecture=architecture,
+        changelog_date=changelog_date(datetime.datetime.utcnow()),
         conflicts=conflicts,
         depends=depends,
         description=description,
         enhances=enhances,
+        fingerprint=fingerprint,
         maintainer=maintainer,
         name=name,
         recommends=recommends,
         suggests=suggests,
         summary=summary,
         version=version)
+    timings.lap('render')
+
+    # The changelog date changes daily and hence is not part of the cache key
+    cache_key = artifact_key(manager, builder, dist, spec_content.split('%changelog')[0])
+    cached_path = artifact_cache.lookup(cache_key, '.rpm', cwd)
+    if cached_path:
+        return cached_path
 
     with open(spec_path, 'w') as f:
         f.write(spec_content)
 
-    cmd = "rpmbuild --define '_topdir {topdir}' -ba '{spec_path}'".format(
+    cmd = "rpmbuild --define '_topdir {topdir}' -bb '{spec_path}'".format(
         topdir=cwd, spec_path=spec_path)
     module.run_command(cmd, check_rc=True, cwd=cwd, environ_update=ENV_VARS)
 
-    cmd = "sh -c 'rpm -E %dist | head -c -1'"
-    rc, stdout, stderr = module.run_command(cmd, check_rc=True, cwd=cwd, environ_update=ENV_VARS)
-    dist = stdout
+    pkg_path = os.path.join(cwd, 'RPMS', architecture, rpm_filename(architecture, name, release, version))
 
-    pkg_filename = 'RPMS/{architecture}/{name}-{version}-1{dist}.{architecture}.rpm'.format(
-        dist=dist, name=name, version=version, architecture=architecture)
+    return artifact_cache.store(cache_key, '.rpm', pkg_path)
 
-    pkg_path = os.path.join(cwd, pkg_filename)
 
-    return pkg_path
+def published(repository, manager, names):
+    """Return published versions and fingerprints of packages in the format of probe_installed()."""
+    versions = {}
+    for name in names:
+        fields = repository.get(name)
+        if fields is None:
+            continue
+
+        if manager == 'apt':
+            versions[name] = [dict(version=fields.get('Version'), fingerprint=fields.get(DEB_FINGERPRINT_FIELD))]
+        else:
+            versions[name] = [dict(version=fields['version'], fingerprint=rpm_fingerprint(fields['description']))]
+    return versions
 
 
-def install(architecture,
-            conflicts,
-            depends,
-            description,
-            enhances,
-            maintainer,
+def publish(pkgs,
+            publish_to,
+            artifact_cache,
+            builder,
             manager,
-            name,
-            recommends,
-            suggests,
-            summary,
-            version,
+            timings,
+            check_mode,
             module):
+    # Meta packages which are not held by the repository with the same version and relationships already are built and
+    # added to the repository. Its index is updated for these packages only and written once. Returns a list with one
+    # result dict per item of pkgs.
 
-    if manager == 'apt':
-        with apt.Cache() as cache:
-            is_installed, is_virtual, installed_pkg = apt_package_status(name, cache)
+    if has_wildcards(pkgs):
+        raise ValueError('wildcards in relationships are not supported when publishing meta packages')
 
-            if is_installed and version == installed_pkg.version:
-                # package is present already
-                return False, conflicts, depends, enhances, recommends, suggests
+    if check_mode and not os.path.isdir(publish_to):
+        return [dict(pkg, changed=True) for pkg in pkgs]
 
-        with tempfile.TemporaryDirectory() as dir:
-            pkg_path = make_deb(
-                architecture,
-                conflicts,
-                dir,
-                depends,
-                description,
-                enhances,
-                maintainer,
-                manager,
-                name,
-                recommends,
-                suggests,
-                summary,
-                version,
-                module)
+    repository_class, make_pkg = (AptRepository, make_deb) if manager == 'apt' else (RpmMdRepository, make_rpm)
+    with repository_class(publish_to) as repository:
+        timings.lap('load')
+        missing_pkgs, reinstall_pkgs = check_installed(
+            pkgs, published(repository, manager, [pkg['name'] for pkg in pkgs]))
+        timings.lap('probe')
 
-            cmd = "apt-get install -y '{pkg_path}'".format(pkg_path=pkg_path)
-            module.run_command(cmd, check_rc=True, cwd=dir, environ_update=dict_merge(ENV_VARS, APT_ENV_VARS))
+        if missing_pkgs and not check_mode:
+            with tempfile.TemporaryDirectory() as dir:
+                for pkg in missing_pkgs:
+                    pkg_path = make_pkg(artifact_cache=artifact_cache, builder=builder, cwd=dir, manager=manager,
+                                        module=module, timings=timings, **pkg)
+                    timings.lap('build')
+                    repository.add(pkg_path)
+                    timings.lap('publish')
 
-            return True, conflicts, depends, enhances, recommends, suggests
+                repository.write()
+                timings.lap('publish')
 
-    elif manager == 'dnf':
-        with dnf.Base() as base:
-            base.read_all_repos()
-            base.fill_sack(load_system_repo=True, load_available_repos=False)
-            q = base.sack.query()
-            installed_pkgs = q.installed().filter(name=name, version=version).run()
-            if installed_pkgs:
-                # package is present already
-                return False, conflicts, depends, enhances, recommends, suggests
+    return [dict(pkg, changed=pkg in missing_pkgs) for pkg in pkgs]
 
-            base.reset(repos=True, sack=True)
-            base.conf.substitutions.update_from_etc(base.conf.installroot)
-            base.read_all_repos()
-            base.fill_sack(load_system_repo=True, load_available_repos=True)
 
-            with tempfile.TemporaryDirectory() as dir:
-                pkg_path = make_rpm(
-                    architecture,
-                    conflicts,
-                    dir,
-                    depends,
-                    description,
-                    enhances,
-                    maintainer,
-                    manager,
-                    name,
-                    recommends,
-                    suggests,
-                    summary,
-                    version,
-                    module)
+def unpublish(names,
+              publish_to,
+              manager,
+              timings,
+              check_mode):
+    # Returns a list of bools, whether each meta package in names has been removed from the repository
 
-                # Install using dnf CLI
-                #  cmd = "dnf install -y '{pkg_path}'".format(pkg_path=pkg_path)
-                #  module.run_command(cmd, check_rc=True, cwd=dir, environ_update=ENV_VARS)
+    if not os.path.isdir(publish_to):
+        return [False for name in names]
 
-                # Install using dnf API
-                pkgs = base.add_remote_rpms([pkg_path])
-                for pkg in pkgs:
-                    base.package_install(pkg)
-                base.resolve()
-                base.download_packages(base.transaction.install_set)
-                base.do_transaction()
+    repository_class = AptRepository if manager == 'apt' else RpmMdRepository
+    with repository_class(publish_to) as repository:
+        timings.lap('load')
+        if check_mode:
+            return [repository.get(name) is not None for name in names]
 
-        return True, conflicts, depends, enhances, recommends, suggests
+        removed = [repository.remove(name) for name in names]
+        repository.write()
+        timings.lap('publish')
+    return removed
 
-    elif manager == 'dnf5':
-        base = libdnf5.base.Base()
-        base_config = base.get_config()
-        base_config.plugins = False
-        base.load_config()
-        base.setup()
 
-        repo_sack = base.get_repo_sack()
-        repo_sack.create_repos_from_system_configuration()
-        repo_sack.load_repos(libdnf5.repo.Repo.Type_SYSTEM)
+def install(pkgs,
+            artifact_cache,
+            builder,
+            manager,
+            plugins,
+            cache_only,
+            metadata_max_age,
+            locks,
+            timings,
+            check_mode,
+            module):
+    # Each item of pkgs is a dict with keys architecture, conflicts, depends, description, enhances, maintainer, name,
+    # recommends, suggests, summary and version. All meta packages which are not present already are installed with a
+    # single transaction. Returns a list with one result dict per item of pkgs, whether the transaction has been
+    # resolved from installed packages only or required metadata of repositories, or None if nothing was installed, and
+    # in check mode a dict with names of packages which would be installed and removed.
+    #
+    # In check mode the transaction is resolved but not run. On apt-based distributions relationships are marked on
+    # apt's in-memory depcache, on rpm-based distributions the meta packages have to be built for resolving.
+
+    changes = None
+
+    installed = probe_installed(manager, [pkg['name'] for pkg in pkgs])
+    timings.lap('probe')
+    if installed is not None:
+        missing_pkgs, reinstall_pkgs = check_installed(pkgs, installed)
+        if not missing_pkgs:
+            # packages are present already
+            return [dict(pkg, changed=False) for pkg in pkgs], None, None
 
-        query = libdnf5.rpm.PackageQuery(base)
-        query.filter_installed()
-        query.filter_name(name)
-        query.filter_version(version)
+    if manager == 'apt':
+        # The apt cache is loaded once and shared by probing, wildcard expansion, resolving and installing
+        with apt.Cache() as cache:
+            timings.lap('load')
 
-        if not query.empty():
-            # package is present already
-            return False, conflicts, depends, enhances, recommends, suggests
+            if installed is None:
+                # fall back to apt cache if dpkg's status file is not available
+                installed = {}
+                for pkg in pkgs:
+                    is_installed, is_virtual, installed_pkg = apt_package_status(pkg['name'], cache)
+                    if is_installed and installed_pkg is not None:
+                        installed[pkg['name']] = [dict(version=installed_pkg.version,
+                                                       fingerprint=installed_pkg.record.get(DEB_FINGERPRINT_FIELD))]
+                timings.lap('probe')
+
+                missing_pkgs, reinstall_pkgs = check_installed(pkgs, installed)
+                if not missing_pkgs:
+                    # packages are present already
+                    return [dict(pkg, changed=False) for pkg in pkgs], None, None
+
+            if metadata_max_age is not None and not check_mode:
+                lists_age = apt_lists_age()
+                if lists_age is None or lists_age > metadata_max_age:
+                    apt_update(cache, locks)
+                    timings.lap('load')
+
+            if has_wildcards(missing_pkgs):
+                expand_wildcards(missing_pkgs, apt_package_names(cache))
+                timings.lap('expand')
+
+            if check_mode:
+                changes = apt_simulate_install(missing_pkgs, cache)
+                timings.lap('resolve')
+                return [dict(pkg, changed=pkg in missing_pkgs) for pkg in pkgs], 'repositories', changes
+
+            # fail before any package is built if dependencies are not available at all
+            apt_check_available(missing_pkgs, cache, cache_only)
 
-        base = libdnf5.base.Base()
-        base.load_config()
-        base.setup()
+            with tempfile.TemporaryDirectory() as dir:
+                pkg_paths = [make_deb(artifact_cache=artifact_cache, builder=builder, cwd=dir, manager=manager,
+                                      module=module, timings=timings, **pkg) for pkg in missing_pkgs]
+                timings.lap('build')
+
+                resolved_from = 'repositories'
+                if not apt_install(missing_pkgs, pkg_paths, cache, dir, locks, module):
+                    # apt-get loads the apt cache once more, but resolves all meta packages jointly
+                    apt_wait_for_lock(locks)
+                    cmd = "apt-get install -y {lock_timeout}{reinstall}{pkg_paths}".format(
+                        lock_timeout=apt_lock_timeout_option(locks),
+                        reinstall='--reinstall ' if reinstall_pkgs else '',
+                        pkg_paths=' '.join("'%s'" % pkg_path for pkg_path in pkg_paths))
+                    module.run_command(cmd, check_rc=True, cwd=dir, environ_update=dict_merge(ENV_VARS, APT_ENV_VARS))
+                timings.lap('transaction')
 
-        repo_sack = base.get_repo_sack()
-        repo_sack.create_repos_from_system_configuration()
-        repo_sack.load_repos()
+    elif manager == 'dnf':
+        with dnf_base(plugins, cache_only, metadata_max_age) as base:
+            # Load the system repo only, because dependencies of meta packages are often satisfied by installed
+            # packages already and then no metadata of remote repositories is required at all.
+            base.fill_sack(load_system_repo=True, load_available_repos=False)
+            timings.lap('load')
+
+            if installed is None:
+                q = base.sack.query()
+                installed = {}
+                for installed_pkg in q.installed().filter(name=[pkg['name'] for pkg in pkgs]).run():
+                    installed.setdefault(installed_pkg.name, []).append(
+                        dict(version=installed_pkg.version, fingerprint=rpm_fingerprint(installed_pkg.description)))
+                timings.lap('probe')
+
+                missing_pkgs, reinstall_pkgs = check_installed(pkgs, installed)
+                if not missing_pkgs:
+                    # packages are present already
+                    return [dict(pkg, changed=False) for pkg in pkgs], None, None
+
+            # Wildcards are expanded against all available packages, hence metadata of repositories is required
+            repos_loaded = has_wildcards(missing_pkgs)
+            if repos_loaded:
+                base.fill_sack(load_system_repo=True, load_available_repos=True)
+                timings.lap('load')
+                expand_wildcards(missing_pkgs, [dnf_pkg.name for dnf_pkg in base.sack.query().run()])
+                timings.lap('expand')
 
-        with tempfile.TemporaryDirectory() as dir:
-            pkg_path = make_rpm(
-                architecture,
-                conflicts,
-                dir,
-                depends,
-                description,
-                enhances,
-                maintainer,
-                manager,
-                name,
-                recommends,
-                suggests,
-                summary,
-                version,
-                module)
+            with tempfile.TemporaryDirectory() as dir:
+                pkg_paths = [make_rpm(artifact_cache=artifact_cache, builder=builder, cwd=dir, manager=manager,
+                                      module=module, timings=timings, **pkg) for pkg in missing_pkgs]
+                timings.lap('build')
+
+                # Install using dnf CLI
+                #  cmd = "dnf install -y '{pkg_path}'".format(pkg_path=pkg_path)
+                #  module.run_command(cmd, check_rc=True, cwd=dir, environ_update=ENV_VARS)
+
+                # Install using dnf API
+                def add_rpms():
+                    reinstall_names = [pkg['name'] for pkg in reinstall_pkgs]
+                    for rpm_pkg in base.add_remote_rpms(pkg_paths):
+                        if rpm_pkg.name in reinstall_names:
+                            base.package_reinstall(rpm_pkg)
+                        else:
+                            base.package_install(rpm_pkg)
+
+                add_rpms()
+                try:
+                    base.resolve()
+                    resolved_from = 'repositories' if repos_loaded else 'installed'
+                except dnf.exceptions.DepsolveError as e:
+                    if repos_loaded:
+                        raise resolve_error(to_native(e), cache_only)
+
+                    timings.lap('resolve')
+                    # Some dependencies are not installed yet, so metadata of remote repositories is required. dnf
+                    # does not provide a public API to add repositories to a filled sack, hence the sack is rebuilt.
+                    base.fill_sack(load_system_repo=True, load_available_repos=True)
+                    timings.lap('load')
+                    add_rpms()
+                    try:
+                        base.resolve()
+                    except dnf.exceptions.DepsolveError as e:
+                        raise resolve_error(to_native(e), cache_only)
+                    resolved_from = 'repositories'
+                timings.lap('resolve')
+
+                if check_mode:
+                    changes = dnf_changes(base.transaction)
+                else:
+                    base.download_packages(base.transaction.install_set)
+                    dnf_wait_for_lock(base, locks)
+                    base.do_transaction()
+                    timings.lap('transaction')
 
-            goal = libdnf5.base.Goal(base)
-            goal.add_install(pkg_path)
-            transaction = goal.resolve()
-            transaction.download()
-            transaction.run()
+    elif manager == 'dnf5':
+        # A single base is used for probing, resolving and running the transaction. Like with dnf, only the system repo
+        # is loaded at first, because dependencies of meta packages are often satisfied by installed packages already.
+        base = dnf5_base(plugins, cache_only, metadata_max_age)
+        timings.lap('load')
+
+        if installed is None:
+            installed = {}
+            for pkg in pkgs:
+                query = libdnf5.rpm.PackageQuery(base)
+                query.filter_installed()
+                query.filter_name(pkg['name'])
+                for installed_pkg in query:
+                    installed.setdefault(pkg['name'], []).append(
+                        dict(version=installed_pkg.get_version(),
+                             fingerprint=rpm_fingerprint(installed_pkg.get_description())))
+            timings.lap('probe')
+
+            missing_pkgs, reinstall_pkgs = check_installed(pkgs, installed)
+            if not missing_pkgs:
+                # packages are present already
+                return [dict(pkg, changed=False) for pkg in pkgs], None, None
+
+        # Wildcards are expanded against all available packages, hence metadata of repositories is required
+        repos_loaded = has_wildcards(missing_pkgs)
+        if repos_loaded:
+            dnf5_load_available_repos(base)
+            timings.lap('load')
+            expand_wildcards(missing_pkgs, [dnf5_pkg.get_name() for dnf5_pkg in libdnf5.rpm.PackageQuery(base)])
+            timings.lap('expand')
 
-        return True, conflicts, depends, enhances, recommends, suggests
+        with tempfile.TemporaryDirectory() as dir:
+            pkg_paths = [make_rpm(artifact_cache=artifact_cache, builder=builder, cwd=dir, manager=manager,
+                                  module=module, timings=timings, **pkg) for pkg in missing_pkgs]
+            timings.lap('build')
+
+            def resolve():
+                goal = libdnf5.base.Goal(base)
+                for pkg, pkg_path in zip(missing_pkgs, pkg_paths):
+                    if pkg in reinstall_pkgs:
+                        goal.add_reinstall(pkg_path)
+                    else:
+                        goal.add_install(pkg_path)
+                return goal.resolve()
+
+            transaction = resolve()
+            resolved_from = 'repositories' if repos_loaded else 'installed'
+            if not repos_loaded and transaction.get_problems() != libdnf5.base.GoalProblem_NO_PROBLEM:
+                timings.lap('resolve')
+                # Some dependencies are not installed yet, so metadata of available repos is required
+                dnf5_load_available_repos(base)
+                timings.lap('load')
+                transaction = resolve()
+                resolved_from = 'repositories'
+            timings.lap('resolve')
+
+            if transaction.get_problems() != libdnf5.base.GoalProblem_NO_PROBLEM:
+                raise resolve_error('; '.join(transaction.get_resolve_logs_as_strings()), cache_only)
+
+            if check_mode:
+                changes = dnf5_changes(transaction)
+            else:
+                transaction.download()
+                dnf5_run_transaction(transaction, locks)
+                timings.lap('transaction')
 
     elif manager == 'yum':
-        yb = yum.YumBase()
-        if yb.rpmdb.searchNevra(name=name, ver=version):
-            # package is present already
-            return False, conflicts, depends, enhances, recommends, suggests
+        # A single YumBase is used for probing, expanding wildcards, resolving and running the transaction, hence
+        # plugins and metadata of repositories are loaded at most once
+        yb = yum_base(cache_only, metadata_max_age)
+        timings.lap('load')
+
+        if installed is None:
+            installed = {}
+            for pkg in pkgs:
+                for installed_pkg in yb.rpmdb.searchNevra(name=pkg['name']):
+                    installed.setdefault(pkg['name'], []).append(
+                        dict(version=installed_pkg.version, fingerprint=rpm_fingerprint(installed_pkg.description)))
+            timings.lap('probe')
+
+            missing_pkgs, reinstall_pkgs = check_installed(pkgs, installed)
+            if not missing_pkgs:
+                # packages are present already
+                return [dict(pkg, changed=False) for pkg in pkgs], None, None
+
+        if has_wildcards(missing_pkgs):
+            expand_wildcards(missing_pkgs, [pkg_tuple[0] for pkg_tuple in
+                                            yb.pkgSack.simplePkgList() + yb.rpmdb.simplePkgList()])
+            timings.lap('expand')
 
         with tempfile.TemporaryDirectory() as dir:
-            pkg_path = make_rpm(
-                architecture,
-                conflicts,
-                dir,
-                depends,
-                description,
-                enhances,
-                maintainer,
-                manager,
-                name,
-                recommends,
-                suggests,
-                summary,
-                version,
-                module)
+            pkg_paths = [make_rpm(artifact_cache=artifact_cache, builder=builder, cwd=dir, manager=manager,
+                                  module=module, timings=timings, **pkg) for pkg in missing_pkgs]
+            timings.lap('build')
+
+            resolved_from = 'repositories'
+            for pkg, pkg_path in zip(missing_pkgs, pkg_paths):
+                if pkg in reinstall_pkgs:
+                    yb.reinstallLocal(pkg_path)
+                else:
+                    yb.installLocal(pkg_path)
+            yum_resolve(yb, cache_only)
+            timings.lap('resolve')
 
-            cmd = "yum install -y '{pkg_path}'".format(pkg_path=pkg_path)
-            module.run_command(cmd, check_rc=True, cwd=dir, environ_update=ENV_VARS)
+            if check_mode:
+                changes = yum_changes(yb)
+            else:
+                yum_run_transaction(yb, locks)
+                timings.lap('transaction')
 
-        return True, conflicts, depends, enhances, recommends, suggests
+    else:  # manager not in [ 'apt', 'dnf', 'dnf5', 'yum' ]
+        return [dict(pkg, changed=False) for pkg in pkgs], None, None
 
-    # else manager not in [ 'apt', 'dnf', 'yum' ]
-    return False, conflicts, depends, enhances, recommends, suggests
+    return [dict(pkg, changed=pkg in missing_pkgs) for pkg in pkgs], resolved_from, changes
 
 
 def remove(manager,
-           name,
+           names,
+           plugins,
+           cache_only,
+           metadata_max_age,
+           locks,
+           timings,
+           check_mode,
            module):
+    # Packages in names which are installed are removed with a single transaction, on dnf-based, dnf5-based and
+    # yum-based distributions including one autoremove pass. Returns the names of packages which have been installed
+    # and hence have been removed, and in check mode the sorted names of all packages which would be removed.
+    #
+    # In check mode the transaction is resolved but not run.
+
+    installed = probe_installed(manager, names)
+    timings.lap('probe')
+    if installed is not None:
+        names = [name for name in names if name in installed]
+        if not names:
+            # packages are absent already
+            return [], []
 
     if manager == 'apt':
-        with apt.Cache() as cache:
-            if name not in cache:
-                # package is absent already
-                return False
-
-        cmd = "apt-get remove -y '{name}'".format(name=name)
+        if installed is None or check_mode:
+            with apt.Cache() as cache:
+                timings.lap('load')
+                names = [name for name in names if name in cache and cache[name].is_installed]
+                if not names:
+                    # packages are absent already
+                    return [], []
+
+                if check_mode:
+                    for name in names:
+                        cache[name].mark_delete()
+                    timings.lap('resolve')
+                    return names, sorted(change.name for change in cache.get_changes() if change.marked_delete)
+
+        apt_wait_for_lock(locks)
+        cmd = "apt-get remove -y {lock_timeout}{names}".format(
+            lock_timeout=apt_lock_timeout_option(locks),
+            names=' '.join("'%s'" % name for name in names))
         module.run_command(cmd, check_rc=True, environ_update=dict_merge(ENV_VARS, APT_ENV_VARS))
-        return True
+        timings.lap('transaction')
+        return names, None
 
     elif manager == 'dnf':
-        with dnf.Base() as base:
-            base.read_all_repos()
+        with dnf_base(plugins, cache_only, metadata_max_age) as base:
             base.fill_sack(load_system_repo=True, load_available_repos=False)
-            q = base.sack.query()
-            if not q.installed().filter(name=name).run():
-                # package is absent already
-                return False
+            timings.lap('load')
+            if installed is None:
+                query = base.sack.query().installed().filter(name=names)
+                installed_names = set(dnf_pkg.name for dnf_pkg in query.run())
+                names = [name for name in names if name in installed_names]
+                timings.lap('probe')
+                if not names:
+                    # packages are absent already
+                    return [], []
 
             # Removal using dnf CLI
-            #  cmd = "dnf autoremove -y '{name}'".format(name=name)
+            #  cmd = "dnf autoremove -y {names}".format(names=' '.join("'%s'" % name for name in names))
             #  module.run_command(cmd, check_rc=True, environ_update=ENV_VARS)
-            #  return True
+            #  return names, None
 
             # Removal using dnf API
             base.conf.clean_requirements_on_remove = True
-            base.remove(name)
+            for name in names:
+                base.remove(name)
             base.resolve(allow_erasing=True)
-            base.do_transaction()
+            timings.lap('resolve')
 
-            return True
+            if check_mode:
+                return names, dnf_changes(base.transaction)['remove']
+
+            dnf_wait_for_lock(base, locks)
+            base.do_transaction()
+            timings.lap('transaction')
+            return names, None
 
     elif manager == 'dnf5':
-        base = libdnf5.base.Base()
-        base_config = base.get_config()
-        base_config.plugins = False
-        base.load_config()
-        base.setup()
-
-        repo_sack = base.get_repo_sack()
-        repo_sack.create_repos_from_system_configuration()
-        repo_sack.load_repos(libdnf5.repo.Repo.Type_SYSTEM)
-
-        query = libdnf5.rpm.PackageQuery(base)
-        query.filter_installed()
-        query.filter_name(name)
-
-        if query.empty():
-            # package is absent already
-            return False
+        base = dnf5_base(plugins, cache_only, metadata_max_age)
+        timings.lap('load')
+
+        if installed is None:
+            query = libdnf5.rpm.PackageQuery(base)
+            query.filter_installed()
+            query.filter_name(names)
+            installed_names = set(dnf5_pkg.get_name() for dnf5_pkg in query)
+            names = [name for name in names if name in installed_names]
+            timings.lap('probe')
+            if not names:
+                # packages are absent already
+                return [], []
 
         goal = libdnf5.base.Goal(base)
         settings = libdnf5.base.GoalJobSettings()
         settings.set_clean_requirements_on_remove(True)
-        goal.add_rpm_remove(name, settings)
+        for name in names:
+            goal.add_rpm_remove(name, settings)
         transaction = goal.resolve()
-        transaction.run()
+        timings.lap('resolve')
 
-        return True
+        if check_mode:
+            return names, dnf5_changes(transaction)['remove']
+
+        dnf5_run_transaction(transaction, locks)
+        timings.lap('transaction')
+        return names, None
 
     elif manager == 'yum':
-        yb = yum.YumBase()
-        if not yb.rpmdb.searchNevra(name=name):
-            # package is absent already
-            return False
+        yb = yum_base(cache_only, metadata_max_age)
+        timings.lap('load')
 
-        cmd = "yum autoremove -y '{name}'".format(name=name)
-        module.run_command(cmd, check_rc=True, environ_update=ENV_VARS)
-        return True
+        if installed is None:
+            names = [name for name in names if yb.rpmdb.searchNevra(name=name)]
+            timings.lap('probe')
+            if not names:
+                # packages are absent already
+                return [], []
 
-    # else manager not in [ 'apt', 'dnf', 'yum' ]
-    return False
+        # yum autoremove is equivalent to removing with clean_requirements_on_remove
+        yb.conf.clean_requirements_on_remove = True
+        for name in names:
+            yb.remove(name=name)
+        yum_resolve(yb, cache_only)
+        timings.lap('resolve')
+
+        if check_mode:
+            return names, yum_changes(yb)['remove']
+
+        yum_run_transaction(yb, locks)
+        timings.lap('transaction')
+        return names, None
+
+    # else manager not in [ 'apt', 'dnf', 'dnf5', 'yum' ]
+    return [], []
 
 
 def core(module):
     architecture = module.params['architecture']
+    artifact_cache = module.params['artifact_cache']
+    artifact_cache_max_age = module.params['artifact_cache_max_age']
+    artifact_cache_max_size = module.params['artifact_cache_max_size']
+    artifacts = module.params['artifacts']
+    builder = module.params['builder']
+    cache_only = module.params['cache_only']
     conflicts = module.params['conflicts']
     depends = module.params['depends']
     description = module.params['description']
     enhances = module.params['enhances']
     maintainer = module.params['maintainer']
     manager = module.params['manager']
+    lock_timeout = module.params['lock_timeout']
+    metadata_max_age = module.params['metadata_max_age']
     name = module.params['name']
+    packages = module.params['packages']
+    plugins = module.params['plugins']
+    publish_to = module.params['publish_to']
     recommends = module.params['recommends']
+    request_artifacts = module.params['request_artifacts']
+    stamp_dir = module.params['stamp_dir']
     state = module.params['state']
     suggests = module.params['suggests']
     summary = module.params['summary']
     version = module.params['version']
 
-    if not maintainer:
-        pwuid = pwd.getpwuid(os.getuid())
-
-        username = pwuid.pw_name
-
-        if pwuid.pw_gecos:
-            fullname = pwuid.pw_gecos.split(',')[0]
-        else:
-            # fallback to username
-            fullname = username
+    timings = Timings()
+    locks = LockWaiter(lock_timeout, module)
 
-        fqdn = socket.getfqdn()
+    if not maintainer:
+        maintainer = default_maintainer()
 
-        maintainer = '{fullname} <{username}@{fqdn}>'.format(fullname=fullname, username=username, fqdn=fqdn)
+    timings.lap('setup')
 
     if manager == 'auto':
-        # Inspired by https://github.com/ansible/ansible/blob/devel/lib/ansible/modules/setup.py
-        namespace = PrefixFactNamespace(namespace_name='ansible', prefix='ansible_')
-
-        fact_collector = \
-            ansible_collector.get_ansible_collector(all_collector_classes=default_collectors.collectors,
-                                                    namespace=namespace,
-                                                    filter_spec='*',
-                                                    gather_subset=['pkg_mgr'],
-                                                    minimal_gather_subset=frozenset(['pkg_mgr']))
-
-        facts_dict = fact_collector.collect(module=module)
-        manager = facts_dict['ansible_pkg_mgr']
+        manager, detection_source = detect_manager(stamp_dir, module)
+    else:
+        detection_source = 'parameter'
+    timings.lap('detection')
+    detection = dict(source=detection_source, elapsed=timings.phases['detection'])
 
     if manager not in ['apt', 'dnf', 'dnf5', 'yum']:
         raise ValueError('manager %s is not supported' % manager)
 
-    if manager == 'apt' and not HAS_APT:
-        module.fail_json(msg=missing_required_lib("apt"), exception=APT_IMPORT_ERROR)
-
-    if manager in ['dnf', 'dnf5', 'yum'] and not HAS_BABEL:
-        module.fail_json(msg=missing_required_lib("babel"), exception=BABEL_IMPORT_ERROR)
-
-    if manager == 'dnf' and not HAS_DNF:
-        module.fail_json(msg=missing_required_lib("dnf"), exception=DNF_IMPORT_ERROR)
-
-    if manager == 'dnf5' and not HAS_LIBDNF5:
-        module.fail_json(msg=missing_required_lib("libdnf5"), exception=LIBDNF5_IMPORT_ERROR)
-
-    if manager == 'yum' and not HAS_YUM:
-        module.fail_json(msg=missing_required_lib("yum"), exception=YUM_IMPORT_ERROR)
+    # Bindings of rpm are needed to probe installed packages, bindings of the package manager are imported only if the
+    # package manager will actually be used, i.e. not if meta packages are published or have been installed already.
+    if not publish_to:
+        import_rpm(manager)
+        timings.lap('import')
 
     if not architecture:
         if manager == 'apt':
@@ -833,92 +2342,230 @@ def core(module):
         elif manager in ['yum', 'dnf', 'dnf5']:
             architecture = 'noarch'
 
-    if module.check_mode:
-        return dict(
-            changed=False,
-            architecture=architecture,
-            conflicts=conflicts,
-            depends=depends,
-            description=description,
-            enhances=enhances,
-            maintainer=maintainer,
-            manager=manager,
-            name=name,
-            recommends=recommends,
-            state=state,
-            suggests=suggests,
-            summary=summary,
-            version=version)
-
-    if state == 'present':
-        changed, conflicts, depends, enhances, recommends, suggests = install(
-            architecture,
-            conflicts,
-            depends,
-            description,
-            enhances,
-            maintainer,
-            manager,
-            name,
-            recommends,
-            suggests,
-            summary,
-            version,
-            module)
-    elif state == 'absent':
-        changed = remove(
-            manager,
-            name,
-            module)
-
-    return dict(
-        changed=changed,
+    defaults = dict(
         architecture=architecture,
         conflicts=conflicts,
         depends=depends,
         description=description,
         enhances=enhances,
         maintainer=maintainer,
-        manager=manager,
         name=name,
         recommends=recommends,
-        state=state,
         suggests=suggests,
         summary=summary,
         version=version)
 
+    # fields which are not defined in an item of packages default to the module's values
+    pkgs = meta_packages(defaults, packages)
+    names = [pkg['name'] for pkg in pkgs]
+
+    resolved_from = None
+    changes = None
+    timings.lap('setup')
+
+    if publish_to and state == 'present':
+        results = publish(
+            pkgs,
+            publish_to,
+            ArtifactCache(artifact_cache, artifact_cache_max_age, artifact_cache_max_size, module, artifacts),
+            builder,
+            manager,
+            timings,
+            module.check_mode,
+            module)
+        timings.lap('cleanup')
+    elif publish_to and state == 'absent':
+        results = [dict(pkg, changed=changed) for pkg, changed in zip(
+            pkgs, unpublish(names, publish_to, manager, timings, module.check_mode))]
+    elif state == 'present':
+        is_unchanged = stamp_dir and all(is_stamped(stamp_dir, manager, pkg) for pkg in pkgs) and \
+            is_probed(manager, pkgs)
+        timings.lap('stamp')
+
+        if not is_unchanged and request_artifacts and not artifacts and not module.check_mode:
+            # The action plugin will run this module again with meta packages which have been built on the controller.
+            # Maintainer and distribution tag are returned, because the keys of the meta packages depend on them.
+            return dict(changed=False, artifacts_requested=True, maintainer=maintainer,
+                        dist=None if manager == 'apt' else get_rpm_dist(None, module))
+
+        if not is_unchanged:
+            require_bindings(manager, timings, module)
+
+        if is_unchanged:
+            # packages have been installed by this module before and have not been changed since
+            results = [dict(pkg, changed=False) for pkg in pkgs]
+        elif module.check_mode:
+            # Meta packages are built natively and are not stored in the artifact cache, if they are needed to
+            # resolve the transaction at all
+            results, resolved_from, changes = install(
+                pkgs,
+                ArtifactCache(None, artifact_cache_max_age, artifact_cache_max_size, module),
+                'native',
+                manager,
+                plugins,
+                cache_only,
+                metadata_max_age,
+                locks,
+                timings,
+                True,
+                module)
+            timings.lap('cleanup')
+        else:
+            results, resolved_from, changes = install(
+                pkgs,
+                ArtifactCache(artifact_cache, artifact_cache_max_age, artifact_cache_max_size, module, artifacts),
+                builder,
+                manager,
+                plugins,
+                cache_only,
+                metadata_max_age,
+                locks,
+                timings,
+                False,
+                module)
+            timings.lap('cleanup')
+
+            if stamp_dir:
+                for pkg in pkgs:
+                    write_stamp(stamp_dir, manager, pkg, module)
+                timings.lap('stamp')
+    elif state == 'absent':
+        require_bindings(manager, timings, module)
+        removed, would_remove = remove(
+            manager, names, plugins, cache_only, metadata_max_age, locks, timings, module.check_mode, module)
+        results = [dict(pkg, changed=pkg['name'] in removed) for pkg in pkgs]
+
+        if module.check_mode:
+            changes = dict(install=[], remove=would_remove)
+        elif stamp_dir:
+            for pkg in pkgs:
+                remove_stamp(stamp_dir, pkg['name'])
+            timings.lap('stamp')
+
+    changed = any(result['changed'] for result in results)
+
+    # Peak resident set size of this module in kilobytes
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if packages is not None:
+        result = dict(
+            changed=changed,
+            detection=detection,
+            lock_wait=locks.waited,
+            manager=manager,
+            packages=results,
+            peak_rss=peak_rss,
+            resolved_from=resolved_from,
+            state=state,
+            timings=timings.result())
+    else:
+        pkg_result = results[0]
+        result = dict(
+            changed=changed,
+            architecture=pkg_result['architecture'],
+            conflicts=pkg_result['conflicts'],
+            depends=pkg_result['depends'],
+            description=pkg_result['description'],
+            detection=detection,
+            enhances=pkg_result['enhances'],
+            fingerprint=pkg_result['fingerprint'],
+            lock_wait=locks.waited,
+            maintainer=pkg_result['maintainer'],
+            manager=manager,
+            name=pkg_result['name'],
+            peak_rss=peak_rss,
+            recommends=pkg_result['recommends'],
+            resolved_from=resolved_from,
+            state=state,
+            suggests=pkg_result['suggests'],
+            summary=pkg_result['summary'],
+            timings=timings.result(),
+            version=pkg_result['version'])
+
+    if publish_to:
+        result.update(repository=dict(path=publish_to, format='apt' if manager == 'apt' else 'rpm-md'))
+
+    if module.check_mode:
+        changes = changes or dict(install=[], remove=[])
+        result.update(would_install=changes['install'], would_remove=changes['remove'])
+
+    return result
+
 
 def main():
     module = AnsibleModule(
         argument_spec=dict(
             architecture=dict(type='str', aliases=['buildarch']),
+            artifact_cache=dict(type='path', default='/var/cache/jm1-pkg'),
+            artifact_cache_max_age=dict(type='int', default=2592000),
+            artifact_cache_max_size=dict(type='int', default=67108864),
+            artifacts=dict(type='dict', no_log=True),
+            build_on_controller=dict(type='bool', default=True),
+            builder=dict(type='str', choices=['native', 'external'], default='native'),
+            cache_only=dict(type='bool', default=False),
             conflicts=dict(type='list', default=[]),
             depends=dict(type='list', default=[]),
-            description=dict(type='str', default='Package management made easy.'),
+            description=dict(type='str', default=PKG_DEFAULTS['description']),
             enhances=dict(type='list', default=[]),
+            lock_timeout=dict(type='int', default=60),
             maintainer=dict(type='str', aliases=['packager']),
             manager=dict(type='str', choices=['auto', 'apt', 'dnf', 'dnf5', 'yum'], default='auto'),
-            name=dict(required=True, type='str'),
+            metadata_max_age=dict(type='int'),
+            name=dict(type='str'),
+            packages=dict(
+                type='list',
+                elements='dict',
+                options=dict(
+                    architecture=dict(type='str', aliases=['buildarch']),
+                    conflicts=dict(type='list'),
+                    depends=dict(type='list'),
+                    description=dict(type='str'),
+                    enhances=dict(type='list'),
+                    maintainer=dict(type='str', aliases=['packager']),
+                    name=dict(required=True, type='str'),
+                    recommends=dict(type='list'),
+                    suggests=dict(type='list'),
+                    summary=dict(type='str', aliases=['synopsis']),
+                    version=dict(type='str'))),
+            plugins=dict(type='bool', default=False),
+            profile=dict(type='path'),
+            publish_to=dict(type='path'),
             recommends=dict(type='list', default=[]),
+            request_artifacts=dict(type='bool', default=False),
+            stamp_dir=dict(type='path', default='/var/lib/jm1-pkg'),
             state=dict(type='str', choices=['present', 'absent'], default='present'),
             suggests=dict(type='list', default=[]),
-            summary=dict(type='str', aliases=['synopsis'], default='Meta package to simplify package management'),
-            version=dict(type='str', default='1')
+            summary=dict(type='str', aliases=['synopsis'], default=PKG_DEFAULTS['summary']),
+            version=dict(type='str', default=PKG_DEFAULTS['version'])
         ),
+        mutually_exclusive=[('name', 'packages'), ('cache_only', 'metadata_max_age')],
+        required_one_of=[('name', 'packages')],
         supports_check_mode=True,
     )
 
-    if not HAS_APT or not HAS_BABEL or not HAS_DNF or not HAS_LIBDNF5 or not HAS_YUM:
-        pass  # errors handled in def core()
+    # errors of package manager bindings are handled in def core()
 
     if six.PY2 and not HAS_BACKPORTS_TEMPFILE:
         module.fail_json(msg=missing_required_lib("backports.tempfile"), exception=BACKPORTS_TEMPFILE_IMPORT_ERROR)
+    profile = module.params['profile']
+    profiler = cProfile.Profile() if profile else None
+
     try:
+        if profiler:
+            profiler.enable()
         result = core(module)
     except Exception as e:
         module.fail_json(msg=to_native(e), exception=traceback.format_exc())
-    else:
-        module.exit_json(**result)
+    finally:
+        if profiler:
+            # dumped before results are returned, but also if the module failed
+            profiler.disable()
+            try:
+                profiler.dump_stats(profile)
+            except (IOError, OSError) as e:
+                module.warn('profile %s could not be written: %s' % (profile, to_native(e)))
+
+    module.exit_json(**result)
 
 
 if __name__ == '__main__':
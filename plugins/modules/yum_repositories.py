@@ -0,0 +1,360 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# vim:set fileformat=unix shiftwidth=4 softtabstop=4 expandtab:
+# kate: end-of-line unix; space-indent on; indent-width 4; remove-trailing-spaces modified;
+
+# Copyright: (c) 2024, Jakob Meng <jakobmeng@web.de>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = r'''
+---
+
+module: yum_repositories
+
+short_description: Write yum repository definitions in a single pass.
+
+description:
+    - "This module runs a list of tasks for Ansible module C(yum_repository) at once, e.g. tasks in variable
+       C(yum_repository_config) of role C(jm1.pkg.yum_repository). Repository files are read once, changed in memory
+       by all tasks in order and written only if their content hash or attributes differ from the files on disk
+       afterwards. Repository files are written like C(yum_repository) does, i.e. options are sorted and comments are
+       dropped from changed files. Optionally, metadata of repositories which have been changed is downloaded with a
+       single C(makecache) of the package manager, so later runs of the package manager, e.g. of module
+       C(jm1.pkg.meta_pkg) with I(cache_only), do not have to revalidate metadata of these repositories.
+
+       Parameters of tasks follow Ansible's C(yum_repository) module, including common file arguments such as
+       C(attributes), C(selevel), C(serole), C(setype), C(seuser) and C(unsafe_writes). Options of repositories which
+       are not known to this module are rejected."
+
+requirements:
+    - dnf5, dnf or yum [only if I(makecache) is enabled]
+
+options:
+
+    config:
+        description:
+            - "List of tasks to run in order. Each task is a dict with a single key, the name of the module, i.e.
+               C(ansible.builtin.yum_repository) or C(yum_repository), which maps to the module parameters. Keywords
+               such as C(when) are not supported."
+        required: true
+        type: list
+        elements: dict
+
+    makecache:
+        default: false
+        description:
+            - "Whether metadata of enabled repositories which have been changed is downloaded with a single
+               C(dnf5 makecache), C(dnf makecache) or C(yum makecache fast), limited to these repositories. The package
+               manager is chosen by the first of these binaries which is found."
+        type: bool
+
+notes:
+    - "Supports check mode and diff mode. In check mode C(makecache) is skipped, but repositories which would be
+       refreshed are returned in I(makecache)."
+
+author: "Jakob Meng (@jm1)"
+'''
+
+EXAMPLES = r'''
+- jm1.pkg.yum_repositories:
+    config:
+    - ansible.builtin.yum_repository:
+        name: epel
+        description: EPEL YUM repo
+        baseurl: https://download.fedoraproject.org/pub/epel/$releasever/$basearch/
+        gpgkey: https://dl.fedoraproject.org/pub/epel/RPM-GPG-KEY-EPEL-9
+    - ansible.builtin.yum_repository:
+        name: epel-testing
+        file: epel
+        state: absent
+    makecache: true
+  register: result
+
+- jm1.pkg.meta_pkg:
+    name: "developer-tools"
+    depends:
+    - make
+    - gcc
+    cache_only: "{{ result.makecache | length > 0 }}"
+'''
+
+RETURN = r'''
+changed_files:
+    description: Paths of repository files whose content or attributes have been changed, in order of tasks
+    returned: changed or success
+    type: list
+    elements: str
+    sample: [ '/etc/yum.repos.d/epel.repo' ]
+
+makecache:
+    description: Ids of repositories whose metadata has been downloaded, or would have been downloaded in check mode
+    returned: if I(makecache) is enabled
+    type: list
+    elements: str
+    sample: [ 'epel' ]
+
+repositories:
+    description: Id, path of repository file, state and whether the repository has been changed, per task
+    returned: changed or success
+    type: list
+    elements: dict
+    sample: [ { 'name': 'epel', 'file': '/etc/yum.repos.d/epel.repo', 'state': 'present', 'changed': true } ]
+'''
+
+# NOTE: Synchronize imports with DOCUMENTATION string above
+from ansible.module_utils._text import to_native, to_text
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.module_utils.six import StringIO
+from ansible.module_utils.six.moves import configparser
+from ansible_collections.jm1.pkg.plugins.module_utils.files import FILE_ATTRIBUTES, Files
+import os
+import traceback
+
+MODULE_NAMES = ['ansible.builtin.yum_repository', 'ansible.legacy.yum_repository', 'yum_repository']
+
+# Parameters of tasks which are not written as repository options, with their default values
+TASK_PARAMS = dict(
+    attributes=None,
+    description=None,
+    file=None,
+    group=None,
+    mode=None,
+    name=None,
+    owner=None,
+    reposdir='/etc/yum.repos.d',
+    selevel=None,
+    serole=None,
+    setype=None,
+    seuser=None,
+    state='present',
+    unsafe_writes=False,
+)
+
+# Aliases of task parameters
+TASK_PARAM_ALIASES = dict(
+    attr='attributes',
+)
+
+# Repository options which are supported by Ansible's yum_repository module
+BOOL_OPTIONS = [
+    'async', 'countme', 'enabled', 'enablegroups', 'gpgcheck', 'keepalive', 'module_hotfixes', 'protect',
+    'repo_gpgcheck', 's3_enabled', 'skip_if_unavailable', 'ssl_check_cert_permissions', 'sslverify', 'ui_repoid_vars']
+
+# Lists of urls are written one per line, lists of packages are written on a single line
+URL_LIST_OPTIONS = ['baseurl', 'gpgkey']
+
+PACKAGE_LIST_OPTIONS = ['exclude', 'includepkgs']
+
+OPTIONS = BOOL_OPTIONS + URL_LIST_OPTIONS + PACKAGE_LIST_OPTIONS + [
+    'bandwidth', 'cost', 'deltarpm_metadata_percentage', 'deltarpm_percentage', 'failovermethod', 'gpgcakey',
+    'http_caching', 'include', 'ip_resolve', 'keepcache', 'metadata_expire', 'metadata_expire_filter', 'metalink',
+    'mirrorlist', 'mirrorlist_expire', 'password', 'priority', 'proxy', 'proxy_password', 'proxy_username', 'retries',
+    'sslcacert', 'sslclientcert', 'sslclientkey', 'throttle', 'timeout', 'username']
+
+
+def parse_repo_file(text):
+    """Return list of sections of repository file as lists of section name and list of options."""
+    parser = configparser.RawConfigParser()
+    if hasattr(parser, 'read_string'):
+        parser.read_string(text)
+    else:
+        parser.readfp(StringIO(text))
+
+    defaults = parser.defaults()
+    sections = [[configparser.DEFAULTSECT, sorted(defaults.items())]] if defaults else []
+    for section in parser.sections():
+        sections.append([section, [(key, parser.get(section, key)) for key in parser.options(section)
+                                   if key not in defaults or parser.get(section, key) != defaults[key]]])
+    return sections
+
+
+def render_repo_file(sections):
+    """Return repository file like configparser would write it."""
+    lines = []
+    for section, options in sections:
+        lines.append('[%s]\n' % section)
+        for key, value in options:
+            lines.append('%s = %s\n' % (key, value.replace('\n', '\n\t')))
+        lines.append('\n')
+    return ''.join(lines)
+
+
+def repo_options(params, args):
+    """Return sorted list of repository options like yum_repository would write them."""
+    options = []
+    for key, value in args.items():
+        if key in TASK_PARAMS or value is None:
+            continue
+        if key not in OPTIONS:
+            raise ValueError('unsupported parameter %s of module yum_repository' % key)
+
+        if key in BOOL_OPTIONS:
+            value = str(int(boolean(value)))
+        elif key in URL_LIST_OPTIONS and isinstance(value, (list, tuple)):
+            value = '\n'.join(to_text(item) for item in value)
+        elif key in PACKAGE_LIST_OPTIONS and isinstance(value, (list, tuple)):
+            value = ' '.join(to_text(item) for item in value)
+        options.append((key, to_text(value)))
+
+    if params['description'] is not None:
+        # yum_repository writes option name from parameter description
+        options.append(('name', to_text(params['description'])))
+
+    if not any(key in ['baseurl', 'metalink', 'mirrorlist'] for key, value in options):
+        raise ValueError("parameter 'baseurl', 'metalink' or 'mirrorlist' is required")
+    return sorted(options)
+
+
+class RepoFiles(object):
+    """Repository files which are parsed once and changed in memory."""
+
+    def __init__(self, files):
+        self.files = files
+        self.original = dict()
+        self.sections = dict()
+
+    def get(self, path):
+        if path not in self.sections:
+            sections = parse_repo_file(self.files.read_text(path) or '')
+            self.original[path] = [[section, list(options)] for section, options in sections]
+            self.sections[path] = sections
+        return self.sections[path]
+
+    def section(self, path, name):
+        for section, options in self.sections[path]:
+            if section == name:
+                return options
+        return None
+
+    def write(self):
+        """Write repository files with changed sections to files, remove them if no section is left."""
+        for path, sections in self.sections.items():
+            if sections != self.original[path]:
+                self.files.write_text(path, render_repo_file(sections) if sections else None)
+
+
+def yum_repository(args, repo_files):
+    args = dict((TASK_PARAM_ALIASES.get(key, key), value) for key, value in args.items())
+    params = dict(TASK_PARAMS)
+    params.update((key, value) for key, value in args.items() if key in TASK_PARAMS and value is not None)
+
+    name = params['name']
+    if not name:
+        raise ValueError('name is required')
+
+    path = os.path.join(params['reposdir'], '%s.repo' % (params['file'] or name))
+    sections = repo_files.get(path)
+    index = None
+    for position, (section, options) in enumerate(sections):
+        if section == name:
+            index = position
+
+    # like yum_repository, a task changes a repository if its section is added, removed or its options are changed
+    before = None if index is None else sections[index][1]
+
+    if params['state'] == 'absent':
+        if index is not None:
+            del sections[index]
+        return name, path, before is not None
+
+    options = repo_options(params, args)
+    if index is None:
+        sections.append([name, options])
+    else:
+        sections[index][1] = options
+
+    params['unsafe_writes'] = boolean(params['unsafe_writes'])
+    repo_files.files.set_attributes(path, **dict((key, params[key]) for key in FILE_ATTRIBUTES))
+    return name, path, options != before
+
+
+def makecache_command(repos, module):
+    """Return commands which download metadata of repos with the available package manager."""
+    dnf5 = module.get_bin_path('dnf5')
+    if dnf5:
+        return [[dnf5, '-q', '-y', 'makecache'] + ['--repo=%s' % repo for repo in repos]]
+
+    dnf = module.get_bin_path('dnf')
+    if dnf:
+        return [[dnf, '-q', '-y', 'makecache'] + ['--repo=%s' % repo for repo in repos]]
+
+    yum = module.get_bin_path('yum', required=True)
+    # yum caches metadata per repository id only, so cached metadata of changed repositories has to be expired first
+    repo_args = ['--disablerepo=*', '--enablerepo=%s' % ','.join(repos)]
+    return [[yum, '-q', '-y'] + repo_args + ['clean', 'expire-cache'],
+            [yum, '-q', '-y'] + repo_args + ['makecache', 'fast']]
+
+
+def core(module):
+    files = Files(module)
+    repo_files = RepoFiles(files)
+
+    tasks = []
+    for index, item in enumerate(module.params['config']):
+        try:
+            if not isinstance(item, dict) or len(item) != 1:
+                raise ValueError('each task must be a dict with a single module, got: %s' % to_native(item))
+
+            module_name, args = list(item.items())[0]
+            if module_name not in MODULE_NAMES:
+                raise ValueError('module %s is not supported' % module_name)
+
+            name, path, changed = yum_repository(args or {}, repo_files)
+            tasks.append(dict(name=name, file=path, state=(args or {}).get('state') or 'present', changed=changed))
+        except ValueError as e:
+            raise ValueError('config[%d]: %s' % (index, to_native(e)))
+
+    repo_files.write()
+    changed_files = files.commit()
+
+    for task in tasks:
+        options = repo_files.section(task['file'], task['name'])
+        task['enabled'] = options is not None and dict(options).get('enabled', '1') != '0'
+
+    result = dict(changed=bool(changed_files), changed_files=changed_files,
+                  repositories=[dict(name=task['name'], file=task['file'], state=task['state'], changed=task['changed'])
+                                for task in tasks])
+
+    if module.params['makecache']:
+        repos = []
+        for task in tasks:
+            if task['changed'] and task['enabled'] and task['name'] not in repos:
+                repos.append(task['name'])
+
+        if repos and not module.check_mode:
+            for command in makecache_command(repos, module):
+                module.run_command(command, check_rc=True)
+        result['makecache'] = repos
+
+    if module._diff:
+        result['diff'] = files.diffs
+    return result
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            config=dict(type='list', elements='dict', required=True),
+            makecache=dict(type='bool', default=False),
+        ),
+        supports_check_mode=True,
+    )
+
+    try:
+        result = core(module)
+    except Exception as e:
+        module.fail_json(msg=to_native(e), exception=traceback.format_exc())
+
+    module.exit_json(**result)
+
+
+if __name__ == '__main__':
+    main()